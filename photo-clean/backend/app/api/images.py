@@ -1,12 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_db, get_read_db, get_async_read_db
 from app.models.schemas import (
     DeleteRequest, DeleteResponse,
-    RestoreRequest, RestoreResponse
+    RestoreRequest, RestoreResponse,
+    SimilarImagesResponse
 )
 from app.services.image_service import ImageService
+from app.core.hash import get_image_hash_from_bytes
 import logging
 import os
 
@@ -23,10 +27,11 @@ async def preview_image(file_path: str):
     - **file_path**: 图片文件路径
     """
     try:
-        if not os.path.exists(file_path):
+        # 文件系统调用交给线程池，避免慢速存储阻塞事件循环
+        if not await run_in_threadpool(os.path.exists, file_path):
             raise HTTPException(status_code=404, detail="文件不存在")
 
-        if not os.path.isfile(file_path):
+        if not await run_in_threadpool(os.path.isfile, file_path):
             raise HTTPException(status_code=400, detail="不是有效的文件")
 
         # 检查是否是支持的图片格式
@@ -44,6 +49,83 @@ async def preview_image(file_path: str):
         raise HTTPException(status_code=500, detail=f"预览图片失败: {str(e)}")
 
 
+def _validate_similar_params(k: int, max_distance: int):
+    """校验相似查询参数"""
+    if k < 1 or k > 500:
+        raise HTTPException(status_code=400, detail="k 必须在1-500之间")
+
+    if max_distance < 0 or max_distance > 64:
+        raise HTTPException(status_code=400, detail="max_distance 必须在0-64之间")
+
+
+@router.get("/similar", response_model=SimilarImagesResponse)
+async def find_similar_images(
+    file_path: str,
+    k: int = 20,
+    max_distance: int = 10,
+    db: Session = Depends(get_read_db)
+):
+    """
+    查找与指定图片相似的图片
+
+    - **file_path**: 图片文件路径（已扫描的图片直接使用已保存的哈希）
+    - **k**: 返回数量上限（默认20）
+    - **max_distance**: 最大汉明距离（默认10）
+    """
+    try:
+        _validate_similar_params(k, max_distance)
+
+        service = ImageService(db)
+        query = await run_in_threadpool(service.get_query_hash, file_path)
+        if not query:
+            raise HTTPException(status_code=404, detail="文件不存在或无法计算哈希")
+
+        result = await run_in_threadpool(
+            service.find_similar_images,
+            query["hash_value"], k, max_distance, exclude_id=query["image_id"]
+        )
+        return SimilarImagesResponse(**result)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查找相似图片失败: {e}")
+        raise HTTPException(status_code=500, detail=f"查找相似图片失败: {str(e)}")
+
+
+@router.post("/similar", response_model=SimilarImagesResponse)
+async def find_similar_by_upload(
+    file: UploadFile = File(...),
+    k: int = 20,
+    max_distance: int = 10,
+    db: Session = Depends(get_read_db)
+):
+    """
+    上传图片查找相似图片
+
+    - **file**: 查询图片
+    - **k**: 返回数量上限（默认20）
+    - **max_distance**: 最大汉明距离（默认10）
+    """
+    try:
+        _validate_similar_params(k, max_distance)
+
+        data = await file.read()
+        hash_value = await run_in_threadpool(get_image_hash_from_bytes, data)
+        if not hash_value:
+            raise HTTPException(status_code=400, detail="无法识别的图片文件")
+
+        service = ImageService(db)
+        result = await run_in_threadpool(service.find_similar_images, hash_value, k, max_distance)
+        return SimilarImagesResponse(**result)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"查找相似图片失败: {e}")
+        raise HTTPException(status_code=500, detail=f"查找相似图片失败: {str(e)}")
+
+
 @router.post("/delete", response_model=DeleteResponse)
 async def delete_images(
     request: DeleteRequest,
@@ -59,7 +141,7 @@ async def delete_images(
             raise HTTPException(status_code=400, detail="文件路径列表不能为空")
 
         service = ImageService(db)
-        result = service.delete_images(request.file_paths)
+        result = await run_in_threadpool(service.delete_images, request.file_paths)
 
         return DeleteResponse(**result)
 
@@ -85,7 +167,7 @@ async def restore_images(
             raise HTTPException(status_code=400, detail="文件路径列表不能为空")
 
         service = ImageService(db)
-        result = service.restore_images(request.file_paths)
+        result = await run_in_threadpool(service.restore_images, request.file_paths)
 
         return RestoreResponse(**result)
 
@@ -103,7 +185,7 @@ async def clean_trash(db: Session = Depends(get_db)):
     """
     try:
         service = ImageService(db)
-        result = service.clean_trash()
+        result = await run_in_threadpool(service.clean_trash)
         return result
 
     except Exception as e:
@@ -112,13 +194,12 @@ async def clean_trash(db: Session = Depends(get_db)):
 
 
 @router.get("/trash-info")
-async def get_trash_info(db: Session = Depends(get_db)):
+async def get_trash_info(db: AsyncSession = Depends(get_async_read_db)):
     """
     获取回收站信息
     """
     try:
-        service = ImageService(db)
-        result = service.get_trash_info()
+        result = await ImageService.get_trash_info_async(db)
         return result
 
     except Exception as e:
@@ -1,28 +1,70 @@
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import ReadSessionLocal, get_db, get_read_db, get_async_read_db
 from app.models.schemas import (
-    ScanRequest, ScanResponse, ScanProgress
+    ScanRequest, ScanResponse, ScanProgress,
+    ResolveRequest, ResolveProgress
 )
 from app.services.scan_service import ScanService
+from app.services.folder_service import FolderService
+from app.services.resolve_service import KEEP_POLICIES, ResolveService
+from app.core.pipeline import EXECUTOR_BACKENDS
+from app.core.thumbnail import build_contact_sheet
 from app.config import settings
+from typing import Dict, Iterator, Optional
+import csv
+import io
 import logging
+import os
+import orjson
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/scan", tags=["scan"])
 
+# 单张联系表最多包含的缩略图数与像素数
+CONTACT_SHEET_MAX_TILES = 1000
+CONTACT_SHEET_MAX_PIXELS = 4096 * 4096
 
-def run_scan_task(task_id: int, scan_dir: str, recursive: bool, threshold: int, db: Session):
+# 导出格式 -> 媒体类型
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# CSV 导出列（每张图片一行）
+EXPORT_CSV_COLUMNS = [
+    "group_id", "is_keeper", "keeper_distance", "id", "file_path", "file_name",
+    "file_size", "width", "height", "hash_value", "modified_at"
+]
+
+
+def run_scan_task(task_id: int, scan_dir: str, request: ScanRequest, db: Session):
     """后台运行扫描任务"""
     try:
         service = ScanService(db)
         service.scan_and_process(
             task_id=task_id,
             scan_dir=scan_dir,
-            recursive=recursive,
-            threshold=threshold,
-            workers=settings.scan_workers
+            recursive=request.recursive,
+            threshold=request.threshold,
+            workers=settings.scan_workers,
+            cluster_mode=request.cluster_mode or settings.cluster_mode,
+            lsh_bands=request.lsh_bands or settings.lsh_bands,
+            lsh_rows=request.lsh_rows or settings.lsh_rows,
+            capture_window=(
+                settings.capture_window if request.capture_window is None
+                else request.capture_window
+            ),
+            executor=request.executor or settings.scan_executor,
+            fast_hash=settings.fast_hash if request.fast_hash is None else request.fast_hash,
+            rotation_invariant=(
+                settings.rotation_invariant if request.rotation_invariant is None
+                else request.rotation_invariant
+            )
         )
     except Exception as e:
         logger.error(f"扫描任务执行失败: {e}")
@@ -30,6 +72,16 @@ def run_scan_task(task_id: int, scan_dir: str, recursive: bool, threshold: int,
         db.close()
 
 
+def run_resolve_job(job_id: int, db: Session):
+    """后台运行批量处理任务"""
+    try:
+        ResolveService(db).run_job(job_id)
+    except Exception as e:
+        logger.error(f"批量处理任务执行失败: {e}")
+    finally:
+        db.close()
+
+
 @router.post("/start", response_model=ScanResponse)
 async def start_scan(
     request: ScanRequest,
@@ -42,30 +94,52 @@ async def start_scan(
     - **scan_dir**: 要扫描的目录路径（可选，默认使用配置的照片目录）
     - **recursive**: 是否递归扫描子目录
     - **threshold**: 相似度阈值（默认10）
+    - **cluster_mode**: 聚类模式 exact / lsh / online / time（默认使用配置）
+    - **lsh_bands** / **lsh_rows**: 近似模式的分段数与每段比特数
+    - **capture_window**: time 模式的拍摄时间窗口（秒）
+    - **executor**: 解码执行方式 process / thread / hybrid（默认使用配置）
+    - **fast_hash**: 是否使用 EXIF 内嵌缩略图快速计算哈希（默认使用配置）
+    - **rotation_invariant**: 是否将旋转/翻转后的图片视为相似（默认使用配置）
     """
     try:
         # 如果未指定扫描目录，使用配置的默认目录
-        import os
         scan_dir = request.scan_dir if request.scan_dir else settings.photo_dir
 
-        # 验证目录是否存在
-        if not os.path.exists(scan_dir):
+        # 验证目录是否存在（文件系统调用交给线程池，网络存储上可能很慢）
+        if not await run_in_threadpool(os.path.exists, scan_dir):
             raise HTTPException(status_code=400, detail=f"扫描目录不存在: {scan_dir}")
 
-        if not os.path.isdir(scan_dir):
+        if not await run_in_threadpool(os.path.isdir, scan_dir):
             raise HTTPException(status_code=400, detail="路径不是目录")
 
+        if not 1 <= request.threshold <= 64:
+            raise HTTPException(status_code=400, detail="相似度阈值必须在1-64之间")
+
+        if request.capture_window is not None and request.capture_window <= 0:
+            raise HTTPException(status_code=400, detail="拍摄时间窗口必须大于0")
+
+        if request.cluster_mode and request.cluster_mode not in ("exact", "lsh", "online", "time"):
+            raise HTTPException(status_code=400, detail="聚类模式必须是 exact、lsh、online 或 time")
+
+        if request.lsh_bands is not None and request.lsh_bands < 1:
+            raise HTTPException(status_code=400, detail="LSH 分段数必须大于0")
+
+        if request.lsh_rows is not None and not 1 <= request.lsh_rows <= 64:
+            raise HTTPException(status_code=400, detail="LSH 每段比特数必须在1-64之间")
+
+        if request.executor and request.executor not in EXECUTOR_BACKENDS:
+            raise HTTPException(status_code=400, detail="执行方式必须是 process、thread 或 hybrid")
+
         # 创建扫描任务
         service = ScanService(db)
-        task = service.create_scan_task(scan_dir)
+        task = await run_in_threadpool(service.create_scan_task, scan_dir)
 
         # 在后台运行扫描
         background_tasks.add_task(
             run_scan_task,
             task.id,
             scan_dir,
-            request.recursive,
-            request.threshold,
+            request,
             db
         )
 
@@ -83,15 +157,14 @@ async def start_scan(
 
 
 @router.get("/progress/{task_id}", response_model=ScanProgress)
-async def get_scan_progress(task_id: int, db: Session = Depends(get_db)):
+async def get_scan_progress(task_id: int, db: AsyncSession = Depends(get_async_read_db)):
     """
     获取扫描任务进度
 
     - **task_id**: 任务ID
     """
     try:
-        service = ScanService(db)
-        progress = service.get_task_progress(task_id)
+        progress = await ScanService.get_task_progress_async(db, task_id)
 
         if not progress:
             raise HTTPException(status_code=404, detail="任务不存在")
@@ -105,12 +178,15 @@ async def get_scan_progress(task_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"获取进度失败: {str(e)}")
 
 
-@router.get("/groups/{task_id}")
+@router.get("/groups/{task_id}", response_class=ORJSONResponse)
 async def get_similar_groups(
     task_id: int,
     page: int = 1,
     page_size: int = 100,
-    db: Session = Depends(get_db)
+    threshold: Optional[int] = None,
+    folder: Optional[str] = None,
+    include_matrix: bool = False,
+    db: Session = Depends(get_read_db)
 ):
     """
     获取相似图片组（分页）
@@ -118,6 +194,9 @@ async def get_similar_groups(
     - **task_id**: 任务ID
     - **page**: 页码（从1开始）
     - **page_size**: 每页数量（默认100）
+    - **threshold**: 相似度阈值（默认使用扫描时的阈值，调整后无需重新扫描）
+    - **folder**: 只返回有图片位于该文件夹（含子目录）中的组
+    - **include_matrix**: 附带组内完整距离矩阵（默认只返回各图片到建议保留图片的距离）
     """
     try:
         if page < 1:
@@ -126,29 +205,349 @@ async def get_similar_groups(
         if page_size < 1 or page_size > 500:
             raise HTTPException(status_code=400, detail="每页数量必须在1-500之间")
 
-        service = ScanService(db)
-        groups = service.get_similar_groups(task_id)
+        if threshold is not None and (threshold < 1 or threshold > 64):
+            raise HTTPException(status_code=400, detail="相似度阈值必须在1-64之间")
 
-        # 计算分页
-        total_groups = len(groups)
-        total_pages = (total_groups + page_size - 1) // page_size
+        if folder is not None:
+            folder = FolderService.normalize_folder(folder)
 
-        # 获取当前页数据
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        page_groups = groups[start_idx:end_idx]
+        # 分组计算可能耗时较长，放到线程池中执行，不阻塞事件循环
+        service = ScanService(db)
+        if threshold is None:
+            threshold = await run_in_threadpool(service.get_default_threshold, task_id)
+        # 分组以图片ID数组保存，只为当前页加载图片记录
+        total_groups, page_groups = await run_in_threadpool(
+            service.get_similar_groups_page, task_id, threshold, page, page_size, folder, include_matrix
+        )
+        total_pages = (total_groups + page_size - 1) // page_size
 
-        return {
+        # 直接返回 orjson 响应，跳过 jsonable_encoder 对每个字段的逐一转换
+        return ORJSONResponse({
             "task_id": task_id,
             "total_groups": total_groups,
             "total_pages": total_pages,
             "current_page": page,
             "page_size": page_size,
+            "threshold": threshold,
+            "folder": folder,
             "groups": page_groups
-        }
+        })
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"获取相似图片组失败: {e}")
         raise HTTPException(status_code=500, detail=f"获取相似图片组失败: {str(e)}")
+
+
+@router.get("/groups/{task_id}/folders", response_class=ORJSONResponse)
+async def get_folder_stats(
+    task_id: int,
+    parent: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    获取各文件夹的重复统计（扫描阈值下，删除图片后增量更新）
+
+    - **task_id**: 任务ID
+    - **parent**: 只返回该文件夹的直接子文件夹（默认返回全部文件夹）
+    """
+    try:
+        folders = await FolderService.get_folder_stats_async(db, task_id, parent)
+        return ORJSONResponse({"task_id": task_id, "parent": parent, "folders": folders})
+
+    except Exception as e:
+        logger.error(f"获取文件夹统计失败: {e}")
+        raise HTTPException(status_code=500, detail=f"获取文件夹统计失败: {str(e)}")
+
+
+def _export_rows(group: Dict) -> Iterator[list]:
+    """相似组对应的 CSV 行"""
+    scores = group["similarity_scores"] or {}
+    distances = dict(zip(scores.get("image_ids", []), scores.get("keeper_distances", [])))
+    for image in group["images"]:
+        yield [
+            group["group_id"], int(image["id"] == group["keeper_id"]), distances.get(image["id"]),
+            *(image[column] for column in EXPORT_CSV_COLUMNS[3:])
+        ]
+
+
+def _iter_export(task_id: int, threshold: Optional[int], export_format: str) -> Iterator[bytes]:
+    """
+    逐块生成导出内容
+
+    使用独立的只读会话，分组按块从数据库加载，内存占用与结果总量无关。
+    """
+    db = ReadSessionLocal()
+    try:
+        groups = ScanService(db).iter_similar_groups(task_id, threshold)
+        if export_format == "ndjson":
+            for group in groups:
+                yield orjson.dumps(group) + b"\n"
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+        for group in groups:
+            writer.writerows(_export_rows(group))
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+
+@router.get("/groups/{task_id}/export")
+async def export_similar_groups(
+    task_id: int,
+    format: str = "ndjson",
+    threshold: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    流式导出任务的全部相似组，供离线审阅
+
+    - **task_id**: 任务ID
+    - **format**: ndjson（每行一个组，与分组接口的组结构相同）或 csv（每行一张图片）
+    - **threshold**: 相似度阈值（默认使用扫描时的阈值）
+    """
+    try:
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail="导出格式必须是 ndjson 或 csv")
+
+        if threshold is not None and (threshold < 1 or threshold > 64):
+            raise HTTPException(status_code=400, detail="相似度阈值必须在1-64之间")
+
+        if threshold is None:
+            threshold = await run_in_threadpool(ScanService(db).get_default_threshold, task_id)
+
+        # 同步生成器由 StreamingResponse 放到线程池中迭代，不阻塞事件循环
+        return StreamingResponse(
+            _iter_export(task_id, threshold, format),
+            media_type=EXPORT_FORMATS[format],
+            headers={
+                "Content-Disposition": f'attachment; filename="task_{task_id}_groups.{format}"'
+            }
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"导出相似图片组失败: {e}")
+        raise HTTPException(status_code=500, detail=f"导出相似图片组失败: {str(e)}")
+
+
+async def _build_group_contact_sheet(
+    db: Session,
+    task_id: int,
+    page: int,
+    page_size: int,
+    threshold: Optional[int],
+    group_id: Optional[int],
+    tile_size: int,
+    columns: int,
+    render: bool
+):
+    """
+    校验参数、选出相似组并生成联系表（两个联系表接口共用）
+
+    Returns:
+        (阈值, 选中的相似组, JPEG 数据, 布局)
+    """
+    if page < 1:
+        raise HTTPException(status_code=400, detail="页码必须大于0")
+
+    if page_size < 1 or page_size > 100:
+        raise HTTPException(status_code=400, detail="每页数量必须在1-100之间")
+
+    if threshold is not None and (threshold < 1 or threshold > 64):
+        raise HTTPException(status_code=400, detail="相似度阈值必须在1-64之间")
+
+    if tile_size < 64 or tile_size > 512:
+        raise HTTPException(status_code=400, detail="缩略图尺寸必须在64-512之间")
+
+    if columns < 1 or columns > 32:
+        raise HTTPException(status_code=400, detail="每行格子数必须在1-32之间")
+
+    service = ScanService(db)
+    if threshold is None:
+        threshold = await run_in_threadpool(service.get_default_threshold, task_id)
+    if group_id is not None:
+        group = await run_in_threadpool(service.get_similar_group, task_id, threshold, group_id)
+        if group is None:
+            raise HTTPException(status_code=404, detail="相似组不存在")
+        selected = [group]
+    else:
+        _, selected = await run_in_threadpool(
+            service.get_similar_groups_page, task_id, threshold, page, page_size
+        )
+
+    # 解码缩放和拼接都是 CPU 密集操作，放到线程池中执行
+    image, layout = await run_in_threadpool(
+        build_contact_sheet, selected, tile_size, columns, settings.thumbnail_dir,
+        CONTACT_SHEET_MAX_TILES, CONTACT_SHEET_MAX_PIXELS, settings.scan_workers, render
+    )
+    return threshold, selected, image, layout
+
+
+@router.get("/groups/{task_id}/contact-sheet")
+async def get_group_contact_sheet(
+    request: Request,
+    task_id: int,
+    page: int = 1,
+    page_size: int = 20,
+    threshold: Optional[int] = None,
+    group_id: Optional[int] = None,
+    tile_size: int = 160,
+    columns: int = 8,
+    db: Session = Depends(get_read_db)
+):
+    """
+    获取一页相似组（或单个组）的缩略图联系表布局
+
+    返回每张图片在联系表中的坐标，以及联系表 JPEG 的地址（image_url，
+    同样参数的 /contact-sheet/image 接口，直接返回二进制图片）。
+    前端按坐标裁剪显示，无需逐张请求预览图。缩略图按文件大小和修改时间缓存。
+    联系表的高度和总像素数有上限，超出的图片不放入联系表（truncated 为 true）。
+
+    - **task_id**: 任务ID
+    - **page**: 页码（从1开始）
+    - **page_size**: 每页组数（默认20）
+    - **threshold**: 相似度阈值（默认使用扫描时的阈值）
+    - **group_id**: 指定单个组，设置后忽略分页
+    - **tile_size**: 缩略图格子边长（64-512像素）
+    - **columns**: 每行格子数（1-32）
+    """
+    try:
+        threshold, selected, _, layout = await _build_group_contact_sheet(
+            db, task_id, page, page_size, threshold, group_id, tile_size, columns, render=False
+        )
+        image_url = f"{request.url.path}/image"
+        if request.url.query:
+            image_url += f"?{request.url.query}"
+
+        return {
+            "task_id": task_id,
+            "current_page": page,
+            "threshold": threshold,
+            "group_ids": [group["group_id"] for group in selected],
+            "image_url": image_url if layout["tiles"] else None,
+            **layout
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"生成联系表失败: {e}")
+        raise HTTPException(status_code=500, detail=f"生成联系表失败: {str(e)}")
+
+
+@router.get("/groups/{task_id}/contact-sheet/image")
+async def get_group_contact_sheet_image(
+    task_id: int,
+    page: int = 1,
+    page_size: int = 20,
+    threshold: Optional[int] = None,
+    group_id: Optional[int] = None,
+    tile_size: int = 160,
+    columns: int = 8,
+    db: Session = Depends(get_read_db)
+):
+    """
+    获取联系表 JPEG（二进制），参数与布局接口相同，布局由 /contact-sheet 返回
+    """
+    try:
+        _, _, image, _ = await _build_group_contact_sheet(
+            db, task_id, page, page_size, threshold, group_id, tile_size, columns, render=True
+        )
+        if image is None:
+            raise HTTPException(status_code=404, detail="联系表中没有图片")
+
+        return Response(content=image, media_type="image/jpeg")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"生成联系表失败: {e}")
+        raise HTTPException(status_code=500, detail=f"生成联系表失败: {str(e)}")
+
+
+@router.post("/groups/{task_id}/resolve")
+async def resolve_groups(
+    task_id: int,
+    request: ResolveRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
+    """
+    按保留策略批量处理任务的全部相似组，每组保留一张图片，其余移到回收站
+
+    - **task_id**: 扫描任务ID
+    - **policy**: 保留策略 suggested（建议保留）/ highest_resolution / largest_file / oldest / newest
+    - **threshold**: 相似度阈值（默认使用扫描时的阈值）
+    - **dry_run**: 只返回统计和部分明细，不移动文件
+    - **batch_size**: 每批移到回收站的文件数
+    """
+    try:
+        if request.policy not in KEEP_POLICIES:
+            raise HTTPException(
+                status_code=400, detail=f"保留策略必须是 {'、'.join(KEEP_POLICIES)} 之一"
+            )
+
+        if request.threshold is not None and (request.threshold < 1 or request.threshold > 64):
+            raise HTTPException(status_code=400, detail="相似度阈值必须在1-64之间")
+
+        if request.batch_size < 1 or request.batch_size > 10000:
+            raise HTTPException(status_code=400, detail="每批数量必须在1-10000之间")
+
+        scan_service = ScanService(db)
+        task = await run_in_threadpool(scan_service.get_task_progress, task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        if task["status"] != "completed":
+            raise HTTPException(status_code=400, detail="扫描任务尚未完成")
+
+        threshold = request.threshold
+        if threshold is None:
+            threshold = await run_in_threadpool(scan_service.get_default_threshold, task_id)
+
+        service = ResolveService(db)
+        if request.dry_run:
+            return await run_in_threadpool(service.summarize, task_id, request.policy, threshold)
+
+        job = await run_in_threadpool(
+            service.create_job, task_id, request.policy, threshold, request.batch_size
+        )
+        background_tasks.add_task(run_resolve_job, job.id, db)
+
+        return {"job_id": job.id, "status": "running", "message": "批量处理任务已启动"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"启动批量处理失败: {e}")
+        raise HTTPException(status_code=500, detail=f"启动批量处理失败: {str(e)}")
+
+
+@router.get("/resolve/{job_id}", response_model=ResolveProgress)
+async def get_resolve_progress(job_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    """
+    获取批量处理任务进度
+
+    - **job_id**: 批量处理任务ID
+    """
+    try:
+        progress = await ResolveService.get_job_progress_async(db, job_id)
+        if not progress:
+            raise HTTPException(status_code=404, detail="批量处理任务不存在")
+
+        return ResolveProgress(**progress)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取批量处理进度失败: {e}")
+        raise HTTPException(status_code=500, detail=f"获取批量处理进度失败: {str(e)}")
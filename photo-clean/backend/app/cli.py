@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _scan(args) -> int:
+    """
+    扫描目录并分组，不经过 Web 服务
+
+    进度逐行输出到标准输出，日志输出到标准错误；结束时输出一行 JSON 摘要，
+    扫描失败时退出码为 1，便于 cron 或群晖任务计划判断结果。
+    """
+    scan_dir = os.path.abspath(args.scan_dir or settings.photo_dir)
+    if not os.path.isdir(scan_dir):
+        logger.error(f"扫描目录不存在或不是目录: {scan_dir}")
+        return 2
+
+    # 导入数据库模块时才会创建主数据库
+    from app.database import SessionLocal
+    from app.core.pipeline import shutdown_worker_pools
+    from app.services.scan_service import ScanService
+
+    def report(processed: int, total: int):
+        print(f"progress {processed}/{total}", flush=True)
+
+    started = time.monotonic()
+    db = SessionLocal()
+    try:
+        service = ScanService(db)
+        task_id = service.create_scan_task(scan_dir).id
+        try:
+            service.scan_and_process(
+                task_id=task_id,
+                scan_dir=scan_dir,
+                recursive=not args.no_recursive,
+                threshold=args.threshold,
+                workers=args.workers,
+                cluster_mode=args.cluster_mode,
+                lsh_bands=args.lsh_bands,
+                lsh_rows=args.lsh_rows,
+                executor=args.executor,
+                fast_hash=args.fast_hash,
+                rotation_invariant=args.rotation_invariant,
+                progress_callback=None if args.quiet else report,
+                capture_window=args.capture_window
+            )
+        except Exception:
+            # 失败原因已记录日志，任务状态已置为 failed
+            pass
+        summary = service.get_task_progress(task_id)
+    finally:
+        db.close()
+        shutdown_worker_pools()
+
+    summary["scan_dir"] = scan_dir
+    summary["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    print(json.dumps(summary, ensure_ascii=False), flush=True)
+    return 0 if summary["status"] == "completed" else 1
+
+
+def _reconcile(args) -> int:
+    """只遍历目录，清除文件已不存在的图片记录并重建哈希索引，不计算哈希"""
+    scan_dir = os.path.abspath(args.scan_dir or settings.photo_dir)
+    if not os.path.isdir(scan_dir):
+        logger.error(f"扫描目录不存在或不是目录: {scan_dir}")
+        return 2
+
+    from app.core.scanner import scan_directory
+    from app.database import SessionLocal
+    from app.services.scan_service import ScanService
+
+    recursive = not args.no_recursive
+    unreadable_dirs = []
+    walked_files = scan_directory(scan_dir, recursive, errors=unreadable_dirs)
+    if not walked_files:
+        # 目录为空多半是存储未挂载，不据此清除记录
+        logger.error(f"目录中没有图片文件，跳过核对: {scan_dir}")
+        return 1
+
+    db = SessionLocal()
+    try:
+        service = ScanService(db)
+        purged = service.reconcile_missing(scan_dir, recursive, walked_files, unreadable_dirs)
+        if purged:
+            service.rebuild_hash_index()
+    finally:
+        db.close()
+
+    print(json.dumps({
+        "scan_dir": scan_dir,
+        "walked_files": len(walked_files),
+        "unreadable_dirs": len(unreadable_dirs),
+        "purged": purged
+    }), flush=True)
+    return 0
+
+
+def _shard_worker(args) -> int:
+    """计算一个分片的哈希并写入分片索引文件，不访问主数据库"""
+    from app.core.pipeline import shutdown_worker_pools
+    from app.core.shard import write_partial_index
+
+    try:
+        write_partial_index(
+            args.output,
+            os.path.abspath(args.root),
+            args.shard,
+            args.shards,
+            workers=args.workers,
+            executor=args.executor,
+            recursive=not args.no_recursive,
+            fast_hash=args.fast_hash,
+            variants=args.rotation_invariant
+        )
+    finally:
+        shutdown_worker_pools()
+    return 0
+
+
+def _merge(args) -> int:
+    """合并分片索引到主数据库并分组"""
+    # 导入数据库模块时才会创建主数据库，工作节点无需访问
+    from app.database import SessionLocal
+    from app.core.pipeline import shutdown_worker_pools
+    from app.services.scan_service import ScanService
+
+    root = os.path.abspath(args.root)
+    db = SessionLocal()
+    try:
+        service = ScanService(db)
+        task_id = service.create_scan_task(root).id
+        result = service.merge_partial_indexes(
+            task_id,
+            args.partials,
+            root,
+            threshold=args.threshold,
+            cluster_mode=args.cluster_mode,
+            lsh_bands=args.lsh_bands,
+            lsh_rows=args.lsh_rows,
+            executor=args.executor,
+            workers=args.workers,
+            capture_window=args.capture_window
+        )
+    finally:
+        db.close()
+        shutdown_worker_pools()
+
+    print(f"任务 {task_id}: {result['total_files']} 个文件, {result['similar_groups']} 个相似图片组")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="相似图片清理命令行工具")
+    parser.add_argument("--quiet", action="store_true", help="只输出警告与错误日志，扫描时不输出进度")
+    # 子命令同样接受 --quiet（写在子命令之后）；默认值不覆盖主命令上的设置
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--quiet", action="store_true", default=argparse.SUPPRESS, help="只输出警告与错误日志，扫描时不输出进度"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", parents=[common], help="扫描目录并查找相似图片（适合定时任务）")
+    scan.add_argument("scan_dir", nargs="?", help="扫描目录（默认使用配置的照片目录）")
+    scan.add_argument("--no-recursive", action="store_true", help="不扫描子目录")
+    scan.add_argument("--threshold", type=int, default=settings.similarity_threshold, help="相似度阈值（1-64）")
+    scan.add_argument(
+        "--cluster-mode", choices=["exact", "lsh", "online", "time"], default=settings.cluster_mode,
+        help="聚类模式"
+    )
+    scan.add_argument(
+        "--capture-window", type=int, default=settings.capture_window, help="time 模式的拍摄时间窗口（秒）"
+    )
+    scan.add_argument("--lsh-bands", type=int, default=settings.lsh_bands, help="lsh 模式的分段数")
+    scan.add_argument("--lsh-rows", type=int, default=settings.lsh_rows, help="lsh 模式每段采样的比特数（1-64）")
+    scan.add_argument("--workers", type=int, default=settings.scan_workers, help="工作进程/线程数")
+    scan.add_argument(
+        "--executor", choices=["process", "thread", "hybrid"], default=settings.scan_executor,
+        help="解码执行方式"
+    )
+    scan.add_argument(
+        "--fast-hash", action=argparse.BooleanOptionalAction, default=settings.fast_hash,
+        help="优先使用 EXIF 缩略图计算哈希"
+    )
+    scan.add_argument(
+        "--rotation-invariant", action=argparse.BooleanOptionalAction, default=settings.rotation_invariant,
+        help="将旋转/翻转后的图片视为相似"
+    )
+    scan.set_defaults(handler=_scan)
+
+    reconcile = subparsers.add_parser(
+        "reconcile", parents=[common], help="清除文件已不存在的图片记录（不计算哈希）"
+    )
+    reconcile.add_argument("scan_dir", nargs="?", help="核对的目录（默认使用配置的照片目录）")
+    reconcile.add_argument("--no-recursive", action="store_true", help="只核对目录下的直接文件")
+    reconcile.set_defaults(handler=_reconcile)
+
+    worker = subparsers.add_parser(
+        "shard-worker", parents=[common], help="计算一个分片的哈希，写入独立的分片索引文件"
+    )
+    worker.add_argument("--root", required=True, help="扫描根目录（本机挂载点）")
+    worker.add_argument("--shard", type=int, required=True, help="分片序号（0 起）")
+    worker.add_argument("--shards", type=int, required=True, help="分片总数")
+    worker.add_argument("--output", required=True, help="分片索引文件路径")
+    worker.add_argument("--workers", type=int, default=settings.scan_workers, help="工作进程/线程数")
+    worker.add_argument(
+        "--executor", choices=["process", "thread", "hybrid"], default=settings.scan_executor,
+        help="解码执行方式"
+    )
+    worker.add_argument("--no-recursive", action="store_true", help="不扫描子目录")
+    worker.add_argument(
+        "--fast-hash", action="store_true", default=settings.fast_hash, help="优先使用 EXIF 缩略图计算哈希"
+    )
+    worker.add_argument(
+        "--rotation-invariant", action="store_true", default=settings.rotation_invariant,
+        help="计算旋转/翻转变体哈希（合并时所有分片须一致）"
+    )
+    worker.set_defaults(handler=_shard_worker)
+
+    merge = subparsers.add_parser("merge", parents=[common], help="合并分片索引到主数据库并分组")
+    merge.add_argument("partials", nargs="+", help="分片索引文件")
+    merge.add_argument("--root", required=True, help="本机上的扫描根目录，分片中的相对路径映射到其下")
+    merge.add_argument("--threshold", type=int, default=settings.similarity_threshold, help="相似度阈值（1-64）")
+    merge.add_argument(
+        "--cluster-mode", choices=["exact", "lsh", "time"], default="exact", help="相似边计算方式"
+    )
+    merge.add_argument(
+        "--capture-window", type=int, default=settings.capture_window, help="time 模式的拍摄时间窗口（秒）"
+    )
+    merge.add_argument("--lsh-bands", type=int, default=settings.lsh_bands, help="lsh 模式的分段数")
+    merge.add_argument("--lsh-rows", type=int, default=settings.lsh_rows, help="lsh 模式每段采样的比特数（1-64）")
+    merge.add_argument("--workers", type=int, default=settings.scan_workers, help="快速哈希确认时的工作进程数")
+    merge.add_argument(
+        "--executor", choices=["process", "thread", "hybrid"], default=settings.scan_executor,
+        help="快速哈希确认时的解码执行方式"
+    )
+    merge.set_defaults(handler=_merge)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if args.command == "shard-worker" and not 0 <= args.shard < args.shards:
+        logger.error(f"分片序号必须在 0-{args.shards - 1} 之间")
+        return 2
+    if args.command in ("scan", "merge"):
+        if not 1 <= args.threshold <= 64:
+            logger.error("相似度阈值必须在1-64之间")
+            return 2
+        if args.lsh_bands < 1:
+            logger.error("LSH 分段数必须大于0")
+            return 2
+        if args.capture_window <= 0:
+            logger.error("拍摄时间窗口必须大于0")
+            return 2
+        if not 1 <= args.lsh_rows <= 64:
+            logger.error("LSH 每段比特数必须在1-64之间")
+            return 2
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
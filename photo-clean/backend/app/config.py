@@ -14,13 +14,57 @@ class Settings(BaseSettings):
     photo_dir: str = os.getenv("PHOTO_DIR", "/data/photo")
     trash_dir: str = os.getenv("TRASH_DIR", "/data/trash")
     db_path: str = os.getenv("DB_PATH", "/data/db/photo_clean.db")
+    # SQLite 调优：页缓存（KiB）、内存映射（MB）、锁等待（毫秒）与只读连接池大小
+    db_cache_kb: int = int(os.getenv("DB_CACHE_KB", "65536"))
+    db_mmap_mb: int = int(os.getenv("DB_MMAP_MB", "256"))
+    db_busy_timeout_ms: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    db_read_pool_size: int = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+    index_path: str = os.getenv("INDEX_PATH", "/data/db/photo_clean.idx")
+    variant_index_path: str = os.getenv("VARIANT_INDEX_PATH", "/data/db/photo_clean.variants.idx")
+    edge_dir: str = os.getenv("EDGE_DIR", "/data/db/edges")
+    thumbnail_dir: str = os.getenv("THUMBNAIL_DIR", "/data/db/thumbs")
 
     # 算法配置
     similarity_threshold: int = int(os.getenv("SIMILARITY_THRESHOLD", "10"))
     scan_workers: int = int(os.getenv("SCAN_WORKERS", "4"))
+    # 解码执行方式：process 进程池，thread 线程池，
+    # hybrid 按目录/inode 顺序预读文件并经共享内存交给解码进程（适合机械硬盘）
+    scan_executor: str = os.getenv("SCAN_EXECUTOR", "process")
+    prefetch_threads: int = int(os.getenv("PREFETCH_THREADS", "2"))
+    # 单个文件的解码时间预算（秒）与工作进程内存上限（MB），0 表示不限制
+    decode_timeout: int = int(os.getenv("DECODE_TIMEOUT", "60"))
+    worker_memory_mb: int = int(os.getenv("WORKER_MEMORY_MB", "2048"))
+    # 每个工作进程处理多少个文件后回收，0 表示不回收
+    worker_max_tasks: int = int(os.getenv("WORKER_MAX_TASKS", "500"))
+    # 快速哈希：优先对 EXIF 内嵌缩略图计算哈希，
+    # 距离落在阈值 ± FAST_HASH_MARGIN 内的组对再完整解码确认
+    fast_hash: bool = os.getenv("FAST_HASH", "false").lower() == "true"
+    fast_hash_margin: int = int(os.getenv("FAST_HASH_MARGIN", "4"))
+    # 旋转/翻转不敏感：计算 8 种变体哈希，旋转过的照片与镜像自拍也能归为一组
+    rotation_invariant: bool = os.getenv("ROTATION_INVARIANT", "false").lower() == "true"
+    # 相似边收录的最大汉明距离，不超过此值+1的阈值都可免扫描重新分组
+    edge_max_distance: int = int(os.getenv("EDGE_MAX_DISTANCE", "16"))
+    # 聚类模式：exact 精确比较，lsh 近似比特采样（适合超大图库），
+    # online 边扫描边聚类（扫描过程中即可查看已发现的组），
+    # time 只比较拍摄时间相近的图片（另有全局完全相同哈希匹配）
+    cluster_mode: str = os.getenv("CLUSTER_MODE", "exact")
+    # time 模式的拍摄时间窗口（秒）
+    capture_window: int = int(os.getenv("CAPTURE_WINDOW", "3600"))
+    # LSH 分段数与每段采样比特数：bands 越大召回越高，rows 越大候选越少
+    lsh_bands: int = int(os.getenv("LSH_BANDS", "32"))
+    lsh_rows: int = int(os.getenv("LSH_ROWS", "16"))
+    # 哈希索引是否附带分段多重索引（加速小半径查询，文件约增大一倍）
+    index_multi_index: bool = os.getenv("INDEX_MULTI_INDEX", "true").lower() == "true"
+
+    # 分组列表与导出响应超过该字节数时压缩（gzip，安装 brotli-asgi 后支持 br）
+    compress_min_size: int = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
 
     # 回收站配置
     trash_retention_days: int = int(os.getenv("TRASH_RETENTION_DAYS", "30"))
+    # 按卷放置回收站：照片与 TRASH_DIR 不在同一卷时，移到照片所在卷挂载点下的
+    # VOLUME_TRASH_DIRNAME 目录，删除只需一次 rename 而不是跨卷复制
+    volume_trash: bool = os.getenv("VOLUME_TRASH", "true").lower() == "true"
+    volume_trash_dirname: str = os.getenv("VOLUME_TRASH_DIRNAME", ".photo_clean_trash")
 
     # 支持的图片格式
     supported_formats: tuple = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
@@ -0,0 +1,151 @@
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.core.similarity import group_arrays_from_edges, groups_from_edges
+
+logger = logging.getLogger(__name__)
+
+# 相似边文件格式：
+#   头部 | magic(8) version(I) max_distance(I) count(Q)
+#   src  | uint32[count]，起点图片ID
+#   dst  | uint32[count]，终点图片ID
+#   dist | uint8[count]，汉明距离，整个文件按距离升序排列
+EDGE_MAGIC = b"PCEDGE01"
+EDGE_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQ")
+
+
+class EdgeStore:
+    """基于 mmap 的只读相似边列表，可在任意不超过 max_distance 的阈值下重新分组"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, max_distance, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != EDGE_MAGIC or version != EDGE_VERSION:
+            self._mmap.close()
+            raise ValueError(f"无效的相似边文件: {path}")
+
+        self.max_distance = max_distance
+        self.count = count
+
+        offset = _HEADER.size
+        self.src = np.frombuffer(self._mmap, dtype="<u4", count=count, offset=offset)
+        offset += 4 * count
+        self.dst = np.frombuffer(self._mmap, dtype="<u4", count=count, offset=offset)
+        offset += 4 * count
+        self.distances = np.frombuffer(self._mmap, dtype="u1", count=count, offset=offset)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def supports(self, threshold: int) -> bool:
+        """该边列表能否精确重建给定阈值下的分组"""
+        return threshold - 1 <= self.max_distance
+
+    def edges_below(self, threshold: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回距离小于 threshold 的边（按距离排序，因此是文件的前缀）"""
+        end = int(np.searchsorted(self.distances, threshold, side="left"))
+        return self.src[:end], self.dst[:end], self.distances[:end]
+
+    def groups(self, threshold: int) -> List[List[int]]:
+        """
+        按阈值重新分组
+
+        Args:
+            threshold: 相似度阈值，汉明距离小于此值视为相似
+
+        Returns:
+            相似图片组列表，每组为图片ID
+        """
+        src, dst, _ = self.edges_below(threshold)
+        return groups_from_edges(src, dst)
+
+    def group_arrays(self, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+        """按阈值重新分组，返回 (members, offsets) 紧凑数组"""
+        src, dst, _ = self.edges_below(threshold)
+        return group_arrays_from_edges(src, dst)
+
+
+def write_edge_store(
+    path: str,
+    src_ids: np.ndarray,
+    dst_ids: np.ndarray,
+    distances: np.ndarray,
+    max_distance: int
+) -> int:
+    """
+    原子地写入相似边文件
+
+    Args:
+        path: 文件路径
+        src_ids: 起点图片ID
+        dst_ids: 终点图片ID
+        distances: 汉明距离
+        max_distance: 收录的最大汉明距离（包含）
+
+    Returns:
+        写入的边数
+    """
+    distances = np.asarray(distances, dtype="u1")
+    order = np.argsort(distances, kind="stable")
+    src_ids = np.asarray(src_ids, dtype="<u4")[order]
+    dst_ids = np.asarray(dst_ids, dtype="<u4")[order]
+    distances = distances[order]
+    count = len(distances)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(EDGE_MAGIC, EDGE_VERSION, max_distance, count))
+        f.write(src_ids.tobytes())
+        f.write(dst_ids.tobytes())
+        f.write(distances.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    logger.info(f"相似边已写入: {path}, 共 {count} 条, 最大距离 {max_distance}")
+    return count
+
+
+# 已打开的相似边缓存：路径 -> ((inode, mtime, size), 边列表)
+_edge_cache: Dict[str, Tuple[tuple, EdgeStore]] = {}
+
+
+def load_edge_store(path: str) -> Optional[EdgeStore]:
+    """
+    打开（或复用已打开的）相似边文件
+
+    Returns:
+        EdgeStore，文件不存在或损坏时返回 None
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _edge_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    try:
+        store = EdgeStore(path)
+    except (ValueError, OSError, struct.error) as e:
+        logger.error(f"打开相似边文件失败: {path}, 错误: {e}")
+        return None
+
+    _edge_cache[path] = (key, store)
+    return store
@@ -1,10 +1,65 @@
 import imagehash
-from PIL import Image
-from typing import Optional
+import numpy as np
+from PIL import Image, ExifTags
+from typing import List, Optional, Tuple, Union, BinaryIO
+import hashlib
+import io
+from datetime import datetime
+import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 哈希来源：完整解码主图，或 EXIF 内嵌缩略图
+HASH_SOURCE_FULL = "full"
+HASH_SOURCE_THUMBNAIL = "thumbnail"
+
+# 二面体群的变换数（4 种旋转 x 是否翻转）
+VARIANT_COUNT = 8
+
+# 部分摘要读取的首尾字节数
+DIGEST_CHUNK = 16 * 1024
+
+# EXIF IFD1 中缩略图数据的偏移与长度标签
+_TAG_THUMBNAIL_OFFSET = 0x0201
+_TAG_THUMBNAIL_LENGTH = 0x0202
+
+# EXIF 子 IFD 中的拍摄时间（DateTimeOriginal）与其亚秒部分，缺失时退回数字化时间
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TAG_DATETIME_DIGITIZED = 0x9004
+_TAG_SUBSEC_ORIGINAL = 0x9291
+
+
+def partial_digest(source: Union[str, bytes, memoryview]) -> str:
+    """
+    文件的部分摘要：文件大小与首尾各 DIGEST_CHUNK 字节的 BLAKE2b
+
+    只读取少量字节，用于识别被移动或复制到其他位置的同一文件。
+
+    Args:
+        source: 文件路径，或完整的文件内容
+
+    Returns:
+        32 位十六进制摘要
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read(DIGEST_CHUNK)
+            tail = b""
+            if size > DIGEST_CHUNK:
+                f.seek(max(size - DIGEST_CHUNK, DIGEST_CHUNK))
+                tail = f.read(DIGEST_CHUNK)
+    else:
+        size = len(source)
+        head = bytes(source[:DIGEST_CHUNK])
+        tail = bytes(source[max(size - DIGEST_CHUNK, DIGEST_CHUNK):])
+
+    digest = hashlib.blake2b(size.to_bytes(8, "little"), digest_size=16)
+    digest.update(head)
+    digest.update(tail)
+    return digest.hexdigest()
+
 
 def get_image_hash(image_path: str, hash_size: int = 8) -> Optional[str]:
     """
@@ -27,6 +82,26 @@ def get_image_hash(image_path: str, hash_size: int = 8) -> Optional[str]:
         return None
 
 
+def get_image_hash_from_bytes(data: bytes, hash_size: int = 8) -> Optional[str]:
+    """
+    计算内存中图片数据的感知哈希值
+
+    Args:
+        data: 图片文件内容
+        hash_size: 哈希大小，默认8（生成64位哈希）
+
+    Returns:
+        哈希值字符串，失败返回None
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            phash = imagehash.phash(img, hash_size=hash_size)
+            return str(phash)
+    except Exception as e:
+        logger.error(f"计算上传图片哈希失败, 错误: {e}")
+        return None
+
+
 def get_image_info(image_path: str) -> Optional[dict]:
     """
     获取图片基本信息
@@ -50,6 +125,171 @@ def get_image_info(image_path: str) -> Optional[dict]:
         return None
 
 
+def phash_variants(img: Image.Image, hash_size: int = 8, highfreq_factor: int = 4) -> List[int]:
+    """
+    计算图片在 8 种旋转/翻转（二面体群）下的感知哈希
+
+    只做一次缩放和 DCT：翻转对应低频系数按行/列号交替变号，
+    转置对应系数矩阵转置，因此 8 个变体都由同一个系数块得到。
+    第一个变体与 imagehash.phash 的结果一致。
+
+    Args:
+        img: 图片
+        hash_size: 哈希大小，默认8（生成64位哈希）
+        highfreq_factor: 缩放倍数，与 imagehash.phash 相同
+
+    Returns:
+        8 个哈希整数：原图、上下翻转、左右翻转、旋转180度，
+        以及转置后的同样 4 种（对应两种 90 度旋转与两种对角翻转）
+    """
+    # 与 imagehash.phash 一样按需导入 scipy，服务与命令行启动时不加载
+    import scipy.fftpack
+
+    img_size = hash_size * highfreq_factor
+    image = img.convert("L").resize((img_size, img_size), Image.Resampling.LANCZOS)
+    pixels = np.asarray(image)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+    block = dct[:hash_size, :hash_size]
+
+    signs = np.where(np.arange(hash_size) % 2, -1.0, 1.0)
+    variants = []
+    for base in (block, block.T):
+        for pattern in (1.0, signs[:, None], signs[None, :], signs[:, None] * signs[None, :]):
+            coefficients = base * pattern
+            bits = (coefficients > np.median(coefficients)).flatten()
+            variants.append(int.from_bytes(np.packbits(bits).tobytes(), "big"))
+    return variants
+
+
+def format_hash(value: int, hash_size: int = 8) -> str:
+    """将哈希整数格式化为与 imagehash 相同的十六进制字符串"""
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def get_exif_thumbnail(img: Image.Image) -> Optional[Image.Image]:
+    """
+    读取 JPEG 内嵌的 EXIF 缩略图，不解码主图
+
+    Args:
+        img: 已打开（尚未解码）的图片
+
+    Returns:
+        缩略图，不存在或无法解析时返回None
+    """
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1.get(_TAG_THUMBNAIL_OFFSET)
+        length = ifd1.get(_TAG_THUMBNAIL_LENGTH)
+        if not offset or not length:
+            return None
+
+        # 偏移量相对于 TIFF 头，APP1 段中的 EXIF 数据以 "Exif\0\0" 开头
+        tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+        data = tiff[offset:offset + length]
+        if len(data) != length:
+            return None
+
+        thumbnail = Image.open(io.BytesIO(data))
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None
+
+
+def get_capture_time(img: Image.Image) -> Optional[datetime]:
+    """
+    读取 EXIF 拍摄时间（DateTimeOriginal，含亚秒），只解析文件头
+
+    Args:
+        img: 已打开的图片
+
+    Returns:
+        拍摄时间，不存在或格式无效时返回None
+    """
+    if not img.info.get("exif"):
+        return None
+
+    try:
+        exif = img.getexif().get_ifd(ExifTags.IFD.Exif)
+        value = exif.get(_TAG_DATETIME_ORIGINAL) or exif.get(_TAG_DATETIME_DIGITIZED)
+        if not value:
+            return None
+        captured_at = datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+        subsec = str(exif.get(_TAG_SUBSEC_ORIGINAL) or "").strip("\x00 ")
+        if subsec.isdigit():
+            captured_at = captured_at.replace(microsecond=int(subsec[:6].ljust(6, "0")))
+        return captured_at
+    except Exception:
+        return None
+
+
+def same_aspect_ratio(size1: Tuple[int, int], size2: Tuple[int, int], tolerance: float = 0.01) -> bool:
+    """两个尺寸的宽高比是否一致（缩略图带黑边或被裁剪时不一致）"""
+    (w1, h1), (w2, h2) = size1, size2
+    if not (w1 and h1 and w2 and h2):
+        return False
+    return abs((w1 / h1) / (w2 / h2) - 1) <= tolerance
+
+
+def analyze_image(
+    source: Union[str, BinaryIO],
+    name: Optional[str] = None,
+    hash_size: int = 8,
+    fast: bool = False,
+    variants: bool = False
+) -> Optional[dict]:
+    """
+    一次解码同时获取感知哈希与图片基本信息
+
+    快速模式下优先对 EXIF 内嵌缩略图计算哈希（仅在宽高比与主图一致时），
+    主图的宽高从文件头读取，无需解码。缩略图哈希与完整解码的哈希
+    通常只差几个比特，阈值附近的结果应使用完整解码确认。
+
+    variants 为真时额外返回 8 种旋转/翻转下的哈希（variant_hashes，逗号分隔）
+    与其中的最小值（canonical_hash），同一张图片的任意旋转/翻转版本
+    具有相同的 canonical_hash。
+
+    Args:
+        source: 图片文件路径或已读入内存的文件对象
+        name: 用于日志的文件名，默认使用 source
+        hash_size: 哈希大小，默认8（生成64位哈希）
+        fast: 是否启用缩略图快速哈希
+        variants: 是否计算旋转/翻转变体哈希
+
+    Returns:
+        包含哈希值、宽度、高度、哈希来源、拍摄时间的字典，失败返回None
+    """
+    try:
+        with Image.open(source) as img:
+            hash_image, hash_source = img, HASH_SOURCE_FULL
+            if fast:
+                thumbnail = get_exif_thumbnail(img)
+                if thumbnail is not None and same_aspect_ratio(thumbnail.size, img.size):
+                    hash_image, hash_source = thumbnail, HASH_SOURCE_THUMBNAIL
+
+            info = {
+                "width": img.width,
+                "height": img.height,
+                "hash_source": hash_source,
+                "captured_at": get_capture_time(img)
+            }
+            if variants:
+                values = phash_variants(hash_image, hash_size=hash_size)
+                info["hash_value"] = format_hash(values[0], hash_size)
+                info["canonical_hash"] = format_hash(min(values), hash_size)
+                info["variant_hashes"] = ",".join(format_hash(v, hash_size) for v in values)
+            else:
+                info["hash_value"] = str(imagehash.phash(hash_image, hash_size=hash_size))
+            return info
+    except Exception as e:
+        logger.error(f"解析图片失败: {name or source}, 错误: {e}")
+        return None
+
+
 def compare_hashes(hash1: str, hash2: str) -> int:
     """
     计算两个哈希值的汉明距离
@@ -0,0 +1,417 @@
+import mmap
+import os
+import struct
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 索引文件格式：
+#   头部   | magic(8) version(I) flags(I) count(Q) reserved(Q)
+#   ids    | uint32[count]，按图片ID升序
+#   hashes | uint64[count]，与 ids 一一对应的 64 位感知哈希
+#   多重索引（可选，flags & FLAG_MULTI_INDEX）：
+#   orders | uint32[4][count]，每个 16 位分段按值排序后的行号
+#   keys   | uint16[4][count]，与 orders 对应的已排序分段值
+# 变体索引（flags & FLAG_VARIANTS）中每张图片占多行（各旋转/翻转变体），ids 可重复
+INDEX_MAGIC = b"PCHIDX01"
+INDEX_VERSION = 1
+FLAG_MULTI_INDEX = 0x1
+FLAG_VARIANTS = 0x2
+
+_HEADER = struct.Struct("<8sIIQQ")
+_SEGMENTS = 4
+_SEGMENT_BITS = 16
+
+# 没有 np.bitwise_count 时使用的逐字节查表
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hash_to_int(hash_value: str) -> int:
+    """将十六进制哈希字符串转换为 64 位整数"""
+    return int(hash_value, 16)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """
+    逐元素计算 uint64 数组中置位的比特数
+
+    Args:
+        values: uint64 数组
+
+    Returns:
+        uint8 数组，即与查询异或后的汉明距离
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def segment_keys(hashes: np.ndarray) -> np.ndarray:
+    """哈希的各 16 位分段值，形状为 (分段数, n)"""
+    # 小端序下第 seg 个 uint16 即第 seg 个 16 位分段（低位在前）
+    hashes = np.ascontiguousarray(hashes, dtype="<u8")
+    return hashes.view("<u2").reshape(-1, _SEGMENTS).T
+
+
+def build_multi_index(hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    构建分段多重索引（与索引文件中的结构相同）
+
+    Returns:
+        (orders, keys)：每个分段按值排序后的行号，以及对应的已排序分段值
+    """
+    keys = segment_keys(hashes)
+    # 16 位整数的稳定排序为基数排序，线性时间
+    orders = np.argsort(keys, axis=1, kind="stable").astype("<u4")
+    return orders, np.take_along_axis(keys, orders.astype(np.intp), axis=1)
+
+
+def bucket_offsets(keys: np.ndarray) -> np.ndarray:
+    """
+    多重索引中每个 16 位分段值所在区间的起点，形状为 (分段数, 65537)
+
+    分段 seg 中值为 v 的行为 orders[seg][offsets[seg, v]:offsets[seg, v + 1]]，
+    查找时直接按值取下标，无需二分查找。
+    """
+    offsets = np.zeros((len(keys), (1 << _SEGMENT_BITS) + 1), dtype=np.int64)
+    for seg, segment in enumerate(keys):
+        np.cumsum(np.bincount(segment, minlength=1 << _SEGMENT_BITS), out=offsets[seg, 1:])
+    return offsets
+
+
+@lru_cache(maxsize=None)
+def segment_masks(radius: int) -> np.ndarray:
+    """置位比特数不超过 radius 的全部 16 位掩码"""
+    values = np.arange(1 << _SEGMENT_BITS, dtype=np.uint64)
+    return values[popcount64(values) <= radius].astype(np.intp)
+
+
+def multi_index_candidates(
+    orders: np.ndarray,
+    offsets: np.ndarray,
+    queries: np.ndarray,
+    segment_radius: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在分段多重索引中查找候选行
+
+    候选为至少有一个分段与查询相差不超过 segment_radius 比特的行。
+    由鸽巢原理，与查询距离不超过 4 * segment_radius + 3 的行一定在候选中。
+
+    Args:
+        orders: 多重索引的行号 (分段数, n)
+        offsets: bucket_offsets 给出的各分段值区间起点
+        queries: uint64 查询哈希数组
+        segment_radius: 每个分段允许的最大比特差
+
+    Returns:
+        (查询序号, 候选行号)，一一对应，可能重复
+    """
+    lo, counts, masks_count = _probe_ranges(orders, offsets, queries, segment_radius)
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # 把各探测值命中的区间 [lo, hi) 展开为 orders 展平后的连续位置
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    rows = orders.ravel()[np.arange(total) + starts].astype(np.intp)
+    query_index = np.arange(len(counts)) // masks_count % len(queries)
+    return np.repeat(query_index, counts), rows
+
+
+def iter_multi_index_candidates(
+    orders: np.ndarray,
+    offsets: np.ndarray,
+    queries: np.ndarray,
+    segment_radius: int,
+    max_rows: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    分批返回 multi_index_candidates 的结果，每批最多 max_rows 个候选
+
+    候选总数由 bucket_offsets 中各探测值的区间长度事先得到，大量重复哈希
+    落在同一分段值时也按候选数切分，单批内存占用有硬上限。
+
+    Yields:
+        (查询序号, 候选行号)，一一对应，可能重复
+    """
+    lo, counts, masks_count = _probe_ranges(orders, offsets, queries, segment_radius)
+    ends = np.cumsum(counts)
+    flat = orders.ravel()
+    start = 0
+    while start < len(counts):
+        # 连续的探测值累计候选数不超过 max_rows
+        stop = int(np.searchsorted(ends, ends[start] - counts[start] + max_rows, side="right"))
+        if stop == start:
+            # 单个探测值的区间超过 max_rows 时按区间切分
+            query_index = start // masks_count % len(queries)
+            for offset in range(0, int(counts[start]), max_rows):
+                rows = flat[lo[start] + offset:lo[start] + min(offset + max_rows, counts[start])]
+                yield np.full(len(rows), query_index, dtype=np.intp), rows.astype(np.intp)
+            start += 1
+            continue
+
+        block_counts = counts[start:stop]
+        total = int(block_counts.sum())
+        if total:
+            starts = np.repeat(lo[start:stop] - (np.cumsum(block_counts) - block_counts), block_counts)
+            rows = flat[np.arange(total) + starts].astype(np.intp)
+            query_index = np.arange(start, stop) // masks_count % len(queries)
+            yield np.repeat(query_index, block_counts), rows
+        start = stop
+
+
+def _probe_ranges(
+    orders: np.ndarray,
+    offsets: np.ndarray,
+    queries: np.ndarray,
+    segment_radius: int
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    各探测值（分段, 查询, 掩码）在 orders 展平后命中的区间
+
+    Returns:
+        (区间起点, 区间长度, 掩码数)，探测值按 (分段, 查询, 掩码) 的顺序展平
+    """
+    masks = segment_masks(segment_radius)
+    probes = segment_keys(queries).astype(np.intp)[:, :, None] ^ masks[None, None, :]
+    segments = np.arange(len(orders))[:, None, None]
+    lo = offsets[segments, probes]
+    counts = (offsets[segments, probes + 1] - lo).ravel()
+    return (lo + segments * orders.shape[1]).ravel(), counts, len(masks)
+
+
+class HashIndex:
+    """基于 mmap 的只读哈希索引"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, count, _ = _HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self._mmap.close()
+            raise ValueError(f"无效的哈希索引文件: {path}")
+
+        self.count = count
+        self.flags = flags
+
+        offset = _HEADER.size
+        self.ids = np.frombuffer(self._mmap, dtype="<u4", count=count, offset=offset)
+        offset += 4 * count
+        self.hashes = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=offset)
+        offset += 8 * count
+
+        self._orders = None
+        self._keys = None
+        if flags & FLAG_MULTI_INDEX:
+            self._orders = np.frombuffer(
+                self._mmap, dtype="<u4", count=_SEGMENTS * count, offset=offset
+            ).reshape(_SEGMENTS, count)
+            offset += 4 * _SEGMENTS * count
+            self._keys = np.frombuffer(
+                self._mmap, dtype="<u2", count=_SEGMENTS * count, offset=offset
+            ).reshape(_SEGMENTS, count)
+
+    @property
+    def has_multi_index(self) -> bool:
+        return self._orders is not None
+
+    @property
+    def has_variants(self) -> bool:
+        return bool(self.flags & FLAG_VARIANTS)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def position_of(self, image_id: int) -> int:
+        """
+        查找图片ID在索引中的行号
+
+        Returns:
+            行号，不存在时返回 -1
+        """
+        pos = int(np.searchsorted(self.ids, image_id))
+        if pos < self.count and int(self.ids[pos]) == image_id:
+            return pos
+        return -1
+
+    def distances(self, query: int) -> np.ndarray:
+        """计算查询哈希与索引内全部哈希的汉明距离"""
+        return popcount64(self.hashes ^ np.uint64(query))
+
+    def radius_search(self, query: int, radius: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查找汉明距离不超过 radius 的所有行
+
+        半径小于分段数时利用鸽巢原理：距离 <= 3 的两个哈希至少有一个
+        16 位分段完全相同，只需在多重索引中二分查找候选行再精确校验。
+
+        Args:
+            query: 64 位查询哈希
+            radius: 最大汉明距离（包含）
+
+        Returns:
+            (行号数组, 距离数组)，按行号升序
+        """
+        if self.count == 0 or radius < 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8)
+
+        if self.has_multi_index and radius < _SEGMENTS:
+            candidates = []
+            for seg in range(_SEGMENTS):
+                key = (query >> (seg * _SEGMENT_BITS)) & 0xFFFF
+                keys = self._keys[seg]
+                lo = np.searchsorted(keys, key, side="left")
+                hi = np.searchsorted(keys, key, side="right")
+                if hi > lo:
+                    candidates.append(self._orders[seg][lo:hi])
+            if not candidates:
+                return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8)
+            rows = np.unique(np.concatenate(candidates)).astype(np.intp)
+            dist = popcount64(self.hashes[rows] ^ np.uint64(query))
+            mask = dist <= radius
+            return rows[mask], dist[mask]
+
+        dist = self.distances(query)
+        rows = np.nonzero(dist <= radius)[0]
+        return rows, dist[rows]
+
+    def knn(
+        self,
+        query: int,
+        k: int,
+        max_distance: int = 64,
+        exclude_id: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查找距离最近的 k 个哈希
+
+        Args:
+            query: 64 位查询哈希
+            k: 返回数量上限
+            max_distance: 最大汉明距离（包含）
+            exclude_id: 需要排除的图片ID（通常是查询图片自身）
+
+        Returns:
+            (图片ID数组, 距离数组)，按距离、ID升序排列
+        """
+        rows, dist = self.radius_search(query, max_distance)
+        if exclude_id is not None:
+            keep = self.ids[rows] != exclude_id
+            rows, dist = rows[keep], dist[keep]
+
+        if self.has_variants and len(rows):
+            # 同一图片的多个变体命中时只保留距离最小的一行
+            order = np.lexsort((dist, self.ids[rows]))
+            rows, dist = rows[order], dist[order]
+            _, first = np.unique(self.ids[rows], return_index=True)
+            rows, dist = rows[first], dist[first]
+
+        if k < len(rows):
+            top = np.argpartition(dist, k - 1)[:k]
+            # 第 k 名存在并列时保留行号更小的，保证结果稳定
+            cutoff = dist[top].max()
+            tied = np.nonzero(dist <= cutoff)[0]
+            rows, dist = rows[tied], dist[tied]
+
+        order = np.lexsort((self.ids[rows], dist))[:k]
+        return self.ids[rows[order]], dist[order]
+
+    def close(self):
+        self.ids = None
+        self.hashes = None
+        self._orders = None
+        self._keys = None
+        self._mmap.close()
+
+
+def write_hash_index(
+    path: str,
+    ids: np.ndarray,
+    hashes: np.ndarray,
+    multi_index: bool = True,
+    variants: bool = False
+) -> int:
+    """
+    原子地写入哈希索引文件
+
+    先写临时文件再 os.replace，正在读取旧索引的进程不受影响。
+
+    Args:
+        path: 索引文件路径
+        ids: 图片ID数组
+        hashes: 与 ids 对应的 64 位哈希数组
+        multi_index: 是否生成分段多重索引
+        variants: ids 是否可重复（每张图片的各旋转/翻转变体各占一行）
+
+    Returns:
+        写入的条目数
+    """
+    ids = np.asarray(ids, dtype="<u4")
+    hashes = np.asarray(hashes, dtype="<u8")
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    hashes = hashes[order]
+    count = len(ids)
+
+    flags = (FLAG_MULTI_INDEX if multi_index else 0) | (FLAG_VARIANTS if variants else 0)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, flags, count, 0))
+        f.write(ids.tobytes())
+        f.write(hashes.tobytes())
+        if multi_index:
+            orders, keys = build_multi_index(hashes)
+            f.write(orders.tobytes())
+            f.write(keys.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    logger.info(f"哈希索引已写入: {path}, 共 {count} 条")
+    return count
+
+
+# 已打开的索引缓存：路径 -> ((inode, mtime, size), 索引)
+_index_cache: Dict[str, Tuple[tuple, HashIndex]] = {}
+
+
+def load_hash_index(path: str) -> Optional[HashIndex]:
+    """
+    打开（或复用已打开的）哈希索引
+
+    文件被重新写入后 inode 会变化，此时自动重新映射。
+
+    Returns:
+        HashIndex，文件不存在或损坏时返回 None
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _index_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    try:
+        index = HashIndex(path)
+    except (ValueError, OSError, struct.error) as e:
+        logger.error(f"打开哈希索引失败: {path}, 错误: {e}")
+        return None
+
+    # 旧映射交给垃圾回收释放，避免仍在使用的 numpy 视图失效
+    _index_cache[path] = (key, index)
+    return index
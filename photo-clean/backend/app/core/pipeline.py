@@ -0,0 +1,363 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+from app.config import settings
+from app.core.worker import process_image_buffer, process_single_image, warm_up
+from app.core.worker_pool import ResilientProcessPool
+
+logger = logging.getLogger(__name__)
+
+# 普通的解码/读取失败（超时、崩溃见 worker_pool）
+REASON_DECODE_FAILED = "decode_failed"
+REASON_READ_FAILED = "read_failed"
+
+
+def order_for_locality(file_paths: List[str]) -> List[str]:
+    """
+    按目录、inode 排序文件，使读取顺序尽量贴近磁盘上的物理布局
+
+    同一目录的文件通常分配在相邻的 inode 和数据块上，
+    按此顺序读取可以显著减少机械硬盘的寻道。
+
+    Args:
+        file_paths: 文件路径列表
+
+    Returns:
+        排序后的文件路径列表
+    """
+    def sort_key(path: str):
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            inode = 0
+        return os.path.dirname(path), inode
+
+    return sorted(file_paths, key=sort_key)
+
+
+class PrefetchedFile:
+    """已读入共享内存的文件"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.shm: Optional[SharedMemory] = None
+        self.size = 0
+        self.mtime = 0.0
+        self.inode = 0
+
+    def read(self) -> "PrefetchedFile":
+        """顺序读取整个文件到共享内存（在预读线程中执行）"""
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            stat = os.fstat(fd)
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+            self.inode = stat.st_ino
+
+            if hasattr(os, "posix_fadvise"):
+                # 提示内核顺序读取并提前预读整个文件
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+            self.shm = SharedMemory(create=True, size=max(self.size, 1))
+            with open(fd, "rb", closefd=False) as f:
+                view = self.shm.buf[:self.size]
+                try:
+                    read = 0
+                    while read < self.size:
+                        n = f.readinto(view[read:])
+                        if not n:
+                            break
+                        read += n
+                    self.size = read
+                finally:
+                    view.release()
+        except Exception:
+            self.release()
+            raise
+        finally:
+            os.close(fd)
+        return self
+
+    def release(self):
+        """释放共享内存"""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+# 空闲的常驻进程池：(进程数, 时间预算, 回收周期, 内存上限) -> 进程池
+# 扫描结束后归还，下次扫描直接复用已启动的工作进程
+_idle_pools: Dict[tuple, ResilientProcessPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _worker_context():
+    """
+    工作进程的启动方式
+
+    统一从预加载了 app.core.worker 与 scipy 的 forkserver 启动：既避免在服务进程
+    （含预读线程）中直接 fork 继承被占用的锁，又省去每个进程重新导入
+    PIL、imagehash、scipy 的开销。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["app.core.worker", "scipy.fftpack"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def default_pool_options() -> Dict:
+    """配置中的工作进程时间、内存预算与回收周期"""
+    return {
+        "task_timeout": settings.decode_timeout or None,
+        "max_tasks_per_worker": settings.worker_max_tasks or None,
+        "memory_limit_mb": settings.worker_memory_mb or None
+    }
+
+
+@contextmanager
+def borrow_worker_pool(
+    workers: int,
+    task_timeout: Optional[float] = None,
+    max_tasks_per_worker: Optional[int] = None,
+    memory_limit_mb: Optional[int] = None
+) -> Iterator[ResilientProcessPool]:
+    """
+    借用常驻进程池，用完归还
+
+    并发的扫描各自借到不同的进程池；中途退出（仍有未完成任务）的进程池
+    直接终止，不再复用。
+    """
+    key = (workers, task_timeout, max_tasks_per_worker, memory_limit_mb)
+    with _pools_lock:
+        pool = _idle_pools.pop(key, None)
+    if pool is not None and not pool.is_healthy():
+        # 空闲期间有工作进程被终止，整体重建，避免首次提交即失败
+        logger.warning("常驻进程池中有工作进程已退出，重建进程池")
+        pool.terminate()
+    if pool is None:
+        pool = ResilientProcessPool(
+            workers,
+            task_timeout=task_timeout,
+            max_tasks_per_worker=max_tasks_per_worker,
+            memory_limit_mb=memory_limit_mb,
+            mp_context=_worker_context()
+        )
+
+    try:
+        yield pool
+    finally:
+        if len(pool):
+            pool.terminate()
+        else:
+            with _pools_lock:
+                if key not in _idle_pools:
+                    _idle_pools[key] = pool
+                    pool = None
+            if pool is not None:
+                pool.close()
+
+
+def start_worker_pool(workers: int, **options):
+    """应用启动时预先启动工作进程，首个扫描无需等待进程启动"""
+    with borrow_worker_pool(workers, **options) as pool:
+        pool.warm_up(warm_up)
+
+
+def shutdown_worker_pools():
+    """应用退出时关闭所有常驻进程池"""
+    with _pools_lock:
+        pools = list(_idle_pools.values())
+        _idle_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def iter_prefetched_results(
+    file_paths: List[str],
+    workers: int = 4,
+    prefetch_threads: int = 2,
+    max_inflight: Optional[int] = None,
+    task_timeout: Optional[float] = None,
+    max_tasks_per_worker: Optional[int] = None,
+    memory_limit_mb: Optional[int] = None,
+    fast_hash: bool = False,
+    variants: bool = False
+) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """
+    混合 I/O 流水线：预读线程按磁盘局部性顺序读取文件，解码进程并行计算哈希
+
+    读取与解码同时进行；在途文件数受 max_inflight 限制，
+    以控制共享内存占用。
+
+    Args:
+        file_paths: 待处理的文件路径
+        workers: 解码进程数
+        prefetch_threads: 预读线程数（机械硬盘建议 1-2）
+        max_inflight: 已读入内存但尚未解码完成的文件数上限
+        task_timeout: 单个文件的解码时间预算（秒）
+        max_tasks_per_worker: 每个解码进程处理多少个文件后回收
+        memory_limit_mb: 每个解码进程的内存上限（MB）
+        fast_hash: 是否优先使用 EXIF 缩略图计算哈希
+        variants: 是否计算旋转/翻转变体哈希
+
+    Yields:
+        (文件路径, 处理结果, 失败原因)，成功时失败原因为 None
+    """
+    max_inflight = max_inflight or workers * 4
+    ordered = iter(order_for_locality(file_paths))
+    pending_reads = deque()
+    decoding: Dict[str, PrefetchedFile] = {}
+
+    with ThreadPoolExecutor(max_workers=prefetch_threads) as readers, \
+            borrow_worker_pool(workers, task_timeout, max_tasks_per_worker, memory_limit_mb) as decoders:
+
+        def fill():
+            while len(pending_reads) + len(decoding) < max_inflight:
+                path = next(ordered, None)
+                if path is None:
+                    return
+                pending_reads.append((path, readers.submit(PrefetchedFile(path).read)))
+
+        fill()
+        try:
+            while pending_reads or decoding:
+                # 读取完成的文件按提交顺序交给解码进程
+                while pending_reads and pending_reads[0][1].done():
+                    path, read_future = pending_reads.popleft()
+                    try:
+                        prefetched = read_future.result()
+                    except Exception as e:
+                        logger.error(f"读取图片失败: {path}, 错误: {e}")
+                        yield path, None, REASON_READ_FAILED
+                        continue
+
+                    decoders.submit(
+                        path,
+                        process_image_buffer,
+                        prefetched.file_path,
+                        prefetched.shm.name,
+                        prefetched.size,
+                        prefetched.mtime,
+                        fast_hash,
+                        variants,
+                        prefetched.inode
+                    )
+                    decoding[path] = prefetched
+
+                if decoding:
+                    # 仍有文件在读取时只短暂等待，以便及时把读完的文件交给空闲进程
+                    timeout = 0.05 if pending_reads else None
+                    for path, result, error in decoders.poll(timeout):
+                        # 共享内存在最终结果返回后才释放，重建进程池后的重试仍可使用
+                        decoding.pop(path).release()
+                        if error:
+                            logger.error(f"处理图片失败: {path}, 原因: {error}")
+                        elif result is None:
+                            error = REASON_DECODE_FAILED
+                        yield path, result, error
+                elif pending_reads:
+                    wait([pending_reads[0][1]])
+
+                fill()
+        finally:
+            # 中途退出时释放尚未处理的共享内存
+            for prefetched in decoding.values():
+                prefetched.release()
+            for _, read_future in pending_reads:
+                if read_future.cancel():
+                    continue
+                try:
+                    read_future.result().release()
+                except Exception:
+                    pass
+
+
+# 可选的解码执行方式
+EXECUTOR_BACKENDS = ("process", "thread", "hybrid")
+
+
+def iter_hash_results(
+    file_paths: List[str],
+    backend: str = "process",
+    workers: int = 4,
+    prefetch_threads: int = 2,
+    task_timeout: Optional[float] = None,
+    max_tasks_per_worker: Optional[int] = None,
+    memory_limit_mb: Optional[int] = None,
+    fast_hash: bool = False,
+    variants: bool = False
+) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """
+    按指定执行方式并行处理图片
+
+    - process: 进程池，每个文件由工作进程自行读取和解码
+    - thread: 线程池，Pillow 解码时释放 GIL，省去进程启动与结果序列化开销
+    - hybrid: 预读线程 + 解码进程（见 iter_prefetched_results），适合机械硬盘
+
+    process 与 hybrid 借用常驻的 ResilientProcessPool（见 borrow_worker_pool）：
+    单个文件超时或导致工作进程崩溃只会让该文件失败，扫描继续进行。线程无法被强制终止，
+    thread 模式下时间与内存预算不生效。
+
+    Args:
+        file_paths: 待处理的文件路径
+        backend: 执行方式
+        workers: 工作进程/线程数
+        prefetch_threads: hybrid 模式下的预读线程数
+        task_timeout: 单个文件的处理时间预算（秒）
+        max_tasks_per_worker: 每个工作进程处理多少个文件后回收
+        memory_limit_mb: 每个工作进程的内存上限（MB）
+        fast_hash: 是否优先使用 EXIF 缩略图计算哈希
+        variants: 是否计算旋转/翻转变体哈希
+
+    Yields:
+        (文件路径, 处理结果, 失败原因)，成功时失败原因为 None
+    """
+    if backend == "hybrid":
+        yield from iter_prefetched_results(
+            file_paths,
+            workers,
+            prefetch_threads,
+            task_timeout=task_timeout,
+            max_tasks_per_worker=max_tasks_per_worker,
+            memory_limit_mb=memory_limit_mb,
+            fast_hash=fast_hash,
+            variants=variants
+        )
+        return
+
+    if backend == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            future_to_path = {
+                executor.submit(process_single_image, path, fast_hash, variants): path
+                for path in file_paths
+            }
+
+            for future in as_completed(future_to_path):
+                result = future.result()
+                yield future_to_path[future], result, None if result else REASON_DECODE_FAILED
+        return
+
+    if backend != "process":
+        raise ValueError(f"不支持的执行方式: {backend}")
+
+    with borrow_worker_pool(workers, task_timeout, max_tasks_per_worker, memory_limit_mb) as pool:
+        for path in file_paths:
+            pool.submit(path, process_single_image, path, fast_hash, variants)
+
+        while len(pool):
+            for path, result, error in pool.poll():
+                if error:
+                    logger.error(f"处理图片失败: {path}, 原因: {error}")
+                elif result is None:
+                    error = REASON_DECODE_FAILED
+                yield path, result, error
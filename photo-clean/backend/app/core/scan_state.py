@@ -0,0 +1,73 @@
+from array import array
+from datetime import datetime
+from typing import List, Optional, Union
+
+import numpy as np
+
+
+class ScanState:
+    """
+    扫描过程中的紧凑状态：按结果到达顺序记录图片ID、哈希、缩略图标记与拍摄时间
+
+    各列用 array 连续存储，每张图片只占二十几个字节（旋转不敏感时 80 个字节左右），
+    百万级图库也不会产生大量 Python 对象。路径等字符串不在内存中保留，
+    需要时按图片ID从数据库读取。
+    """
+
+    def __init__(self, hash_width: int = 1):
+        """
+        Args:
+            hash_width: 每张图片的哈希个数，旋转不敏感时为 8
+        """
+        self.hash_width = hash_width
+        self._ids = array("q")
+        self._hashes = array("Q")
+        self._thumbnail = array("B")
+        self._captured = array("d")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(
+        self,
+        image_id: int,
+        hash_row: Union[int, List[int]],
+        thumbnail: bool = False,
+        captured_at: Optional[datetime] = None
+    ):
+        """
+        记录一张图片
+
+        Args:
+            image_id: 图片ID
+            hash_row: 原图哈希，或 hash_width 个变体哈希
+            thumbnail: 哈希是否来自 EXIF 缩略图
+            captured_at: EXIF 拍摄时间
+        """
+        self._ids.append(image_id)
+        if self.hash_width == 1:
+            self._hashes.append(hash_row)
+        elif isinstance(hash_row, int):
+            # 缺少变体哈希时所有方向都用原图哈希，只匹配未旋转的图片
+            self._hashes.extend([hash_row] * self.hash_width)
+        else:
+            self._hashes.extend(hash_row)
+        self._thumbnail.append(1 if thumbnail else 0)
+        self._captured.append(captured_at.timestamp() if captured_at else float("nan"))
+
+    def ids(self) -> np.ndarray:
+        """图片ID数组（int64）"""
+        return np.array(self._ids, dtype=np.int64)
+
+    def hashes(self) -> np.ndarray:
+        """哈希数组：(n,) 或 (n, hash_width) 的 uint64"""
+        hashes = np.array(self._hashes, dtype=np.uint64)
+        return hashes if self.hash_width == 1 else hashes.reshape(-1, self.hash_width)
+
+    def thumbnail_ids(self) -> np.ndarray:
+        """哈希来自 EXIF 缩略图的图片ID"""
+        return self.ids()[np.array(self._thumbnail, dtype=bool)]
+
+    def captured_times(self) -> np.ndarray:
+        """拍摄时间戳数组（float64），无拍摄时间为 NaN"""
+        return np.array(self._captured, dtype=np.float64)
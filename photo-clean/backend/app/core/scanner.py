@@ -23,7 +23,8 @@ def is_image_file(file_path: str) -> bool:
 def scan_directory(
     directory: str,
     recursive: bool = True,
-    progress_callback: Optional[Callable[[int], None]] = None
+    progress_callback: Optional[Callable[[int], None]] = None,
+    errors: Optional[List[str]] = None
 ) -> List[str]:
     """
     扫描目录下的所有图片文件
@@ -32,6 +33,8 @@ def scan_directory(
         directory: 要扫描的目录路径
         recursive: 是否递归扫描子目录
         progress_callback: 进度回调函数，接收已扫描文件数
+        errors: 传入列表时收集无法读取的目录（其下的文件不在返回结果中，
+            不能据此判断这些文件已不存在）
 
     Returns:
         图片文件路径列表
@@ -39,6 +42,11 @@ def scan_directory(
     image_files = []
     directory_path = Path(directory)
 
+    def on_error(error: OSError):
+        logger.warning(f"无法读取目录，跳过: {error.filename}, 错误: {error}")
+        if errors is not None:
+            errors.append(error.filename or directory)
+
     if not directory_path.exists():
         logger.error(f"目录不存在: {directory}")
         return []
@@ -52,7 +60,9 @@ def scan_directory(
     try:
         if recursive:
             # 递归扫描所有子目录
-            for root, dirs, files in os.walk(directory):
+            for root, dirs, files in os.walk(directory, onerror=on_error):
+                # 跳过各卷的回收站目录
+                dirs[:] = [d for d in dirs if d != settings.volume_trash_dirname]
                 for file in files:
                     file_path = os.path.join(root, file)
                     if is_image_file(file_path):
@@ -74,6 +84,8 @@ def scan_directory(
 
     except Exception as e:
         logger.error(f"扫描目录失败: {e}")
+        if errors is not None:
+            errors.append(directory)
         return []
 
 
@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import logging
+
+from app.config import settings
+from app.core.pipeline import default_pool_options, iter_hash_results
+from app.core.scanner import scan_directory
+
+logger = logging.getLogger(__name__)
+
+# 分片索引文件格式：独立的 SQLite 文件，只依赖标准库即可读写。
+# 路径一律保存为相对扫描根目录的 POSIX 路径，各机器挂载点不同也能合并；
+# inode 只在本机有意义，不写入分片索引。
+PARTIAL_FORMAT_VERSION = 3
+
+_PARTIAL_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE images (
+    path TEXT PRIMARY KEY,
+    file_size INTEGER,
+    width INTEGER,
+    height INTEGER,
+    hash_value TEXT,
+    hash_source TEXT,
+    canonical_hash TEXT,
+    variant_hashes TEXT,
+    partial_digest TEXT,
+    mtime REAL,
+    captured_at REAL
+);
+CREATE TABLE failures (path TEXT PRIMARY KEY, reason TEXT);
+"""
+
+_IMAGE_COLUMNS = (
+    "path", "file_size", "width", "height", "hash_value",
+    "hash_source", "canonical_hash", "variant_hashes", "partial_digest", "mtime", "captured_at"
+)
+
+
+def relative_path(file_path: str, root: str) -> str:
+    """相对扫描根目录的 POSIX 路径"""
+    return os.path.relpath(file_path, root).replace(os.sep, "/")
+
+
+def shard_of(rel_path: str, shard_count: int) -> int:
+    """
+    路径所属分片：相对路径 UTF-8 编码的 CRC32 对分片数取模
+
+    只取决于相对路径，与机器、挂载点和进程无关，各工作节点独立计算也不会重叠。
+    """
+    return zlib.crc32(rel_path.encode("utf-8", "surrogateescape")) % shard_count
+
+
+def shard_files(root: str, shard_index: int, shard_count: int, recursive: bool = True) -> List[str]:
+    """扫描根目录，返回属于指定分片的图片路径"""
+    return [
+        path for path in scan_directory(root, recursive)
+        if shard_of(relative_path(path, root), shard_count) == shard_index
+    ]
+
+
+def write_partial_index(
+    output: str,
+    root: str,
+    shard_index: int,
+    shard_count: int,
+    workers: int = 4,
+    executor: str = "process",
+    recursive: bool = True,
+    fast_hash: bool = False,
+    variants: bool = False,
+    batch_size: int = 1000
+) -> Dict:
+    """
+    计算一个分片的哈希并写入分片索引文件（不访问主数据库）
+
+    先写入临时文件，完成后再改名，中途失败不会留下不完整的索引。
+
+    Args:
+        output: 分片索引文件路径
+        root: 扫描根目录（本机挂载点）
+        shard_index: 分片序号（0 起）
+        shard_count: 分片总数
+        workers: 工作进程/线程数
+        executor: 解码执行方式 process / thread / hybrid
+        recursive: 是否递归扫描子目录
+        fast_hash: 是否优先使用 EXIF 缩略图计算哈希
+        variants: 是否计算旋转/翻转变体哈希
+        batch_size: 每批写入的记录数
+
+    Returns:
+        统计信息
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"分片序号必须在 0-{shard_count - 1} 之间")
+
+    files = shard_files(root, shard_index, shard_count, recursive)
+    logger.info(f"分片 {shard_index}/{shard_count}: {len(files)} 个文件")
+
+    tmp_path = f"{output}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_PARTIAL_SCHEMA)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("format_version", str(PARTIAL_FORMAT_VERSION)),
+            ("shard_index", str(shard_index)),
+            ("shard_count", str(shard_count)),
+            ("variants", "1" if variants else "0"),
+            ("root", root),
+            ("created_at", datetime.utcnow().isoformat())
+        ])
+
+        images, failures = [], []
+        stats = {"files": len(files), "images": 0, "failures": 0}
+
+        def flush():
+            conn.executemany(
+                f"INSERT OR REPLACE INTO images VALUES ({', '.join('?' * len(_IMAGE_COLUMNS))})", images
+            )
+            conn.executemany("INSERT OR REPLACE INTO failures VALUES (?, ?)", failures)
+            conn.commit()
+            images.clear()
+            failures.clear()
+
+        results = iter_hash_results(
+            files,
+            executor,
+            workers,
+            settings.prefetch_threads,
+            fast_hash=fast_hash,
+            variants=variants,
+            **default_pool_options()
+        )
+        for processed, (file_path, result, error) in enumerate(results, 1):
+            rel_path = relative_path(file_path, root)
+            if result:
+                images.append((
+                    rel_path, result["file_size"], result["width"], result["height"],
+                    result["hash_value"], result["hash_source"], result.get("canonical_hash"),
+                    result.get("variant_hashes"), result.get("partial_digest"),
+                    result["modified_at"].timestamp(),
+                    result["captured_at"].timestamp() if result.get("captured_at") else None
+                ))
+                stats["images"] += 1
+            elif error:
+                failures.append((rel_path, error))
+                stats["failures"] += 1
+
+            if len(images) + len(failures) >= batch_size:
+                flush()
+            if processed % batch_size == 0:
+                logger.info(f"分片处理进度: {processed}/{len(files)}")
+
+        flush()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, output)
+    logger.info(f"分片索引已写入: {output}, 图片 {stats['images']} 个, 失败 {stats['failures']} 个")
+    return stats
+
+
+class PartialIndex:
+    """只读打开的分片索引文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            self.meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        except sqlite3.DatabaseError:
+            self._conn.close()
+            raise ValueError(f"无效的分片索引文件: {path}")
+
+        if self.meta.get("format_version") != str(PARTIAL_FORMAT_VERSION):
+            self._conn.close()
+            raise ValueError(f"不支持的分片索引版本: {path}")
+
+        self.shard_index = int(self.meta["shard_index"])
+        self.shard_count = int(self.meta["shard_count"])
+        self.variants = self.meta["variants"] == "1"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def count(self) -> int:
+        """图片与失败记录总数"""
+        return sum(
+            self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("images", "failures")
+        )
+
+    def iter_images(self, root: str, batch_size: int = 500) -> Iterator[List[Dict]]:
+        """
+        分批读取图片记录，路径映射到本机的扫描根目录下
+
+        Returns:
+            与扫描结果结构相同的图片信息字典列表
+        """
+        cursor = self._conn.execute(f"SELECT {', '.join(_IMAGE_COLUMNS)} FROM images")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [self._to_result(dict(zip(_IMAGE_COLUMNS, row)), root) for row in rows]
+
+    def iter_failures(self, root: str) -> Iterator[tuple]:
+        """读取处理失败的文件：(本机路径, 失败原因)"""
+        for rel_path, reason in self._conn.execute("SELECT path, reason FROM failures"):
+            yield os.path.join(root, *rel_path.split("/")), reason
+
+    @staticmethod
+    def _to_result(row: Dict, root: str) -> Dict:
+        rel_path = row.pop("path")
+        mtime = row.pop("mtime")
+        captured_at = row.pop("captured_at")
+        return {
+            "file_path": os.path.join(root, *rel_path.split("/")),
+            "file_name": rel_path.rsplit("/", 1)[-1],
+            "modified_at": datetime.fromtimestamp(mtime) if mtime is not None else None,
+            "captured_at": datetime.fromtimestamp(captured_at) if captured_at is not None else None,
+            **row
+        }
+
+
+def missing_shards(partials: List[PartialIndex]) -> Optional[List[int]]:
+    """
+    检查分片是否齐全
+
+    Returns:
+        缺失的分片序号；各文件的分片总数不一致时返回None
+    """
+    counts = {partial.shard_count for partial in partials}
+    if len(counts) != 1:
+        return None
+    present = {partial.shard_index for partial in partials}
+    return [i for i in range(counts.pop()) if i not in present]
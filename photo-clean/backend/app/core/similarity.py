@@ -1,5 +1,10 @@
-from typing import List, Dict, Set
+from typing import List, Dict, Optional, Tuple, Union
 from app.core.hash import compare_hashes
+from app.core.hash_index import (
+    HashIndex, bucket_offsets, build_multi_index, hash_to_int, iter_multi_index_candidates,
+    multi_index_candidates, popcount64, segment_masks
+)
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
@@ -7,51 +12,579 @@ logger = logging.getLogger(__name__)
 
 def find_similar_groups(
     image_hashes: Dict[str, str],
-    threshold: int = 10
+    threshold: int = 10,
+    mode: str = "exact",
+    lsh_bands: int = 32,
+    lsh_rows: int = 16
 ) -> List[List[str]]:
     """
     查找所有相似图片组
 
+    按传递闭包归组：A~B、B~C 时三者同组，分组结果与图片顺序无关。
+
     Args:
         image_hashes: 图片路径到哈希值的映射
         threshold: 相似度阈值，汉明距离小于此值视为相似
+        mode: 聚类模式，exact 为精确两两比较，lsh 为近似的比特采样 LSH
+        lsh_bands: LSH 分段数，越大召回越高、候选越多
+        lsh_rows: 每段采样的比特数，越大候选越少、召回越低
 
     Returns:
         相似图片组列表，每组包含多个相似图片的路径
     """
-    groups = []
-    processed: Set[str] = set()
+    if mode not in ("exact", "lsh"):
+        raise ValueError(f"不支持的聚类模式: {mode}")
 
     image_paths = list(image_hashes.keys())
+    hashes = np.fromiter(
+        (hash_to_int(image_hashes[path]) for path in image_paths),
+        dtype=np.uint64,
+        count=len(image_paths)
+    )
+    if mode == "lsh":
+        position_groups = find_similar_groups_lsh(hashes, threshold, lsh_bands, lsh_rows)
+    else:
+        src, dst, _ = exact_similarity_edges(hashes, threshold - 1)
+        position_groups = groups_from_edges(src, dst)
 
-    for i, path1 in enumerate(image_paths):
-        if path1 in processed:
-            continue
+    groups = [[image_paths[pos] for pos in group] for group in position_groups]
+    logger.info(f"找到 {len(groups)} 个相似图片组")
+    return groups
 
-        hash1 = image_hashes[path1]
-        group = [path1]
 
-        # 与后续所有图片比较
-        for path2 in image_paths[i + 1:]:
-            if path2 in processed:
-                continue
+def find_similar_groups_indexed(
+    index: HashIndex,
+    threshold: int = 10
+) -> List[List[int]]:
+    """
+    基于哈希索引查找所有相似图片组
+
+    分组规则与 find_similar_groups 相同（传递闭包），
+    直接在 mmap 的哈希数组上分块向量化比较，无需加载 ORM 对象。
+
+    Args:
+        index: 哈希索引
+        threshold: 相似度阈值，汉明距离小于此值视为相似
+
+    Returns:
+        相似图片组列表，每组包含多个相似图片的ID
+    """
+    src, dst, _ = exact_similarity_edges(np.asarray(index.hashes), threshold - 1)
+    ids = np.asarray(index.ids, dtype=np.int64)
+    groups = groups_from_edges(ids[src], ids[dst])
+    logger.info(f"找到 {len(groups)} 个相似图片组")
+    return groups
+
+
+def lsh_candidate_pairs(
+    hashes: np.ndarray,
+    bands: int = 32,
+    rows: int = 16,
+    seed: int = 0
+):
+    """
+    用比特采样 LSH 生成候选图片对
+
+    每个分段随机选取 rows 个比特位拼成桶键，同一桶内的图片互为候选。
+    汉明距离为 d 的两张图片在单个分段碰撞的概率约为 (1 - d/64)^rows，
+    在任一分段碰撞的概率为 1 - (1 - (1 - d/64)^rows)^bands。
+
+    Args:
+        hashes: uint64 哈希数组
+        bands: 分段数
+        rows: 每段采样的比特数
+        seed: 采样比特位的随机种子，固定种子保证结果可复现
+
+    Yields:
+        (行号数组a, 行号数组b)，同一批次内 a、b 一一对应
+    """
+    n = len(hashes)
+    if n < 2:
+        return
 
-            hash2 = image_hashes[path2]
-            distance = compare_hashes(hash1, hash2)
+    rng = np.random.default_rng(seed)
+    rows = min(rows, 64)
 
-            if distance < threshold:
-                group.append(path2)
-                processed.add(path2)
+    for _ in range(bands):
+        positions = rng.choice(64, size=rows, replace=False)
+        keys = np.zeros(n, dtype=np.uint64)
+        for bit, pos in enumerate(positions):
+            keys |= ((hashes >> np.uint64(pos)) & np.uint64(1)) << np.uint64(bit)
 
-        # 只有找到相似图片才添加到组
-        if len(group) > 1:
-            groups.append(group)
-            processed.add(path1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
 
+        # 同桶元素在排序后连续：依次比较相隔 t 的位置，
+        # 仍在同一桶内的起点逐步减少，总工作量与候选对数成正比
+        active = np.arange(n - 1)
+        step = 1
+        while active.size:
+            active = active[sorted_keys[active] == sorted_keys[active + step]]
+            if active.size:
+                yield order[active], order[active + step]
+            step += 1
+            active = active[active + step < n]
+
+
+def find_similar_groups_lsh(
+    hashes: np.ndarray,
+    threshold: int = 10,
+    bands: int = 32,
+    rows: int = 16
+) -> List[List[int]]:
+    """
+    近似模式：仅对 LSH 候选对计算汉明距离，再按精确模式的规则（传递闭包）归组
+
+    Args:
+        hashes: uint64 哈希数组
+        threshold: 相似度阈值，汉明距离小于此值视为相似
+        bands: LSH 分段数
+        rows: 每段采样的比特数
+
+    Returns:
+        相似图片组列表，每组为 hashes 中的行号
+    """
+    src, dst, _ = lsh_similarity_edges(hashes, threshold - 1, bands, rows)
+    groups = groups_from_edges(src, dst)
     logger.info(f"找到 {len(groups)} 个相似图片组")
     return groups
 
 
+def lsh_similarity_edges(
+    hashes: np.ndarray,
+    max_distance: int,
+    bands: int = 32,
+    rows: int = 16
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    用 LSH 候选对生成距离不超过 max_distance 的相似边（近似）
+
+    Args:
+        hashes: uint64 哈希数组
+        max_distance: 最大汉明距离（包含）
+        bands: LSH 分段数
+        rows: 每段采样的比特数
+
+    Returns:
+        (起点行号, 终点行号, 距离)，起点小于终点，按 (起点, 终点) 升序且无重复
+    """
+    n = len(hashes)
+    edge_keys = []
+    edge_distances = []
+    candidate_count = 0
+
+    for a, b in lsh_candidate_pairs(hashes, bands, rows):
+        candidate_count += len(a)
+        distances = popcount64(hashes[a] ^ hashes[b])
+        mask = distances <= max_distance
+        if mask.any():
+            lo = np.minimum(a[mask], b[mask]).astype(np.int64)
+            hi = np.maximum(a[mask], b[mask]).astype(np.int64)
+            edge_keys.append(lo * n + hi)
+            edge_distances.append(distances[mask])
+
+    if edge_keys:
+        keys, first = np.unique(np.concatenate(edge_keys), return_index=True)
+        distances = np.concatenate(edge_distances)[first]
+    else:
+        keys = np.empty(0, dtype=np.int64)
+        distances = np.empty(0, dtype=np.uint8)
+
+    total_pairs = n * (n - 1) // 2
+    logger.info(
+        f"LSH 候选对 {candidate_count}（全量 {total_pairs}），"
+        f"命中 {len(keys)} 对, bands={bands}, rows={rows}"
+    )
+    return keys // n, keys % n, distances
+
+
+def exact_similarity_edges(
+    hashes: np.ndarray,
+    max_distance: int,
+    block_size: int = 256,
+    chunk_size: int = 65536
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    精确生成距离不超过 max_distance 的所有相似边
+
+    按 block_size x chunk_size 的分块计算距离矩阵的上三角，
+    避免逐对的 Python 循环，同时限制单次计算的内存占用。
+
+    Args:
+        hashes: uint64 哈希数组
+        max_distance: 最大汉明距离（包含）
+        block_size: 每块的行数
+        chunk_size: 每块的列数
+
+    Returns:
+        (起点行号, 终点行号, 距离)，起点小于终点，按 (起点, 终点) 升序
+    """
+    n = len(hashes)
+    src_parts, dst_parts, dist_parts = [], [], []
+
+    for row_start in range(0, n, block_size):
+        block = hashes[row_start:row_start + block_size, None]
+        for col_start in range(row_start, n, chunk_size):
+            distances = popcount64(block ^ hashes[None, col_start:col_start + chunk_size])
+            rows, cols = np.nonzero(distances <= max_distance)
+            upper = cols + col_start > rows + row_start
+            rows, cols = rows[upper], cols[upper]
+            src_parts.append(rows + row_start)
+            dst_parts.append(cols + col_start)
+            dist_parts.append(distances[rows, cols])
+
+    if not src_parts:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.uint8))
+
+    src = np.concatenate(src_parts)
+    dst = np.concatenate(dst_parts)
+    order = np.lexsort((dst, src))
+    return src[order], dst[order], np.concatenate(dist_parts)[order]
+
+
+def _min_distance_edges(
+    n: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    distances: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """合并重复的边（同一对图片经不同变体命中），保留最小距离，按 (起点, 终点) 升序"""
+    if len(src) == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.uint8))
+
+    lo = np.minimum(src, dst).astype(np.int64)
+    hi = np.maximum(src, dst).astype(np.int64)
+    keys = lo * n + hi
+    order = np.lexsort((distances, keys))
+    keys, distances = keys[order], distances[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    keys = keys[first]
+    return keys // n, keys % n, distances[first]
+
+
+def variant_similarity_edges(
+    variants: np.ndarray,
+    max_distance: int,
+    chunk_probes: int = 1 << 22,
+    chunk_candidates: int = 1 << 22
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    旋转/翻转不敏感的精确相似边
+
+    两张图片的距离为一张的原图哈希与另一张全部 8 个变体的最小距离。
+    二面体变换构成群，d(X, gY) = d(g⁻¹X, Y)，因此只需计算上三角。
+
+    canonical_hash（变体中的最小值）相同的图片任意方向完全相同，直接相连；
+    其余候选来自全部变体的分段多重索引，每张图片只用原图哈希查找一次，
+    只对候选计算距离，再按图片对合并取最小值。由鸽巢原理，距离不超过
+    max_distance 的变体一定有一个分段相差不超过 max_distance // 4 比特，结果是精确的。
+
+    Args:
+        variants: (n, 8) uint64 数组，第 0 列为原图哈希
+        max_distance: 最大汉明距离（包含）
+        chunk_probes: 每批查询的探测值个数上限
+        chunk_candidates: 每批展开的候选个数上限（按各探测值的区间长度切分，控制内存占用）
+
+    Returns:
+        (起点行号, 终点行号, 距离)，起点小于终点，按 (起点, 终点) 升序且无重复
+    """
+    n, count = variants.shape
+    same_src, same_dst = _exact_duplicate_edges(variants.min(axis=1))
+    src_parts, dst_parts = [same_src], [same_dst]
+    dist_parts = [np.zeros(len(same_src), dtype=np.uint8)]
+
+    if n > 1 and max_distance > 0:
+        table = np.ascontiguousarray(variants.reshape(-1))
+        orders, keys = build_multi_index(table)
+        offsets = bucket_offsets(keys)
+        segment_radius = min(max_distance // 4, 16)
+        chunk_size = max(chunk_probes // (len(orders) * len(segment_masks(segment_radius))), 1)
+
+        for start in range(0, n, chunk_size):
+            queries = variants[start:start + chunk_size, 0]
+            for query_index, rows in iter_multi_index_candidates(
+                orders, offsets, queries, segment_radius, chunk_candidates
+            ):
+                src, dst = query_index + start, rows // count
+                upper = dst > src
+                query_index, rows = query_index[upper], rows[upper]
+                distances = popcount64(queries[query_index] ^ table[rows])
+                mask = distances <= max_distance
+                src_parts.append(src[upper][mask])
+                dst_parts.append(dst[upper][mask])
+                dist_parts.append(distances[mask])
+
+    src = np.concatenate(src_parts).astype(np.int64)
+    dst = np.concatenate(dst_parts).astype(np.int64)
+    return _min_distance_edges(n, src, dst, np.concatenate(dist_parts).astype(np.uint8))
+
+
+def lsh_variant_similarity_edges(
+    variants: np.ndarray,
+    max_distance: int,
+    bands: int = 32,
+    rows: int = 16
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    旋转/翻转不敏感的 LSH 相似边（近似）
+
+    全部变体一起分桶，只保留“行号较小的图片的原图哈希 - 另一张图片的变体”
+    这样的候选对，与 variant_similarity_edges 的距离定义一致。
+
+    Args:
+        variants: (n, 8) uint64 数组，第 0 列为原图哈希
+        max_distance: 最大汉明距离（包含）
+        bands: LSH 分段数
+        rows: 每段采样的比特数
+
+    Returns:
+        (起点行号, 终点行号, 距离)，起点小于终点，按 (起点, 终点) 升序且无重复
+    """
+    n, count = variants.shape
+    table = variants.reshape(-1)
+    src_parts, dst_parts, dist_parts = [], [], []
+
+    for a, b in lsh_candidate_pairs(table, bands, rows):
+        owner_a, owner_b = a // count, b // count
+        keep = ((a % count == 0) & (owner_a < owner_b)) | ((b % count == 0) & (owner_b < owner_a))
+        if not keep.any():
+            continue
+        distances = popcount64(table[a[keep]] ^ table[b[keep]])
+        mask = distances <= max_distance
+        src_parts.append(owner_a[keep][mask])
+        dst_parts.append(owner_b[keep][mask])
+        dist_parts.append(distances[mask])
+
+    if not src_parts:
+        return _min_distance_edges(n, np.empty(0), np.empty(0), np.empty(0, dtype=np.uint8))
+    return _min_distance_edges(
+        n, np.concatenate(src_parts), np.concatenate(dst_parts), np.concatenate(dist_parts)
+    )
+
+
+def _window_ends(times: np.ndarray, window: float) -> np.ndarray:
+    """已排序的拍摄时间中，每个位置的时间窗口（不含）结束位置"""
+    return np.searchsorted(times, times + window, side="right")
+
+
+def time_block_comparisons(times: np.ndarray, window: float) -> Tuple[int, int]:
+    """
+    按拍摄时间分桶后需要比较的图片对数
+
+    Args:
+        times: 拍摄时间戳（秒），无拍摄时间为 NaN
+        window: 时间窗口（秒）
+
+    Returns:
+        (分桶后的比较次数, 全量两两比较次数)
+    """
+    n = len(times)
+    dated = np.sort(times[~np.isnan(times)])
+    undated = n - len(dated)
+    blocked = int((_window_ends(dated, window) - np.arange(len(dated)) - 1).sum())
+    # 无拍摄时间的图片与全部图片比较
+    blocked += undated * len(dated) + undated * (undated - 1) // 2
+    return blocked, n * (n - 1) // 2
+
+
+def _exact_duplicate_edges(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """哈希完全相同的图片两两相连（每组按行号连成星形，足以保证连通）"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    same = np.nonzero(sorted_keys[1:] == sorted_keys[:-1])[0] + 1
+    if not len(same):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # 每个位置所在连续相同段的第一个位置
+    starts = np.ones(len(keys), dtype=bool)
+    starts[same] = False
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(keys)), 0))
+    return order[first[same]], order[same]
+
+
+def time_blocked_similarity_edges(
+    hashes: np.ndarray,
+    times: np.ndarray,
+    window: float,
+    max_distance: int,
+    chunk_pairs: int = 1 << 22,
+    block_size: int = 256,
+    chunk_size: int = 8192
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按拍摄时间分桶的相似边
+
+    连拍与近似重复的照片几乎都在相近的时间拍摄。按拍摄时间排序后，
+    每张图片只与其后 window 秒内的图片比较（相当于相互重叠的滑动窗口）；
+    没有拍摄时间的图片与全部图片比较。另外对全部图片做一遍完全相同
+    哈希的匹配，拍摄时间被改动的真正副本也能归到一起。
+
+    Args:
+        hashes: uint64 哈希数组 (n,)，或旋转/翻转变体 (n, 8)（第 0 列为原图哈希）
+        times: 拍摄时间戳（秒），无拍摄时间为 NaN
+        window: 时间窗口（秒）
+        max_distance: 最大汉明距离（包含）
+        chunk_pairs: 每批计算的图片对数上限
+        block_size: 无拍摄时间的图片每块的行数
+        chunk_size: 无拍摄时间的图片每块的列数（变体模式下按变体数缩小，中间数组大小不变）
+
+    Returns:
+        (起点行号, 终点行号, 距离)，起点小于终点，按 (起点, 终点) 升序且无重复
+    """
+    n = len(hashes)
+    variants = hashes.ndim == 2
+    src_parts, dst_parts, dist_parts = [], [], []
+
+    # 时间窗口内的图片对
+    dated = np.nonzero(~np.isnan(times))[0]
+    dated = dated[np.argsort(times[dated], kind="stable")]
+    counts = _window_ends(times[dated], window) - np.arange(len(dated)) - 1
+    position = 0
+    while position < len(dated):
+        # 累计图片对数不超过 chunk_pairs（单个位置超过时也至少处理一个）
+        cumulative = np.cumsum(counts[position:])
+        stop = position + max(int(np.searchsorted(cumulative, chunk_pairs, side="right")), 1)
+        chunk_counts = counts[position:stop]
+        total = int(chunk_counts.sum())
+        if total:
+            left = np.repeat(np.arange(position, stop), chunk_counts)
+            starts = np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            right = left + np.arange(total) - starts + 1
+            a, b = dated[left], dated[right]
+            if variants:
+                distances = popcount64(hashes[a, 0, None] ^ hashes[b]).min(axis=1)
+            else:
+                distances = popcount64(hashes[a] ^ hashes[b])
+            mask = distances <= max_distance
+            src_parts.append(a[mask])
+            dst_parts.append(b[mask])
+            dist_parts.append(distances[mask])
+        position = stop
+
+    # 没有拍摄时间的图片（截图、去除了 EXIF 的导出图等）与全部图片比较
+    undated = np.nonzero(np.isnan(times))[0]
+    if variants:
+        chunk_size = max(chunk_size // hashes.shape[1], 1)
+    for row_start in range(0, len(undated), block_size):
+        rows = undated[row_start:row_start + block_size]
+        for col_start in range(0, n, chunk_size):
+            columns = hashes[col_start:col_start + chunk_size]
+            if variants:
+                distances = popcount64(hashes[rows, 0, None, None] ^ columns[None]).min(axis=2)
+            else:
+                distances = popcount64(hashes[rows, None] ^ columns[None])
+            r, c = np.nonzero(distances <= max_distance)
+            c_rows = c + col_start
+            keep = c_rows != rows[r]
+            src_parts.append(rows[r[keep]])
+            dst_parts.append(c_rows[keep])
+            dist_parts.append(distances[r[keep], c[keep]])
+
+    # 全局完全相同哈希（变体模式下为任意方向相同）
+    keys = hashes.min(axis=1) if variants else hashes
+    same_src, same_dst = _exact_duplicate_edges(keys)
+    src_parts.append(same_src)
+    dst_parts.append(same_dst)
+    dist_parts.append(np.zeros(len(same_src), dtype=np.uint8))
+
+    src = np.concatenate(src_parts).astype(np.int64)
+    dst = np.concatenate(dst_parts).astype(np.int64)
+    return _min_distance_edges(n, src, dst, np.concatenate(dist_parts).astype(np.uint8))
+
+
+def connected_components(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    向量化并查集：计算 n 个节点在给定边下的连通分量
+
+    交替执行“挂接”（每条边两端的根挂到较小的标签上）与指针跳跃，
+    迭代次数约为 O(log n)，全部在 numpy 中完成。
+
+    Returns:
+        每个节点所在分量的标签（分量内最小节点号）
+    """
+    labels = np.arange(n)
+    if len(src) == 0:
+        return labels
+
+    while True:
+        label_src, label_dst = labels[src], labels[dst]
+        if (label_src == label_dst).all():
+            return labels
+
+        lower = np.minimum(label_src, label_dst)
+        np.minimum.at(labels, label_src, lower)
+        np.minimum.at(labels, label_dst, lower)
+
+        # 指针跳跃直到每个节点直接指向根
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+
+def group_arrays_from_edges(
+    src_ids: np.ndarray,
+    dst_ids: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按传递闭包把相似边归为图片组，以紧凑数组形式返回
+
+    Args:
+        src_ids: 边起点的图片ID
+        dst_ids: 边终点的图片ID
+
+    Returns:
+        (members, offsets)：第 i 组为 members[offsets[i]:offsets[i + 1]]
+        （组内ID升序，组间按最小ID升序）
+    """
+    if len(src_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    nodes, inverse = np.unique(np.concatenate([src_ids, dst_ids]), return_inverse=True)
+    src = inverse[:len(src_ids)]
+    dst = inverse[len(src_ids):]
+    labels = connected_components(len(nodes), src, dst)
+
+    # 按标签排序后切分；标签即分量内最小节点号，节点又按ID升序
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    boundaries = np.nonzero(np.diff(sorted_labels))[0] + 1
+    offsets = np.concatenate([[0], boundaries, [len(order)]]).astype(np.int64)
+    return nodes[order].astype(np.int64), offsets
+
+
+def pack_groups(groups: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """将图片组列表转换为 (members, offsets) 紧凑数组"""
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(group) for group in groups])
+    members = np.fromiter(
+        (image_id for group in groups for image_id in group), dtype=np.int64, count=int(offsets[-1])
+    )
+    return members, offsets
+
+
+def groups_from_edges(
+    src_ids: np.ndarray,
+    dst_ids: np.ndarray
+) -> List[List[int]]:
+    """
+    按传递闭包把相似边归为图片组
+
+    Args:
+        src_ids: 边起点的图片ID
+        dst_ids: 边终点的图片ID
+
+    Returns:
+        相似图片组列表（组内ID升序，组间按最小ID升序）
+    """
+    members, offsets = group_arrays_from_edges(src_ids, dst_ids)
+    return [members[start:stop].tolist() for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
 def calculate_similarity_score(hash1: str, hash2: str) -> float:
     """
     计算相似度分数（百分比）
@@ -64,6 +597,237 @@ def calculate_similarity_score(hash1: str, hash2: str) -> float:
         相似度分数 0-100，100表示完全相同
     """
     distance = compare_hashes(hash1, hash2)
-    max_distance = 64  # 8x8 哈希最大汉明距离
+    return distance_to_similarity(distance)
+
+
+def distance_to_similarity(distance: int, max_distance: int = 64) -> float:
+    """
+    将汉明距离换算为相似度分数（百分比）
+
+    Args:
+        distance: 汉明距离
+        max_distance: 最大汉明距离，8x8 哈希为 64
+
+    Returns:
+        相似度分数 0-100，100表示完全相同
+    """
     similarity = (1 - distance / max_distance) * 100
     return max(0, min(100, similarity))
+
+
+def pairwise_distance_matrix(hashes: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    一次性计算组内两两汉明距离矩阵
+
+    Args:
+        hashes: uint64 哈希数组 (n,)，或旋转/翻转变体 (n, 8)（第一列为原图哈希）
+        rows: 只计算这些位置所在的行，默认计算全部
+
+    Returns:
+        (len(rows), n) uint8 距离矩阵，变体模式下取任意方向的最小距离
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    subset = hashes if rows is None else hashes[rows]
+    if hashes.ndim == 1:
+        return popcount64(subset[:, None] ^ hashes[None, :]).astype(np.uint8)
+
+    # 变体距离不对称：分别用两边的原图哈希去比对另一边的全部变体，取较小值
+    forward = popcount64(subset[:, None, :1] ^ hashes[None, :, :]).min(axis=2)
+    backward = popcount64(hashes[None, :, :1] ^ subset[:, None, :]).min(axis=2)
+    return np.minimum(forward, backward).astype(np.uint8)
+
+
+def rank_keepers(
+    pixels: np.ndarray,
+    sizes: np.ndarray,
+    mtimes: np.ndarray
+) -> np.ndarray:
+    """
+    为组内图片排序，第一个为建议保留的图片
+
+    依次比较：分辨率高者优先，文件大者优先（压缩损失少），修改时间早者优先（原始文件）。
+
+    Returns:
+        组内位置数组，按建议保留优先级排列
+    """
+    # lexsort 以最后一个键为主键
+    return np.lexsort((mtimes, -np.asarray(sizes, dtype=np.int64), -np.asarray(pixels, dtype=np.int64)))
+
+
+class UnionFind:
+    """并查集，记录每个集合的成员以便增量输出归属变化"""
+
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+        self.members: Dict[int, List[int]] = {}
+
+    def add(self, item: int):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.members[item] = [item]
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # 路径压缩
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: int, b: int) -> List[int]:
+        """
+        合并 a、b 所在集合（按集合大小合并）
+
+        Returns:
+            归属根节点发生变化的成员列表
+        """
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return []
+
+        if len(self.members[root_a]) < len(self.members[root_b]):
+            root_a, root_b = root_b, root_a
+
+        self.parent[root_b] = root_a
+        moved = self.members.pop(root_b)
+        self.members[root_a].extend(moved)
+        return moved
+
+    def groups(self) -> List[List[int]]:
+        """返回所有成员数大于1的集合"""
+        return [sorted(members) for members in self.members.values() if len(members) > 1]
+
+
+class OnlineClusterer:
+    """
+    在线聚类：哈希逐个到达时插入内存中的分段多重索引，并用并查集合并相似图片
+
+    与其他模式一样按传递闭包归组：A~B、B~C 时三者同组。
+    新哈希只与多重索引给出的候选比较：距离小于阈值的两个哈希至少有一个 16 位分段
+    相差不超过 (threshold - 1) // 4 比特。最近插入的哈希先放在尾部缓冲区中直接比较，
+    每积累 rebuild_every 个再整体排入多重索引（16 位分段排序为线性时间的基数排序）。
+
+    width 为 8 时每张图片插入全部旋转/翻转变体，查询只用原图哈希，
+    与 variant_similarity_edges 的距离定义一致。
+
+    比较过程中同时收集距离不超过 edge_distance 的相似边，扫描结束后直接写入
+    相似边文件，无需再做一遍全量的相似边计算。
+    """
+
+    def __init__(
+        self,
+        threshold: int = 10,
+        capacity: int = 1024,
+        rebuild_every: int = 4096,
+        width: int = 1,
+        edge_distance: Optional[int] = None
+    ):
+        self.threshold = threshold
+        self.rebuild_every = rebuild_every
+        self.width = width
+        # 收集的相似边的最大距离（包含），至少覆盖阈值
+        self.edge_distance = max(threshold - 1, edge_distance or 0)
+        self._edge_parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.uf = UnionFind()
+        self._ids = np.empty(capacity, dtype=np.int64)
+        # 第 i 张图片的哈希（或变体）位于 _hashes[i * width:(i + 1) * width]
+        self._hashes = np.empty(capacity * width, dtype=np.uint64)
+        self._size = 0
+        # 前 _indexed 张图片已排入多重索引，其余在尾部缓冲区中
+        self._indexed = 0
+        self._orders = None
+        self._offsets = None
+        self.group_count = 0
+
+    def _candidates(self, hash_value: int) -> np.ndarray:
+        """可能与 hash_value 相似的哈希行号：多重索引候选加尾部缓冲区"""
+        tail = np.arange(self._indexed * self.width, self._size * self.width)
+        if not self._indexed or self.edge_distance < 0:
+            return tail
+
+        # 候选可能重复，按图片去重后再收集相似边
+        _, rows = multi_index_candidates(
+            self._orders, self._offsets, np.array([hash_value], dtype=np.uint64),
+            min(self.edge_distance // 4, 16)
+        )
+        return np.concatenate([rows, tail])
+
+    def _reindex(self):
+        """把尾部缓冲区并入多重索引"""
+        self._orders, keys = build_multi_index(self._hashes[:self._size * self.width])
+        self._offsets = bucket_offsets(keys)
+        self._indexed = self._size
+
+    def add(self, image_id: int, hash_value: Union[int, List[int]]) -> Dict[int, int]:
+        """
+        插入一张图片并与已有图片合并
+
+        Args:
+            image_id: 图片ID
+            hash_value: 64 位哈希；width 大于 1 时为变体哈希列表（第 0 个为原图哈希）
+
+        Returns:
+            归属发生变化的图片：图片ID -> 所在组的根图片ID
+        """
+        values = np.atleast_1d(np.asarray(hash_value, dtype=np.uint64))
+        if len(values) != self.width:
+            raise ValueError(f"哈希个数 {len(values)} 与聚类宽度 {self.width} 不一致")
+
+        rows = self._candidates(int(values[0]))
+        distances = popcount64(self._hashes[rows] ^ values[0])
+        within = distances <= self.edge_distance
+        # 每张已有图片只保留最小距离（候选重复或多个变体命中）
+        owners, distances = rows[within] // self.width, distances[within]
+        order = np.lexsort((distances, owners))
+        owners, distances = owners[order], distances[order]
+        first = np.ones(len(owners), dtype=bool)
+        first[1:] = owners[1:] != owners[:-1]
+        owners, distances = owners[first], distances[first].astype(np.uint8)
+        if len(owners):
+            self._edge_parts.append((
+                self._ids[owners], np.full(len(owners), image_id, dtype=np.int64), distances
+            ))
+        matches = self._ids[owners[distances < self.threshold]]
+
+        if self._size == len(self._ids):
+            self._ids = np.resize(self._ids, self._size * 2)
+            self._hashes = np.resize(self._hashes, self._size * 2 * self.width)
+        self._ids[self._size] = image_id
+        self._hashes[self._size * self.width:(self._size + 1) * self.width] = values
+        self._size += 1
+        if self._size - self._indexed >= self.rebuild_every:
+            self._reindex()
+
+        self.uf.add(image_id)
+        changed = {}
+        for other in matches.tolist():
+            root_a, root_b = self.uf.find(image_id), self.uf.find(other)
+            if root_a == root_b:
+                continue
+
+            size_a = len(self.uf.members[root_a])
+            size_b = len(self.uf.members[root_b])
+            moved = self.uf.union(root_a, root_b)
+            root = self.uf.find(image_id)
+
+            # 两个组合并时组数减一；两张单图新成组时根节点本身也需要写出
+            self.group_count += 1 - (size_a > 1) - (size_b > 1)
+            for member in moved:
+                changed[member] = root
+            if size_a == 1 and size_b == 1:
+                changed[root] = root
+
+        return changed
+
+    def groups(self) -> List[List[int]]:
+        """返回当前所有相似图片组（图片ID）"""
+        return self.uf.groups()
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回收集到的相似边 (起点图片ID, 终点图片ID, 距离)，每对图片一条"""
+        if not self._edge_parts:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.uint8))
+        src, dst, distances = zip(*self._edge_parts)
+        return np.concatenate(src), np.concatenate(dst), np.concatenate(distances)
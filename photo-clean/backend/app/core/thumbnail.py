@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from PIL import ExifTags, Image
+
+from app.core.hash import get_exif_thumbnail, same_aspect_ratio
+
+logger = logging.getLogger(__name__)
+
+# 联系表背景色与 JPEG 质量
+SHEET_BACKGROUND = (240, 240, 240)
+JPEG_QUALITY = 80
+
+# JPEG 图片的宽高上限
+JPEG_MAX_DIMENSION = 65535
+
+# EXIF 方向 -> 摆正所需的变换
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _cache_path(cache_dir: str, file_path: str, stat: os.stat_result, size: int) -> str:
+    """缩略图缓存路径：路径、文件大小、修改时间或尺寸变化后自动失效"""
+    key = f"{file_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size}"
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(cache_dir, digest[:2], f"{digest}.jpg")
+
+
+def _render_thumbnail(file_path: str, size: int) -> Image.Image:
+    """解码并缩放图片，长边不超过 size"""
+    with Image.open(file_path) as img:
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+
+        # 足够大且宽高比一致的 EXIF 缩略图可直接使用，不解码主图
+        source = get_exif_thumbnail(img)
+        if source is None or max(source.size) < size or not same_aspect_ratio(source.size, img.size):
+            # JPEG 按 1/2、1/4、1/8 比例解码，大幅减少解码量
+            img.draft("RGB", (size, size))
+            source = img
+
+        result = source.convert("RGB")
+        result.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    # 缩略图按原图的 EXIF 方向摆正
+    method = _ORIENTATION_TRANSPOSE.get(orientation)
+    return result.transpose(method) if method is not None else result
+
+
+def get_thumbnail(file_path: str, size: int, cache_dir: str) -> Optional[Image.Image]:
+    """
+    获取缩略图，优先读取磁盘缓存
+
+    Args:
+        file_path: 图片路径
+        size: 缩略图长边像素
+        cache_dir: 缓存目录
+
+    Returns:
+        RGB 缩略图，文件不存在或无法解码时返回None
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    cache_path = _cache_path(cache_dir, file_path, stat, size)
+    try:
+        with Image.open(cache_path) as cached:
+            cached.load()
+            return cached.convert("RGB")
+    except (OSError, ValueError):
+        pass
+
+    try:
+        thumbnail = _render_thumbnail(file_path, size)
+    except Exception as e:
+        logger.warning(f"生成缩略图失败: {file_path}, 错误: {e}")
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # 先写临时文件再改名，并发请求不会读到写了一半的缓存
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        thumbnail.save(tmp_path, "JPEG", quality=JPEG_QUALITY)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"写入缩略图缓存失败: {cache_path}, 错误: {e}")
+
+    return thumbnail
+
+
+def build_contact_sheet(
+    groups: List[Dict],
+    tile_size: int,
+    columns: int,
+    cache_dir: str,
+    max_tiles: int,
+    max_pixels: int,
+    workers: int = 4,
+    render: bool = True
+) -> Tuple[Optional[bytes], Dict]:
+    """
+    将多个相似组的缩略图拼成一张联系表
+
+    每个组从新的一行开始，组内图片按 columns 列依次排列。
+    联系表的高度不超过 JPEG 的尺寸上限，总像素数不超过 max_pixels。
+
+    Args:
+        groups: 相似组列表（接口返回格式，含 group_id 和 images）
+        tile_size: 单个格子的边长（像素）
+        columns: 每行格子数
+        cache_dir: 缩略图缓存目录
+        max_tiles: 格子总数上限
+        max_pixels: 联系表像素数上限；超出格子数或像素数上限的图片不放入联系表（truncated 标记为 True）
+        workers: 并行生成缩略图的线程数
+        render: 为假时只计算布局（格子区域取决于缩略图尺寸），不拼接和编码图片
+
+    Returns:
+        (JPEG 数据, 布局)，布局中每个格子给出图片在联系表中的实际区域；
+        没有图片或不渲染时 JPEG 数据为 None
+    """
+    width = columns * tile_size
+    max_rows = min(JPEG_MAX_DIMENSION, max_pixels // width) // tile_size
+    tiles = []
+    row = 0
+    truncated = False
+    for group in groups:
+        limit = min(max_tiles - len(tiles), (max_rows - row) * columns)
+        images = group["images"][:max(limit, 0)]
+        if len(images) < len(group["images"]):
+            truncated = True
+        if not images:
+            break
+        for i, image in enumerate(images):
+            tiles.append({
+                "group_id": group["group_id"],
+                "image_id": image["id"],
+                "file_path": image["file_path"],
+                "x": (i % columns) * tile_size,
+                "y": (row + i // columns) * tile_size
+            })
+        row += (len(images) + columns - 1) // columns
+
+    layout = {
+        "tile_size": tile_size,
+        "columns": columns,
+        "width": width,
+        "height": row * tile_size,
+        "truncated": truncated,
+        "tiles": tiles
+    }
+    if not tiles:
+        return None, layout
+
+    # 缩略图解码和缩放大部分时间释放 GIL，线程并行即可
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        thumbnails = list(executor.map(
+            lambda tile: get_thumbnail(tile["file_path"], tile_size, cache_dir), tiles
+        ))
+
+    sheet = Image.new("RGB", (layout["width"], layout["height"]), SHEET_BACKGROUND) if render else None
+    for tile, thumbnail in zip(tiles, thumbnails):
+        if thumbnail is None:
+            tile.update(w=0, h=0)
+            continue
+        # 缩略图在格子内居中，坐标为图片实际所在区域
+        w, h = thumbnail.size
+        tile["x"] += (tile_size - w) // 2
+        tile["y"] += (tile_size - h) // 2
+        tile.update(w=w, h=h)
+        if render:
+            sheet.paste(thumbnail, (tile["x"], tile["y"]))
+
+    if not render:
+        return None, layout
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, "JPEG", quality=JPEG_QUALITY)
+    return buffer.getvalue(), layout
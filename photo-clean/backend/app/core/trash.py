@@ -0,0 +1,126 @@
+import errno
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 挂载点 -> 该挂载点上的回收站目录
+_mount_roots: Dict[str, str] = {}
+# 文件所在目录 -> 回收站目录（避免每个文件都向上查找挂载点）
+_dir_roots: Dict[str, str] = {}
+_volume_lock = threading.Lock()
+
+
+def _device_of(path: str) -> Optional[int]:
+    """路径所在文件系统的设备号，路径不存在时取最近的已存在上级目录"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def _mount_point(path: str) -> str:
+    """路径所在文件系统的挂载点（设备号发生变化的最上层目录）"""
+    path = os.path.abspath(path)
+    device = os.stat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != device:
+            return path
+        path = parent
+
+
+def _volume_trash_root(mount: str, device: int) -> Optional[str]:
+    """在文件所在卷的挂载点下创建回收站目录，无写权限时返回None"""
+    root = os.path.join(mount, settings.volume_trash_dirname)
+    try:
+        os.makedirs(root, exist_ok=True)
+        if os.stat(root).st_dev != device or not os.access(root, os.W_OK):
+            return None
+    except OSError as e:
+        logger.warning(f"无法在文件所在卷创建回收站: {root}, 错误: {e}")
+        return None
+    return root
+
+
+def _rename_works(directory: str, target_dir: str) -> bool:
+    """
+    在 directory 中创建临时文件并尝试 rename 到 target_dir
+
+    同一设备上的两个 bind mount（如 docker-compose 分别挂载的照片目录与回收站）
+    设备号相同，rename 仍会以 EXDEV 失败，只能实际试一次。
+    """
+    try:
+        fd, probe = tempfile.mkstemp(prefix=".trash-probe-", dir=directory)
+        os.close(fd)
+    except OSError:
+        return False
+
+    target = os.path.join(target_dir, os.path.basename(probe))
+    try:
+        os.rename(probe, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            logger.warning(f"无法将文件直接移入回收站: {target_dir}, 错误: {e}")
+        os.remove(probe)
+        return False
+    os.remove(target)
+    return True
+
+
+def _select_trash_root(directory: str, mount: str) -> str:
+    """为挂载点选择回收站：能直接 rename 到配置的回收站时使用它，否则使用挂载点下的回收站"""
+    device = os.stat(directory).st_dev
+    if device == _device_of(settings.trash_dir):
+        os.makedirs(settings.trash_dir, exist_ok=True)
+        if _rename_works(directory, settings.trash_dir):
+            return settings.trash_dir
+    return _volume_trash_root(mount, device) or settings.trash_dir
+
+
+def get_trash_root(file_path: str) -> str:
+    """
+    选择文件的回收站目录
+
+    文件所在挂载点能直接 rename 到配置的回收站时使用配置的回收站；否则使用
+    该挂载点下的回收站目录，移动文件只需一次 rename，不会退化为跨卷复制再删除。
+    每个挂载点只实际试探一次。所在卷不可写时回退到配置的回收站。
+
+    Args:
+        file_path: 待删除的文件路径
+
+    Returns:
+        回收站目录
+    """
+    if not settings.volume_trash:
+        return settings.trash_dir
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    with _volume_lock:
+        root = _dir_roots.get(directory)
+        if root is None or not os.path.isdir(root):
+            mount = _mount_point(directory)
+            root = _mount_roots.get(mount)
+            if root is None or not os.path.isdir(root):
+                root = _select_trash_root(directory, mount)
+                _mount_roots[mount] = root
+            _dir_roots[directory] = root
+    return root
+
+
+def trash_root_of(trash_path: str) -> str:
+    """回收站文件所属的回收站目录"""
+    parent = os.path.dirname(trash_path)
+    if os.path.basename(parent) == settings.volume_trash_dirname:
+        return parent
+    return settings.trash_dir
@@ -0,0 +1,112 @@
+import io
+import os
+from datetime import datetime
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Optional
+import logging
+
+from app.core.hash import analyze_image, partial_digest
+
+logger = logging.getLogger(__name__)
+
+# 哈希工作进程入口：本模块只依赖标准库、PIL 与 imagehash（经 app.core.hash），
+# 不会触发配置、数据库等模块的导入副作用。forkserver 预加载本模块后，
+# 新工作进程直接从已完成导入的服务进程 fork 出来。
+
+
+def warm_up() -> int:
+    """空任务，用于提前启动工作进程"""
+    return os.getpid()
+
+
+def _with_variants(info: Dict, result: Dict) -> Dict:
+    """附加旋转/翻转变体哈希（未计算时置空，避免数据库中残留旧的变体）与拍摄时间"""
+    result["canonical_hash"] = info.get("canonical_hash")
+    result["variant_hashes"] = info.get("variant_hashes")
+    result["captured_at"] = info.get("captured_at")
+    return result
+
+
+def process_single_image(
+    file_path: str,
+    fast_hash: bool = False,
+    variants: bool = False
+) -> Optional[Dict]:
+    """处理单个图片文件（在工作进程或线程中执行）"""
+    try:
+        # 获取文件信息
+        stat = os.stat(file_path)
+
+        # 一次解码同时计算哈希和获取图片信息
+        img_info = analyze_image(file_path, fast=fast_hash, variants=variants)
+        if not img_info:
+            return None
+
+        return _with_variants(img_info, {
+            "file_path": file_path,
+            "file_name": os.path.basename(file_path),
+            "file_size": stat.st_size,
+            "width": img_info["width"],
+            "height": img_info["height"],
+            "hash_value": img_info["hash_value"],
+            "hash_source": img_info["hash_source"],
+            "modified_at": datetime.fromtimestamp(stat.st_mtime),
+            "inode": stat.st_ino,
+            "partial_digest": partial_digest(file_path)
+        })
+    except Exception as e:
+        logger.error(f"处理图片失败: {file_path}, 错误: {e}")
+        return None
+
+
+def process_image_buffer(
+    file_path: str,
+    shm_name: str,
+    size: int,
+    mtime: float,
+    fast_hash: bool = False,
+    variants: bool = False,
+    inode: Optional[int] = None
+) -> Optional[Dict]:
+    """
+    解码共享内存中的图片（在解码进程中执行，不再访问磁盘）
+
+    Args:
+        file_path: 原始文件路径
+        shm_name: 共享内存名称
+        size: 文件字节数
+        mtime: 文件修改时间戳
+        fast_hash: 是否优先使用 EXIF 缩略图计算哈希
+        variants: 是否计算旋转/翻转变体哈希
+        inode: 文件的 inode 号
+
+    Returns:
+        图片信息字典，失败返回None
+    """
+    shm = SharedMemory(name=shm_name)
+    try:
+        view = shm.buf[:size]
+        try:
+            stream = io.BytesIO(view)
+            digest = partial_digest(view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+    info = analyze_image(stream, name=file_path, fast=fast_hash, variants=variants)
+    if not info:
+        return None
+
+    return _with_variants(info, {
+        "file_path": file_path,
+        "file_name": os.path.basename(file_path),
+        "file_size": size,
+        "width": info["width"],
+        "height": info["height"],
+        "hash_value": info["hash_value"],
+        "hash_source": info["hash_source"],
+        "modified_at": datetime.fromtimestamp(mtime),
+        "inode": inode,
+        "partial_digest": digest
+    })
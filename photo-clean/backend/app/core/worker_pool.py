@@ -0,0 +1,228 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 失败原因
+REASON_TIMEOUT = "timeout"
+REASON_CRASHED = "worker_crashed"
+
+
+def _init_worker(memory_limit_mb: Optional[int]):
+    """工作进程初始化：限制地址空间与单张图片的像素数"""
+    if not memory_limit_mb:
+        return
+
+    limit = memory_limit_mb * 1024 * 1024
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"无法限制工作进程内存: {e}")
+
+    # Pillow 在像素数超过 MAX_IMAGE_PIXELS 的两倍时直接拒绝解码（解压炸弹）
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = limit // 8
+
+
+class ResilientProcessPool:
+    """
+    带容错的进程池
+
+    - 每个任务有独立的时间预算，超时后终止进程池并重建，其余在途任务重新提交
+    - 工作进程崩溃（BrokenProcessPool）时重建进程池，并把当时在途的任务逐个
+      单独重跑，单独运行仍然崩溃的任务即为元凶
+    - 每个工作进程处理约 max_tasks_per_worker 个任务后整体回收，释放碎片化的内存
+    - 通过 initializer 为工作进程设置内存上限
+
+    任务通过 submit 提交，poll 驱动执行并返回已结束的任务。
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        task_timeout: Optional[float] = None,
+        max_tasks_per_worker: Optional[int] = None,
+        memory_limit_mb: Optional[int] = None,
+        mp_context=None
+    ):
+        self.workers = workers
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.memory_limit_mb = memory_limit_mb
+        self.mp_context = mp_context
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Deque[Tuple[Any, Callable, tuple]] = deque()
+        self._isolated: Deque[Tuple[Any, Callable, tuple]] = deque()
+        # future -> (key, fn, args, 截止时间, 是否单独运行)
+        self._inflight: Dict[Any, Tuple[Any, Callable, tuple, float, bool]] = {}
+        self._completed_since_start = 0
+        self.restarts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._isolated) + len(self._inflight)
+
+    def submit(self, key: Any, fn: Callable, *args):
+        """提交任务，key 用于在结果中识别任务"""
+        self._pending.append((key, fn, args))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def terminate(self):
+        """丢弃所有未完成的任务并立即终止工作进程"""
+        self._pending.clear()
+        self._isolated.clear()
+        self._inflight.clear()
+        self._kill()
+
+    def is_healthy(self) -> bool:
+        """工作进程是否都还在（空闲期间可能被 OOM killer 或内存上限终止）"""
+        if self._executor is None:
+            return True
+        if getattr(self._executor, "_broken", False):
+            return False
+        processes = (getattr(self._executor, "_processes", None) or {}).values()
+        return all(process.is_alive() for process in processes)
+
+    def warm_up(self, fn: Callable):
+        """提前启动全部工作进程（fn 为无参数的空任务）"""
+        if self._executor is None:
+            self._start()
+        futures = [self._executor.submit(fn) for _ in range(self.workers)]
+        wait(futures)
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self.mp_context,
+            initializer=_init_worker,
+            initargs=(self.memory_limit_mb,)
+        )
+        self._completed_since_start = 0
+
+    def _kill(self):
+        """立即终止所有工作进程（用于超时或进程池损坏）"""
+        if self._executor is None:
+            return
+        processes = list((getattr(self._executor, "_processes", None) or {}).values())
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout=5)
+        self._executor = None
+        self.restarts += 1
+
+    def _submit_to_executor(self, item, isolated: bool):
+        key, fn, args = item
+        deadline = time.monotonic() + self.task_timeout if self.task_timeout else float("inf")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # 工作进程在两次提交之间异常退出：重建进程池后重新提交
+            logger.warning("进程池已损坏，重建后重新提交任务")
+            self._kill()
+            self._start()
+            future = self._executor.submit(fn, *args)
+        self._inflight[future] = (key, fn, args, deadline, isolated)
+
+    def _fill(self):
+        if self._executor is None:
+            self._start()
+
+        # 达到回收阈值后不再提交新任务，等在途任务结束后重建进程池
+        if self.max_tasks_per_worker and \
+                self._completed_since_start >= self.workers * self.max_tasks_per_worker:
+            if self._inflight:
+                return
+            self.close()
+            self._start()
+
+        # 可疑任务逐个单独运行
+        if self._isolated:
+            if not self._inflight:
+                self._submit_to_executor(self._isolated.popleft(), isolated=True)
+            return
+
+        # 在途任务数不超过进程数，使提交时间近似于开始执行的时间
+        while self._pending and len(self._inflight) < self.workers:
+            self._submit_to_executor(self._pending.popleft(), isolated=False)
+
+    def poll(self, timeout: Optional[float] = None) -> List[Tuple[Any, Any, Optional[str]]]:
+        """
+        等待至少一个任务结束（或超时）
+
+        Args:
+            timeout: 最长等待时间（秒），None 表示等到有任务结束或超出时间预算
+
+        Returns:
+            [(key, 结果, 失败原因)]，成功时失败原因为 None
+        """
+        self._fill()
+        if not self._inflight:
+            return []
+
+        if self.task_timeout:
+            nearest = min(entry[3] for entry in self._inflight.values())
+            budget = max(nearest - time.monotonic(), 0)
+            timeout = budget if timeout is None else min(timeout, budget)
+
+        done, _ = wait(list(self._inflight), timeout=timeout, return_when=FIRST_COMPLETED)
+        outcomes = []
+        broken = False
+
+        for future in done:
+            key, fn, args, _, isolated = self._inflight.pop(future)
+            try:
+                outcomes.append((key, future.result(), None))
+                self._completed_since_start += 1
+            except BrokenProcessPool:
+                broken = True
+                if isolated:
+                    outcomes.append((key, None, REASON_CRASHED))
+                else:
+                    self._isolated.append((key, fn, args))
+            except Exception as e:
+                outcomes.append((key, None, f"error: {type(e).__name__}: {e}"))
+                self._completed_since_start += 1
+
+        if broken:
+            for key, fn, args, _, isolated in self._inflight.values():
+                if isolated:
+                    outcomes.append((key, None, REASON_CRASHED))
+                else:
+                    self._isolated.append((key, fn, args))
+            self._inflight.clear()
+            self._kill()
+            logger.warning(f"工作进程异常退出，重建进程池并逐个重试 {len(self._isolated)} 个可疑任务")
+            return outcomes
+
+        now = time.monotonic()
+        expired = [future for future, entry in self._inflight.items() if entry[3] <= now]
+        if expired:
+            for future in expired:
+                key = self._inflight.pop(future)[0]
+                logger.warning(f"任务超时（{self.task_timeout}s），终止进程池: {key}")
+                outcomes.append((key, None, REASON_TIMEOUT))
+            # 其余在途任务不受影响，重建进程池后优先重新提交
+            for key, fn, args, _, isolated in self._inflight.values():
+                (self._isolated if isolated else self._pending).appendleft((key, fn, args))
+            self._inflight.clear()
+            self._kill()
+
+        return outcomes
@@ -1,4 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Integer, String, Float, DateTime, Boolean,
+    Index, LargeBinary, UniqueConstraint
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -8,14 +13,81 @@ from app.config import settings
 # 确保数据库目录存在
 os.makedirs(os.path.dirname(settings.db_path), exist_ok=True)
 
-# 创建数据库引擎
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    """设置连接级 PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # 写入方持有锁时读连接最多等待的毫秒数
+        cursor.execute(f"PRAGMA busy_timeout = {settings.db_busy_timeout_ms}")
+        # 负数表示以 KiB 为单位的页缓存大小
+        cursor.execute(f"PRAGMA cache_size = -{settings.db_cache_kb}")
+        cursor.execute(f"PRAGMA mmap_size = {settings.db_mmap_mb * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            # WAL：读者读取快照，不会被写入方的提交阻塞；
+            # WAL 下 synchronous=NORMAL 仍保证崩溃一致性，只是断电时可能丢失最近的提交
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+    finally:
+        cursor.close()
+
+
+def create_writer_engine(db_path: str) -> Engine:
+    """
+    创建写入引擎
+
+    只有一个连接，所有写事务在应用内排队，避免多个写连接争抢 SQLite 的写锁。
+    """
+    writer = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False},
+        pool_size=1,
+        max_overflow=0
+    )
+    event.listen(writer, "connect", lambda conn, _: _apply_pragmas(conn, read_only=False))
+    return writer
+
+
+def create_reader_engine(db_path: str) -> Engine:
+    """
+    创建只读引擎（连接池）
+
+    以 mode=ro 打开，WAL 模式下读取不会等待扫描的写入事务。
+    """
+    reader = create_engine(
+        f"sqlite:///file:{db_path}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False},
+        pool_size=settings.db_read_pool_size,
+        max_overflow=settings.db_read_pool_size
+    )
+    event.listen(reader, "connect", lambda conn, _: _apply_pragmas(conn, read_only=True))
+    return reader
+
+
+def create_async_reader_engine(db_path: str) -> AsyncEngine:
+    """创建异步只读引擎（aiosqlite），在事件循环中查询而不占用线程池"""
+    reader = create_async_engine(
+        f"sqlite+aiosqlite:///file:{db_path}?mode=ro&uri=true",
+        pool_size=settings.db_read_pool_size,
+        max_overflow=settings.db_read_pool_size
+    )
+    event.listen(reader.sync_engine, "connect", lambda conn, _: _apply_pragmas(conn, read_only=True))
+    return reader
+
+
+# 创建数据库引擎：engine 负责写入（扫描、删除、恢复），
+# read_engine / async_read_engine 供接口查询
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{settings.db_path}"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+engine = create_writer_engine(settings.db_path)
+read_engine = create_reader_engine(settings.db_path)
+async_read_engine = create_async_reader_engine(settings.db_path)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -26,12 +98,19 @@ class ImageRecord(Base):
     id = Column(Integer, primary_key=True, index=True)
     file_path = Column(String, unique=True, index=True, nullable=False)
     file_name = Column(String, nullable=False)
+    dir_path = Column(String, index=True)  # 所在目录（规范化路径，不带末尾分隔符），按文件夹筛选时使用
     file_size = Column(Integer, nullable=False)  # 字节
     width = Column(Integer)
     height = Column(Integer)
     hash_value = Column(String, index=True)  # 感知哈希值
+    hash_source = Column(String, default="full")  # full 完整解码, thumbnail EXIF缩略图
+    canonical_hash = Column(String, index=True)  # 8种旋转/翻转变体哈希中的最小值
+    variant_hashes = Column(String)  # 8种变体哈希，逗号分隔，第一个为原图哈希
+    inode = Column(Integer)  # 用于识别被移动/重命名的文件
+    partial_digest = Column(String)  # 文件大小与首尾字节的摘要，跨卷复制后 inode 变化时使用
     created_at = Column(DateTime, default=datetime.utcnow)
     modified_at = Column(DateTime)
+    captured_at = Column(DateTime)  # EXIF 拍摄时间，按拍摄时间分桶比较时使用
     scanned_at = Column(DateTime, default=datetime.utcnow)
 
 
@@ -57,13 +136,151 @@ class ScanTask(Base):
     total_files = Column(Integer, default=0)
     processed_files = Column(Integer, default=0)
     similar_groups = Column(Integer, default=0)
+    cluster_mode = Column(String, default="exact")  # exact, lsh, online, time
+    threshold = Column(Integer, default=10)  # 扫描时使用的相似度阈值
+    # time 模式按拍摄时间分桶后的比较次数、全量两两比较次数与无拍摄时间的图片数
+    comparisons_blocked = Column(Integer)
+    comparisons_full = Column(Integer)
+    undated_files = Column(Integer)
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class ResolveJob(Base):
+    """批量处理任务表：按保留策略处理一个扫描任务的全部相似组"""
+    __tablename__ = "resolve_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    policy = Column(String, nullable=False)  # suggested, highest_resolution, largest_file, oldest, newest
+    threshold = Column(Integer)
+    batch_size = Column(Integer, default=500)
+    status = Column(String, default="pending")  # pending, running, completed, failed
+    total_groups = Column(Integer, default=0)
+    processed_groups = Column(Integer, default=0)
+    deleted_files = Column(Integer, default=0)
+    failed_files = Column(Integer, default=0)
+    resolved_files = Column(Integer, default=0)  # 生成计划时已不存在（此前已处理）的待删除图片数
+    out_of_range_files = Column(Integer, default=0)  # 与保留图片的距离超出阈值而未删除的图片数
+    freed_bytes = Column(Integer, default=0)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GroupMember(Base):
+    """相似组成员表（在线聚类模式下随扫描增量写入）"""
+    __tablename__ = "group_members"
+    __table_args__ = (UniqueConstraint("task_id", "image_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    image_id = Column(Integer, nullable=False)
+    group_key = Column(Integer, nullable=False)  # 组内根图片ID
+
+
+class GroupSummary(Base):
+    """相似组摘要表（扫描完成时按扫描阈值计算，展示分组时直接读取）"""
+    __tablename__ = "group_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    threshold = Column(Integer, nullable=False)
+    group_index = Column(Integer, nullable=False)
+    image_ids = Column(String, nullable=False)  # 组内图片ID，逗号分隔，第一个为建议保留的图片
+    distances = Column(LargeBinary)  # uint8 距离矩阵，大组只保存建议保留图片所在行
+
+
+class GroupImage(Base):
+    """相似组成员表（扫描阈值下的分组），按文件夹筛选分组与维护文件夹统计时使用"""
+    __tablename__ = "group_images"
+    __table_args__ = (
+        Index("ix_group_images_task_dir", "task_id", "dir_path"),
+        Index("ix_group_images_task_group", "task_id", "group_index"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False)
+    group_index = Column(Integer, nullable=False)
+    image_id = Column(Integer, nullable=False, index=True)
+    dir_path = Column(String, nullable=False)
+    file_size = Column(Integer, default=0)
+    rank = Column(Integer, default=0)  # 组内保留优先级，0 为建议保留的图片
+    removed = Column(Boolean, default=False)  # 图片已删除（移到回收站或记录已清除），恢复后重新计入
+
+
+class FolderStat(Base):
+    """文件夹重复统计表：目录（含子目录）下的相似组数、可删除的重复图片数与大小"""
+    __tablename__ = "folder_stats"
+    __table_args__ = (
+        UniqueConstraint("task_id", "dir_path", name="uq_folder_stats_task_dir"),
+        Index("ix_folder_stats_task_parent", "task_id", "parent_path"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, nullable=False)
+    dir_path = Column(String, nullable=False)
+    parent_path = Column(String)  # 上级目录，按层级展开文件夹树时使用
+    group_count = Column(Integer, default=0)
+    duplicate_count = Column(Integer, default=0)  # 建议保留图片以外的组成员数
+    duplicate_bytes = Column(Integer, default=0)
+
+
+class QuarantinedFile(Base):
+    """隔离文件表：处理失败的文件，大小和修改时间不变时后续扫描直接跳过"""
+    __tablename__ = "quarantined_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_path = Column(String, unique=True, index=True, nullable=False)
+    file_size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=False)  # 文件修改时间戳
+    reason = Column(String)  # timeout, worker_crashed, decode_failed, read_failed
+    failures = Column(Integer, default=1)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+def _add_missing_columns():
+    """为已存在的表补充新增的列（create_all 不会修改已有表结构）"""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column.type.compile(dialect=engine.dialect)}'
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, bool):
+                    ddl += f" DEFAULT {int(default)}"
+                elif isinstance(default, (int, float)):
+                    ddl += f" DEFAULT {default}"
+                elif isinstance(default, str):
+                    ddl += f" DEFAULT '{default}'"
+                conn.execute(text(ddl))
+
+            # 新增列上的索引同样不会由 create_all 创建
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def _backfill_dir_paths():
+    """为新增 dir_path 列之前的图片记录补充所在目录（末尾分隔符之前的部分）"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE images SET dir_path = coalesce("
+            "nullif(rtrim(rtrim(file_path, replace(file_path, :sep, '')), :sep), ''), :sep"
+            ") WHERE dir_path IS NULL"
+        ), {"sep": os.sep})
+
+
 # 创建所有表
 Base.metadata.create_all(bind=engine)
+_add_missing_columns()
+_backfill_dir_paths()
 
 
 def get_db():
@@ -73,3 +290,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    """获取只读数据库会话（不与扫描争抢写连接）"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    """获取异步只读数据库会话"""
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -2,6 +2,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import scan, images
 from app.config import settings
+from app.database import async_read_engine
+from app.core.pipeline import default_pool_options, shutdown_worker_pools, start_worker_pool
+from app.middleware import SelectiveCompressionMiddleware
 import logging
 
 # 配置日志
@@ -28,11 +31,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 压缩分组相关的大响应
+app.add_middleware(
+    SelectiveCompressionMiddleware,
+    prefixes=("/api/scan/groups",),
+    minimum_size=settings.compress_min_size
+)
+
 # 注册路由
 app.include_router(scan.router)
 app.include_router(images.router)
 
 
+@app.on_event("startup")
+def start_workers():
+    """预先启动常驻的哈希工作进程"""
+    if settings.scan_executor not in ("process", "hybrid"):
+        return
+    try:
+        start_worker_pool(settings.scan_workers, **default_pool_options())
+    except Exception as e:
+        logger.warning(f"预启动工作进程失败: {e}")
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    """关闭常驻的哈希工作进程"""
+    shutdown_worker_pools()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    """关闭异步只读连接池"""
+    await async_read_engine.dispose()
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -0,0 +1,32 @@
+from typing import Tuple
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# 安装 brotli-asgi 时按 Accept-Encoding 协商 br / gzip，否则只用 gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+class SelectiveCompressionMiddleware:
+    """
+    只压缩指定路径下的响应
+
+    分组列表、导出等大体积的 JSON / NDJSON / CSV 压缩后传输量可减少一个数量级；
+    图片预览本身已是压缩格式，直接透传，避免白白消耗 CPU。
+    """
+
+    def __init__(self, app: ASGIApp, prefixes: Tuple[str, ...], minimum_size: int = 1024):
+        self.app = app
+        self.prefixes = prefixes
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"].startswith(self.prefixes):
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 
@@ -33,15 +33,39 @@ class ImageResponse(ImageBase):
 class SimilarGroup(BaseModel):
     """相似图片组"""
     group_id: int
-    images: List[ImageResponse]
+    images: List[ImageResponse]  # 按建议保留优先级排列
+    keeper_id: Optional[int] = None  # 建议保留的图片ID（分辨率、文件大小、修改时间依次比较）
     similarity_scores: Optional[dict] = None  # 图片间的相似度分数
 
 
+class SimilarImage(ImageBase):
+    """相似图片查询结果"""
+    id: int
+    hash_value: str
+    modified_at: Optional[datetime] = None
+    distance: int  # 与查询图片的汉明距离
+    similarity: float  # 相似度百分比
+
+
+class SimilarImagesResponse(BaseModel):
+    """相似图片查询响应"""
+    query_hash: str
+    total: int
+    images: List[SimilarImage]
+
+
 class ScanRequest(BaseModel):
     """扫描请求"""
     scan_dir: Optional[str] = None  # 可选，默认使用配置的目录
     recursive: bool = True
     threshold: int = 10
+    cluster_mode: Optional[str] = None  # exact / lsh / online / time，默认使用配置
+    lsh_bands: Optional[int] = None
+    lsh_rows: Optional[int] = None
+    capture_window: Optional[int] = None  # time 模式的拍摄时间窗口（秒），默认使用配置
+    executor: Optional[str] = None  # process / thread / hybrid，默认使用配置
+    fast_hash: Optional[bool] = None  # 是否使用 EXIF 缩略图快速哈希，默认使用配置
+    rotation_invariant: Optional[bool] = None  # 是否匹配旋转/翻转后的图片，默认使用配置
 
 
 class ScanResponse(BaseModel):
@@ -59,6 +83,32 @@ class ScanProgress(BaseModel):
     processed_files: int
     similar_groups: int
     progress_percent: float
+    comparisons: Optional[Dict[str, int]] = None  # time 模式的比较次数（blocked / full / undated）
+
+
+class ResolveRequest(BaseModel):
+    """批量处理相似组请求"""
+    policy: str = "suggested"  # suggested / highest_resolution / largest_file / oldest / newest
+    threshold: Optional[int] = None  # 默认使用扫描时的阈值
+    dry_run: bool = False  # 只统计，不移动文件
+    batch_size: int = 500  # 每批移到回收站的文件数
+
+
+class ResolveProgress(BaseModel):
+    """批量处理进度"""
+    job_id: int
+    task_id: int
+    status: str
+    policy: str
+    threshold: Optional[int] = None
+    total_groups: int
+    processed_groups: int
+    deleted_files: int
+    failed_files: int
+    resolved_files: int
+    out_of_range_files: int
+    freed_bytes: int
+    progress_percent: float
 
 
 class DeleteRequest(BaseModel):
@@ -70,6 +120,7 @@ class DeleteResponse(BaseModel):
     """删除响应"""
     success: bool
     deleted_count: int
+    freed_bytes: int = 0  # 移到回收站的文件总大小
     failed_files: List[str] = []
     message: str
 
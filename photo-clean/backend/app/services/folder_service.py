@@ -0,0 +1,311 @@
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.database import FolderStat, GroupImage, ImageRecord, ScanTask
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FolderService:
+    """
+    按文件夹组织相似组
+
+    扫描完成时记录扫描阈值下每组成员所在的目录，并把组数、重复图片数与大小
+    累加到所在目录及其各级上级目录（直到扫描目录）；之后删除、恢复或移动图片时
+    按组增量更新，文件夹树无需重新统计即可显示。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def normalize_folder(folder: str) -> str:
+        """规范化文件夹路径（绝对路径，不带末尾分隔符）"""
+        return os.path.normpath(os.path.abspath(folder))
+
+    @staticmethod
+    def folder_range(folder: str) -> Tuple[str, str]:
+        """folder 的子目录所在的字符串区间 [folder/, folder0)，范围查询可走 dir_path 索引"""
+        prefix = os.path.join(folder, "")
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    @classmethod
+    def in_folder(cls, column, folder: str):
+        """列值为 folder 本身或其子目录的查询条件"""
+        prefix, upper = cls.folder_range(folder)
+        return or_(column == folder, (column >= prefix) & (column < upper))
+
+    @staticmethod
+    def folder_chain(dir_path: str, root: str) -> List[str]:
+        """目录及其各级上级目录，到扫描目录为止"""
+        chain = [dir_path]
+        root_prefix = os.path.join(root, "")
+        while dir_path != root:
+            parent = os.path.dirname(dir_path)
+            if parent == dir_path or not (parent == root or parent.startswith(root_prefix)):
+                break
+            chain.append(parent)
+            dir_path = parent
+        return chain
+
+    @classmethod
+    def _contribution(
+        cls,
+        members: Iterable[Tuple[str, int, int]],
+        root: str
+    ) -> Dict[str, List[int]]:
+        """
+        一个组对各目录统计的贡献
+
+        Args:
+            members: 组成员 (所在目录, 文件大小, 保留优先级)
+            root: 扫描目录
+
+        Returns:
+            目录 -> [组数, 重复图片数, 重复图片字节数]；不足两张图片时没有贡献
+        """
+        members = list(members)
+        if len(members) < 2:
+            return {}
+
+        keeper_rank = min(rank for _, _, rank in members)
+        stats: Dict[str, List[int]] = {}
+        for dir_path, file_size, rank in members:
+            for folder in cls.folder_chain(dir_path, root):
+                entry = stats.setdefault(folder, [1, 0, 0])
+                if rank != keeper_rank:
+                    entry[1] += 1
+                    entry[2] += file_size or 0
+        return stats
+
+    def _apply(self, task_id: int, deltas: Dict[str, List[int]]):
+        """把增量累加到文件夹统计"""
+        if not deltas:
+            return
+
+        stmt = sqlite_insert(FolderStat).values([
+            {
+                "task_id": task_id,
+                "dir_path": folder,
+                "parent_path": os.path.dirname(folder),
+                "group_count": groups,
+                "duplicate_count": duplicates,
+                "duplicate_bytes": size
+            }
+            for folder, (groups, duplicates, size) in deltas.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["task_id", "dir_path"],
+            set_={
+                "group_count": FolderStat.group_count + stmt.excluded.group_count,
+                "duplicate_count": FolderStat.duplicate_count + stmt.excluded.duplicate_count,
+                "duplicate_bytes": FolderStat.duplicate_bytes + stmt.excluded.duplicate_bytes
+            }
+        )
+        self.db.execute(stmt)
+
+    def clear(self, task_id: int):
+        """删除任务的组成员与文件夹统计（重新保存分组前调用）"""
+        self.db.query(GroupImage).filter(GroupImage.task_id == task_id).delete()
+        self.db.query(FolderStat).filter(FolderStat.task_id == task_id).delete()
+
+    def add_groups(self, task_id: int, root: str, groups: List[Tuple[int, List[ImageRecord]]]):
+        """
+        记录一批相似组的成员并累加文件夹统计（由调用方提交事务）
+
+        Args:
+            task_id: 任务ID
+            root: 扫描目录
+            groups: [(组序号, 按保留优先级排列的组内图片记录)]
+        """
+        root = self.normalize_folder(root)
+        rows = []
+        deltas: Dict[str, List[int]] = {}
+        for group_index, records in groups:
+            members = []
+            for rank, record in enumerate(records):
+                dir_path = record.dir_path or os.path.dirname(record.file_path)
+                members.append((dir_path, record.file_size, rank))
+                rows.append({
+                    "task_id": task_id,
+                    "group_index": group_index,
+                    "image_id": record.id,
+                    "dir_path": dir_path,
+                    "file_size": record.file_size,
+                    "rank": rank,
+                    "removed": False
+                })
+            for folder, (groups_delta, duplicates, size) in self._contribution(members, root).items():
+                entry = deltas.setdefault(folder, [0, 0, 0])
+                entry[0] += groups_delta
+                entry[1] += duplicates
+                entry[2] += size
+
+        if rows:
+            self.db.bulk_insert_mappings(GroupImage, rows)
+        for start in range(0, len(deltas), 500):
+            self._apply(task_id, dict(list(deltas.items())[start:start + 500]))
+
+    def _update_members(
+        self,
+        image_ids: List[int],
+        change: Callable[[GroupImage], None],
+        chunk_size: int = 500
+    ) -> List[Tuple[int, int]]:
+        """
+        修改图片所在各组的成员记录，并按修改前后的贡献之差增量更新文件夹统计
+
+        Args:
+            image_ids: 图片ID
+            change: 对这些图片的每条成员记录执行的修改
+
+        Returns:
+            受影响的组 [(任务ID, 组序号)]
+        """
+        affected_groups = []
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = set(image_ids[start:start + chunk_size])
+            affected = self.db.query(GroupImage.task_id, GroupImage.group_index).filter(
+                GroupImage.image_id.in_(chunk)
+            ).distinct().all()
+            if not affected:
+                continue
+
+            task_ids = {task_id for task_id, _ in affected}
+            roots = {
+                task_id: self.normalize_folder(scan_dir)
+                for task_id, scan_dir in self.db.query(ScanTask.id, ScanTask.scan_dir).filter(
+                    ScanTask.id.in_(task_ids)
+                )
+            }
+
+            for task_id, group_index in affected:
+                members = self.db.query(GroupImage).filter(
+                    GroupImage.task_id == task_id,
+                    GroupImage.group_index == group_index
+                ).all()
+                root = roots.get(task_id, os.sep)
+                before = self._active_contribution(members, root)
+                for member in members:
+                    if member.image_id in chunk:
+                        change(member)
+                after = self._active_contribution(members, root)
+
+                deltas = {}
+                for folder in before.keys() | after.keys():
+                    old = before.get(folder, [0, 0, 0])
+                    new = after.get(folder, [0, 0, 0])
+                    if old != new:
+                        deltas[folder] = [n - o for o, n in zip(old, new)]
+                self._apply(task_id, deltas)
+
+            self.db.flush()
+            self.db.query(FolderStat).filter(
+                FolderStat.task_id.in_(task_ids), FolderStat.group_count <= 0
+            ).delete(synchronize_session=False)
+            self.db.commit()
+            affected_groups.extend(affected)
+        return affected_groups
+
+    @classmethod
+    def _active_contribution(cls, members: List[GroupImage], root: str) -> Dict[str, List[int]]:
+        """组内未删除的成员对各目录统计的贡献"""
+        return cls._contribution(
+            ((m.dir_path, m.file_size, m.rank) for m in members if not m.removed), root
+        )
+
+    def remove_images(self, image_ids: List[int], chunk_size: int = 500) -> List[Tuple[int, int]]:
+        """
+        从各任务的相似组中移除图片（文件已删除或已不存在），增量扣减文件夹统计
+
+        成员记录只标记为已删除，从回收站恢复后重新计入；
+        组内只剩一张图片时该组不再是重复组，不再计入统计。
+
+        Returns:
+            受影响的组 [(任务ID, 组序号)]，调用方据此更新组摘要
+        """
+        def mark_removed(member: GroupImage):
+            member.removed = True
+        return self._update_members(image_ids, mark_removed, chunk_size)
+
+    def restore_images(self, image_ids: List[int], chunk_size: int = 500) -> List[Tuple[int, int]]:
+        """
+        把从回收站恢复的图片重新计入原来的相似组，增量累加文件夹统计
+
+        Returns:
+            受影响的组 [(任务ID, 组序号)]，调用方据此更新组摘要
+        """
+        def mark_restored(member: GroupImage):
+            member.removed = False
+        return self._update_members(image_ids, mark_restored, chunk_size)
+
+    def relink_images(self, dir_paths: Dict[int, str], chunk_size: int = 500):
+        """
+        被移动/重命名的图片改到新目录，文件夹统计随之从原目录转到新目录
+
+        Args:
+            dir_paths: 图片ID -> 新的所在目录
+        """
+        def move(member: GroupImage):
+            member.dir_path = dir_paths[member.image_id]
+        self._update_members(list(dir_paths), move, chunk_size)
+
+    def group_indexes(self, task_id: int, folder: str) -> List[int]:
+        """成员位于 folder（含子目录）中的组序号，升序"""
+        # 只剩一张未删除图片的组已不是重复组
+        duplicate_groups = self.db.query(GroupImage.group_index).filter(
+            GroupImage.task_id == task_id, GroupImage.removed == False
+        ).group_by(GroupImage.group_index).having(func.count() > 1)
+        rows = self.db.query(GroupImage.group_index).filter(
+            GroupImage.task_id == task_id,
+            GroupImage.removed == False,
+            self.in_folder(GroupImage.dir_path, self.normalize_folder(folder)),
+            GroupImage.group_index.in_(duplicate_groups)
+        ).distinct().order_by(GroupImage.group_index).all()
+        return [group_index for group_index, in rows]
+
+    def image_ids_in_folder(self, folder: str) -> List[int]:
+        """位于 folder（含子目录）中的图片ID"""
+        rows = self.db.query(ImageRecord.id).filter(
+            self.in_folder(ImageRecord.dir_path, self.normalize_folder(folder))
+        ).all()
+        return [image_id for image_id, in rows]
+
+    @classmethod
+    async def get_folder_stats_async(
+        cls,
+        db: AsyncSession,
+        task_id: int,
+        parent: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        异步读取文件夹统计
+
+        Args:
+            task_id: 任务ID
+            parent: 只返回该目录的直接子目录，默认返回全部目录
+
+        Returns:
+            按路径排序的 [{dir_path, group_count, duplicate_count, duplicate_bytes}]
+        """
+        stmt = select(
+            FolderStat.dir_path, FolderStat.group_count,
+            FolderStat.duplicate_count, FolderStat.duplicate_bytes
+        ).where(FolderStat.task_id == task_id)
+        if parent is not None:
+            stmt = stmt.where(FolderStat.parent_path == cls.normalize_folder(parent))
+
+        rows = (await db.execute(stmt.order_by(FolderStat.dir_path))).all()
+        return [
+            {
+                "dir_path": dir_path,
+                "group_count": group_count,
+                "duplicate_count": duplicate_count,
+                "duplicate_bytes": duplicate_bytes
+            }
+            for dir_path, group_count, duplicate_count, duplicate_bytes in rows
+        ]
@@ -1,8 +1,17 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.database import ImageRecord, OperationLog
 from app.config import settings
-from typing import List, Dict
+from app.core.hash import get_image_hash
+from app.core.hash_index import hash_to_int
+from app.core.similarity import distance_to_similarity
+from app.core.trash import get_trash_root, trash_root_of
+from app.services.folder_service import FolderService
+from app.services.scan_service import ScanService
+from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+import asyncio
 import shutil
 import os
 import logging
@@ -30,7 +39,9 @@ class ImageService:
         os.makedirs(settings.trash_dir, exist_ok=True)
 
         deleted_count = 0
+        freed_bytes = 0
         failed_files = []
+        deleted_paths = []
 
         for file_path in file_paths:
             try:
@@ -38,14 +49,16 @@ class ImageService:
                     failed_files.append(f"{file_path} (文件不存在)")
                     continue
 
+                file_size = os.path.getsize(file_path)
+
                 # 生成回收站路径
                 # 使用文件名和时间戳避免冲突
                 filename = os.path.basename(file_path)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
                 trash_filename = f"{timestamp}_{filename}"
-                trash_path = os.path.join(settings.trash_dir, trash_filename)
+                trash_path = os.path.join(get_trash_root(file_path), trash_filename)
 
-                # 移动文件到回收站
+                # 移动文件到回收站（回收站已确认可直接 rename，shutil.move 只做一次 rename）
                 shutil.move(file_path, trash_path)
 
                 # 记录操作日志
@@ -58,6 +71,8 @@ class ImageService:
                 self.db.add(log)
 
                 deleted_count += 1
+                freed_bytes += file_size
+                deleted_paths.append(file_path)
                 logger.info(f"文件已移动到回收站: {file_path} -> {trash_path}")
 
             except Exception as e:
@@ -66,13 +81,101 @@ class ImageService:
 
         self.db.commit()
 
+        # 从相似组中移除已删除的图片，组摘要与文件夹统计随之更新
+        if deleted_paths:
+            groups = FolderService(self.db).remove_images(self._image_ids(deleted_paths))
+            ScanService(self.db).refresh_group_summaries(groups)
+
         return {
             "success": deleted_count > 0,
             "deleted_count": deleted_count,
+            "freed_bytes": freed_bytes,
             "failed_files": failed_files,
             "message": f"成功删除 {deleted_count} 个文件，失败 {len(failed_files)} 个"
         }
 
+    def _image_ids(self, file_paths: List[str], chunk_size: int = 500) -> List[int]:
+        """按路径分批查询图片ID"""
+        image_ids = []
+        for start in range(0, len(file_paths), chunk_size):
+            image_ids.extend(image_id for image_id, in self.db.query(ImageRecord.id).filter(
+                ImageRecord.file_path.in_(file_paths[start:start + chunk_size])
+            ))
+        return image_ids
+
+    def get_query_hash(self, file_path: str) -> Optional[Dict]:
+        """
+        获取查询图片的哈希值
+
+        优先使用数据库中已保存的哈希，未扫描过的文件现场计算。
+
+        Returns:
+            {"hash_value": ..., "image_id": ...}，无法获取时返回None
+        """
+        record = self.db.query(ImageRecord.id, ImageRecord.hash_value).filter(
+            ImageRecord.file_path == file_path
+        ).first()
+        if record and record.hash_value:
+            return {"hash_value": record.hash_value, "image_id": record.id}
+
+        if not os.path.isfile(file_path):
+            return None
+
+        hash_value = get_image_hash(file_path)
+        if not hash_value:
+            return None
+        return {"hash_value": hash_value, "image_id": None}
+
+    def find_similar_images(
+        self,
+        hash_value: str,
+        k: int = 20,
+        max_distance: int = 10,
+        exclude_id: Optional[int] = None
+    ) -> Dict:
+        """
+        在哈希索引中查找与给定哈希最相近的图片
+
+        Args:
+            hash_value: 查询哈希值
+            k: 返回数量上限
+            max_distance: 最大汉明距离（包含）
+            exclude_id: 需要排除的图片ID
+
+        Returns:
+            按距离升序排列的相似图片
+        """
+        scan_service = ScanService(self.db)
+        # 有变体索引时（全局启用或做过旋转/翻转不敏感扫描）查询变体索引，一次检索覆盖所有方向
+        index = scan_service.get_hash_index(variants=True)
+        if index is None or len(index) == 0:
+            return {"query_hash": hash_value, "total": 0, "images": []}
+
+        ids, distances = index.knn(
+            hash_to_int(hash_value), k, max_distance, exclude_id=exclude_id
+        )
+        records = scan_service.load_images_by_ids(ids.tolist())
+
+        images = []
+        for image_id, distance in zip(ids.tolist(), distances.tolist()):
+            img = records.get(image_id)
+            if not img:
+                continue
+            images.append({
+                "id": img.id,
+                "file_path": img.file_path,
+                "file_name": img.file_name,
+                "file_size": img.file_size,
+                "width": img.width,
+                "height": img.height,
+                "hash_value": img.hash_value,
+                "modified_at": img.modified_at,
+                "distance": distance,
+                "similarity": round(distance_to_similarity(distance), 2)
+            })
+
+        return {"query_hash": hash_value, "total": len(images), "images": images}
+
     def restore_images(self, file_paths: List[str]) -> Dict:
         """
         从回收站恢复图片
@@ -85,6 +188,7 @@ class ImageService:
         """
         restored_count = 0
         failed_files = []
+        restored_paths = []
 
         for file_path in file_paths:
             try:
@@ -120,6 +224,7 @@ class ImageService:
                 self.db.add(restore_log)
 
                 restored_count += 1
+                restored_paths.append(file_path)
                 logger.info(f"文件已恢复: {log.trash_path} -> {file_path}")
 
             except Exception as e:
@@ -128,6 +233,11 @@ class ImageService:
 
         self.db.commit()
 
+        # 恢复的图片重新计入原来的相似组
+        if restored_paths:
+            groups = FolderService(self.db).restore_images(self._image_ids(restored_paths))
+            ScanService(self.db).refresh_group_summaries(groups)
+
         return {
             "success": restored_count > 0,
             "restored_count": restored_count,
@@ -184,21 +294,50 @@ class ImageService:
             回收站统计信息
         """
         # 统计回收站文件
-        active_logs = self.db.query(OperationLog).filter(
-            OperationLog.operation_type == "delete",
-            OperationLog.is_permanent == False
-        ).all()
+        trash_paths = [
+            row[0] for row in self.db.query(OperationLog.trash_path).filter(
+                OperationLog.operation_type == "delete",
+                OperationLog.is_permanent == False
+            )
+        ]
+        return self._trash_summary(trash_paths)
+
+    @staticmethod
+    async def get_trash_info_async(db: AsyncSession) -> Dict:
+        """
+        异步获取回收站信息：数据库查询走 aiosqlite，逐个 stat 交给线程池
 
+        Returns:
+            回收站统计信息
+        """
+        result = await db.execute(
+            select(OperationLog.trash_path).where(
+                OperationLog.operation_type == "delete",
+                OperationLog.is_permanent == False
+            )
+        )
+        trash_paths = result.scalars().all()
+        return await asyncio.to_thread(ImageService._trash_summary, trash_paths)
+
+    @staticmethod
+    def _trash_summary(trash_paths: List[str]) -> Dict:
+        """统计回收站文件大小（合计以及各卷回收站目录）"""
         total_size = 0
-        file_count = len(active_logs)
-
-        for log in active_logs:
-            if os.path.exists(log.trash_path):
-                total_size += os.path.getsize(log.trash_path)
+        roots: Dict[str, Dict] = {}
+        for trash_path in trash_paths:
+            if not trash_path:
+                continue
+            root = roots.setdefault(trash_root_of(trash_path), {"file_count": 0, "total_size": 0})
+            root["file_count"] += 1
+            if os.path.exists(trash_path):
+                size = os.path.getsize(trash_path)
+                root["total_size"] += size
+                total_size += size
 
         return {
-            "file_count": file_count,
+            "file_count": len(trash_paths),
             "total_size": total_size,
             "total_size_mb": round(total_size / 1024 / 1024, 2),
-            "retention_days": settings.trash_retention_days
+            "retention_days": settings.trash_retention_days,
+            "roots": [{"path": path, **stats} for path, stats in roots.items()]
         }
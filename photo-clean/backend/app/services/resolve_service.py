@@ -0,0 +1,269 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.hash_index import hash_to_int
+from app.database import ReadSessionLocal, ResolveJob
+from app.services.folder_service import FolderService
+from app.services.image_service import ImageService
+from app.services.scan_service import ScanService
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _resolution(image: Dict) -> int:
+    return (image["width"] or 0) * (image["height"] or 0)
+
+
+def _mtime(image: Dict, missing: float) -> float:
+    modified_at = image["modified_at"]
+    return datetime.fromisoformat(modified_at).timestamp() if modified_at else missing
+
+
+# 保留策略：排序键最小的图片被保留，其余移到回收站
+# suggested 使用分组时计算的建议保留图片（分辨率、文件大小、修改时间依次比较）
+KEEP_POLICIES: Dict[str, Optional[Callable[[Dict], tuple]]] = {
+    "suggested": None,
+    "highest_resolution": lambda img: (-_resolution(img), -img["file_size"]),
+    "largest_file": lambda img: (-img["file_size"], -_resolution(img)),
+    "oldest": lambda img: (_mtime(img, float("inf")), -_resolution(img)),
+    "newest": lambda img: (-_mtime(img, float("-inf")), -_resolution(img)),
+}
+
+
+def _keeper_distances(group: Dict, keeper: Dict) -> Dict[int, int]:
+    """
+    组内各图片到保留图片的汉明距离
+
+    保留的是建议保留图片时直接使用 keeper_distances；否则使用距离矩阵中
+    保留图片所在的行，大组没有完整矩阵时按原图哈希计算。
+    """
+    scores = group["similarity_scores"]
+    image_ids = scores["image_ids"]
+    if keeper["id"] == image_ids[0]:
+        return dict(zip(image_ids, scores["keeper_distances"]))
+    matrix = scores.get("distance_matrix")
+    if matrix:
+        return dict(zip(image_ids, matrix[image_ids.index(keeper["id"])]))
+    keeper_hash = hash_to_int(keeper["hash_value"])
+    return {
+        img["id"]: (hash_to_int(img["hash_value"]) ^ keeper_hash).bit_count()
+        for img in group["images"]
+    }
+
+
+class ResolveService:
+    """批量处理相似组：按保留策略为每组保留一张图片，其余分批移到回收站"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def plan(
+        self,
+        task_id: int,
+        policy: str,
+        threshold: Optional[int] = None
+    ) -> Tuple[List[Tuple[int, str, List[str], int]], List[int], List[int]]:
+        """
+        按保留策略生成处理计划
+
+        相似组按传递闭包归组，组内图片与保留图片的距离可能超出阈值；
+        只有与保留图片的距离小于阈值的图片才列为待删除，其余保留并单独返回。
+        保留的图片已不存在时跳过整组，避免把一组图片全部删除。
+        待删除的图片已不存在（此前已处理过）时不再列入计划，单独返回；
+        没有剩余待删除图片的组同样不列入。
+        分组在只读会话中读取，遍历全部组期间不占用唯一的写连接。
+
+        Returns:
+            ([(组ID, 保留的图片路径, 待删除的图片路径, 待删除文件总大小)],
+             已不存在的待删除图片ID, 与保留图片距离超出阈值而保留的图片ID)
+        """
+        sort_key = KEEP_POLICIES[policy]
+        plan = []
+        gone = []
+        out_of_range = []
+        read_db = ReadSessionLocal()
+        try:
+            scan_service = ScanService(read_db)
+            if threshold is None:
+                threshold = scan_service.get_default_threshold(task_id)
+            for group in scan_service.iter_similar_groups(task_id, threshold, include_matrix=True):
+                images = group["images"]
+                if len(images) < 2:
+                    continue
+
+                if sort_key is None:
+                    keeper = next(img for img in images if img["id"] == group["keeper_id"])
+                else:
+                    keeper = min(images, key=sort_key)
+
+                if not os.path.exists(keeper["file_path"]):
+                    logger.warning(f"保留的图片不存在，跳过相似组 #{group['group_id']}: {keeper['file_path']}")
+                    continue
+
+                distances = _keeper_distances(group, keeper)
+                losers = []
+                for img in images:
+                    if img["id"] == keeper["id"]:
+                        continue
+                    if distances[img["id"]] >= threshold:
+                        out_of_range.append(img["id"])
+                    elif os.path.exists(img["file_path"]):
+                        losers.append(img)
+                    else:
+                        gone.append(img["id"])
+                if not losers:
+                    continue
+
+                plan.append((
+                    group["group_id"],
+                    keeper["file_path"],
+                    [img["file_path"] for img in losers],
+                    sum(img["file_size"] for img in losers)
+                ))
+        finally:
+            read_db.close()
+        return plan, gone, out_of_range
+
+    def summarize(
+        self,
+        task_id: int,
+        policy: str,
+        threshold: Optional[int] = None,
+        sample_size: int = 20
+    ) -> Dict:
+        """
+        试运行：只统计处理结果，不移动任何文件
+
+        Returns:
+            组数、待删除文件数、已不存在的待删除文件数、超出阈值而保留的文件数、
+            可释放空间以及前 sample_size 组的处理明细
+        """
+        plan, gone, out_of_range = self.plan(task_id, policy, threshold)
+        return {
+            "task_id": task_id,
+            "policy": policy,
+            "threshold": threshold,
+            "dry_run": True,
+            "total_groups": len(plan),
+            "delete_files": sum(len(losers) for _, _, losers, _ in plan),
+            "resolved_files": len(gone),
+            "out_of_range_files": len(out_of_range),
+            "freed_bytes": sum(size for _, _, _, size in plan),
+            "samples": [
+                {"group_id": group_id, "keep": keeper, "delete": losers}
+                for group_id, keeper, losers, _ in plan[:sample_size]
+            ]
+        }
+
+    def create_job(self, task_id: int, policy: str, threshold: int, batch_size: int) -> ResolveJob:
+        """创建批量处理任务"""
+        job = ResolveJob(
+            task_id=task_id,
+            policy=policy,
+            threshold=threshold,
+            batch_size=batch_size,
+            status="pending",
+            started_at=datetime.utcnow()
+        )
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def update_job_status(self, job_id: int, status: str, **kwargs):
+        """更新批量处理任务状态"""
+        job = self.db.query(ResolveJob).filter(ResolveJob.id == job_id).first()
+        if job:
+            job.status = status
+            for key, value in kwargs.items():
+                setattr(job, key, value)
+            self.db.commit()
+
+    def run_job(self, job_id: int):
+        """
+        执行批量处理任务
+
+        生成计划期间任务即为 running。与保留图片距离超出阈值的图片不删除，
+        只计入 out_of_range_files。已不存在的待删除图片计为已处理，
+        并从已保存的相似组中移除；其余图片按 batch_size 分批移到回收站，
+        每批结束后更新进度。
+        """
+        job = self.db.query(ResolveJob).filter(ResolveJob.id == job_id).first()
+        if not job:
+            return
+        # 生成计划期间不占用写连接（对象先脱离会话，提交后无需重新加载）
+        self.db.expunge(job)
+        self.update_job_status(job_id, "running")
+
+        try:
+            plan, gone, out_of_range = self.plan(job.task_id, job.policy, job.threshold)
+            self.update_job_status(
+                job_id, "running", total_groups=len(plan), resolved_files=len(gone),
+                out_of_range_files=len(out_of_range)
+            )
+            if gone:
+                groups = FolderService(self.db).remove_images(gone)
+                ScanService(self.db).refresh_group_summaries(groups)
+            logger.info(
+                f"开始批量处理相似组: {len(plan)} 组, 策略: {job.policy}，"
+                f"{len(gone)} 个待删除文件已不存在，{len(out_of_range)} 个文件与保留图片的距离超出阈值"
+            )
+
+            image_service = ImageService(self.db)
+            stats = {"processed_groups": 0, "deleted_files": 0, "failed_files": 0, "freed_bytes": 0}
+            batch: List[str] = []
+            batch_groups = 0
+
+            for i, (_, _, losers, _) in enumerate(plan):
+                batch.extend(losers)
+                batch_groups += 1
+                if len(batch) < job.batch_size and i < len(plan) - 1:
+                    continue
+
+                result = image_service.delete_images(batch)
+                stats["processed_groups"] += batch_groups
+                stats["deleted_files"] += result["deleted_count"]
+                stats["failed_files"] += len(result["failed_files"])
+                stats["freed_bytes"] += result["freed_bytes"]
+                self.update_job_status(job_id, "running", **stats)
+                batch, batch_groups = [], 0
+
+            self.update_job_status(job_id, "completed", completed_at=datetime.utcnow())
+            logger.info(
+                f"批量处理完成: 删除 {stats['deleted_files']} 个文件，失败 {stats['failed_files']} 个"
+            )
+
+        except Exception as e:
+            logger.error(f"批量处理任务失败: {e}")
+            self.update_job_status(job_id, "failed", completed_at=datetime.utcnow())
+            raise
+
+    @staticmethod
+    async def get_job_progress_async(db: AsyncSession, job_id: int) -> Optional[Dict]:
+        """异步获取批量处理任务进度"""
+        job = await db.get(ResolveJob, job_id)
+        if not job:
+            return None
+
+        progress = 0
+        if job.total_groups > 0:
+            progress = (job.processed_groups / job.total_groups) * 100
+
+        return {
+            "job_id": job.id,
+            "task_id": job.task_id,
+            "status": job.status,
+            "policy": job.policy,
+            "threshold": job.threshold,
+            "total_groups": job.total_groups,
+            "processed_groups": job.processed_groups,
+            "deleted_files": job.deleted_files,
+            "failed_files": job.failed_files,
+            "resolved_files": job.resolved_files,
+            "out_of_range_files": job.out_of_range_files,
+            "freed_bytes": job.freed_bytes,
+            "progress_percent": round(progress, 2)
+        }
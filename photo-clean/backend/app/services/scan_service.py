@@ -1,45 +1,34 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, update
 from sqlalchemy.orm import Session
-from app.database import ImageRecord, ScanTask
-from app.core.scanner import scan_directory, get_file_info
-from app.core.hash import get_image_hash, get_image_info
-from app.core.similarity import find_similar_groups
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Dict
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.database import ImageRecord, ScanTask, GroupImage, GroupMember, GroupSummary, QuarantinedFile
+from app.core.scanner import scan_directory
+from app.core.pipeline import default_pool_options, iter_hash_results
+from app.core.hash import HASH_SOURCE_THUMBNAIL, VARIANT_COUNT, partial_digest
+from app.core.similarity import (
+    exact_similarity_edges, lsh_similarity_edges, group_arrays_from_edges, pack_groups,
+    variant_similarity_edges, lsh_variant_similarity_edges,
+    time_blocked_similarity_edges, time_block_comparisons,
+    distance_to_similarity, pairwise_distance_matrix, rank_keepers,
+    OnlineClusterer
+)
+from app.core.edge_store import load_edge_store, write_edge_store
+from app.core.scan_state import ScanState
+from app.core.shard import PartialIndex, missing_shards
+from app.core.hash_index import HashIndex, hash_to_int, load_hash_index, write_hash_index
+from app.services.folder_service import FolderService
+from app.config import settings
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime
+import numpy as np
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
-
-def process_single_image(file_path: str) -> Dict:
-    """处理单个图片文件（用于多进程）"""
-    try:
-        # 获取文件信息
-        file_info = get_file_info(file_path)
-
-        # 计算哈希
-        hash_value = get_image_hash(file_path)
-        if not hash_value:
-            return None
-
-        # 获取图片信息
-        img_info = get_image_info(file_path)
-        if not img_info:
-            return None
-
-        return {
-            "file_path": file_path,
-            "file_name": file_info["name"],
-            "file_size": file_info["size"],
-            "width": img_info["width"],
-            "height": img_info["height"],
-            "hash_value": hash_value,
-            "modified_at": datetime.fromtimestamp(file_info["modified_at"])
-        }
-    except Exception as e:
-        logger.error(f"处理图片失败: {file_path}, 错误: {e}")
-        return None
+# 超过该大小的组只保存建议保留图片到其余图片的距离，避免平方级的矩阵
+GROUP_MATRIX_MAX_SIZE = 256
 
 
 class ScanService:
@@ -75,7 +64,15 @@ class ScanService:
         scan_dir: str,
         recursive: bool = True,
         threshold: int = 10,
-        workers: int = 4
+        workers: int = 4,
+        cluster_mode: str = "exact",
+        lsh_bands: int = 32,
+        lsh_rows: int = 16,
+        executor: str = "process",
+        fast_hash: bool = False,
+        rotation_invariant: bool = False,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        capture_window: int = 3600
     ) -> Dict:
         """
         扫描并处理图片
@@ -86,17 +83,28 @@ class ScanService:
             recursive: 是否递归
             threshold: 相似度阈值
             workers: 工作进程数
+            cluster_mode: 聚类模式 exact / lsh / online / time
+            lsh_bands: LSH 分段数
+            lsh_rows: LSH 每段采样比特数
+            executor: 解码执行方式 process / thread / hybrid
+            fast_hash: 是否优先使用 EXIF 缩略图计算哈希
+            rotation_invariant: 是否将旋转/翻转后的图片视为相似
+            progress_callback: 进度回调 (已处理文件数, 文件总数)，与任务进度同步调用
+            capture_window: time 模式的拍摄时间窗口（秒）
 
         Returns:
             处理结果字典
         """
         try:
             # 更新任务状态
-            self.update_task_status(task_id, "running")
+            self.update_task_status(
+                task_id, "running", cluster_mode=cluster_mode, threshold=threshold
+            )
 
             # 扫描目录
             logger.info(f"开始扫描目录: {scan_dir}")
-            image_files = scan_directory(scan_dir, recursive)
+            unreadable_dirs = []
+            image_files = scan_directory(scan_dir, recursive, errors=unreadable_dirs)
 
             if not image_files:
                 self.update_task_status(
@@ -106,66 +114,526 @@ class ScanService:
                     processed_files=0,
                     completed_at=datetime.utcnow()
                 )
-                return {"groups": [], "total_files": 0}
+                return {"total_files": 0, "similar_groups": 0}
 
             total_files = len(image_files)
             self.update_task_status(task_id, "running", total_files=total_files)
 
+            walked_files = image_files
+
+            # 跳过此前处理失败且未被修改过的文件
+            quarantined = self._load_quarantine()
+            if quarantined:
+                image_files = [
+                    path for path in image_files
+                    if not self._is_quarantined(path, quarantined)
+                ]
+                skipped = total_files - len(image_files)
+                if skipped:
+                    logger.info(f"跳过 {skipped} 个已隔离的文件")
+
+            # 每张图片一个原图哈希；旋转不敏感时为 8 个变体哈希
+            state = ScanState(VARIANT_COUNT if rotation_invariant else 1)
+
+            # 在线模式：结果到达即聚类，组成员随进度增量写入数据库，
+            # 比较时顺带收集相似边，扫描结束后无需再全量计算
+            clusterer = None
+            if cluster_mode == "online":
+                clusterer = OnlineClusterer(
+                    threshold, width=state.hash_width,
+                    edge_distance=max(settings.edge_max_distance, threshold - 1)
+                )
+            pending_members = {}
+
+            # 被移动/重命名的文件沿用原记录的哈希，无需重新解码；
+            # 之后仍未出现在本次遍历结果中的记录对应的文件已不存在，批量清除
+            image_files, moved = self._relink_moved_files(scan_dir, recursive, image_files)
+            self.reconcile_missing(scan_dir, recursive, walked_files, unreadable_dirs)
+            for record in moved:
+                hash_row = self._hash_row(record, rotation_invariant)
+                if rotation_invariant and isinstance(hash_row, int):
+                    # 原记录没有变体哈希，仍需解码计算
+                    image_files.append(record["file_path"])
+                    continue
+                state.add(
+                    record["id"], hash_row,
+                    record["hash_source"] == HASH_SOURCE_THUMBNAIL, record["captured_at"]
+                )
+                if clusterer:
+                    pending_members.update(clusterer.add(record["id"], hash_row))
+
             # 多进程处理图片
-            logger.info(f"开始处理 {total_files} 个图片文件，使用 {workers} 个进程")
-            processed_count = 0
-            image_hashes = {}
+            logger.info(f"开始处理 {len(image_files)} 个图片文件，使用 {workers} 个 {executor} 工作单元")
+            processed_count = total_files - len(image_files)
 
-            with ProcessPoolExecutor(max_workers=workers) as executor:
-                future_to_path = {
-                    executor.submit(process_single_image, path): path
-                    for path in image_files
-                }
+            results = iter_hash_results(
+                image_files,
+                executor,
+                workers,
+                settings.prefetch_threads,
+                fast_hash=fast_hash,
+                variants=rotation_invariant,
+                **default_pool_options()
+            )
 
-                for future in as_completed(future_to_path):
-                    result = future.result()
-                    if result:
-                        # 保存到数据库
-                        self._save_or_update_image(result)
-                        image_hashes[result["file_path"]] = result["hash_value"]
+            for file_path, result, error in results:
+                if error:
+                    self._quarantine_file(file_path, error)
+                elif file_path in quarantined:
+                    # 文件修改后处理成功，解除隔离
+                    self._release_quarantine(file_path)
 
-                    processed_count += 1
+                if result:
+                    # 保存到数据库
+                    image_id = self._save_or_update_image(result)
+                    hash_row = self._hash_row(result, rotation_invariant)
+                    state.add(
+                        image_id,
+                        hash_row,
+                        result.get("hash_source") == HASH_SOURCE_THUMBNAIL,
+                        result.get("captured_at")
+                    )
 
-                    # 更新进度
-                    if processed_count % 100 == 0 or processed_count == total_files:
-                        self.update_task_status(
-                            task_id,
-                            "running",
-                            processed_files=processed_count
-                        )
-                        logger.info(f"处理进度: {processed_count}/{total_files}")
+                    if clusterer:
+                        pending_members.update(clusterer.add(image_id, hash_row))
 
-            # 查找相似图片组
-            logger.info("开始查找相似图片组")
-            groups = find_similar_groups(image_hashes, threshold)
+                processed_count += 1
 
-            # 完成任务
-            self.update_task_status(
-                task_id,
-                "completed",
-                processed_files=processed_count,
-                similar_groups=len(groups),
-                completed_at=datetime.utcnow()
+                # 更新进度
+                if processed_count % 100 == 0 or processed_count == total_files:
+                    progress = {"processed_files": processed_count}
+                    if clusterer:
+                        self._save_group_members(task_id, pending_members)
+                        pending_members = {}
+                        progress["similar_groups"] = clusterer.group_count
+
+                    self.update_task_status(task_id, "running", **progress)
+                    logger.info(f"处理进度: {processed_count}/{total_files}")
+                    if progress_callback:
+                        progress_callback(processed_count, total_files)
+
+            return self._finish_scan(
+                task_id, state, processed_count, threshold, cluster_mode,
+                lsh_bands, lsh_rows, executor, workers, capture_window,
+                edges=clusterer.edges() if clusterer else None
             )
 
-            return {
-                "groups": groups,
-                "total_files": processed_count,
-                "similar_groups": len(groups)
+        except Exception as e:
+            logger.error(f"扫描任务失败: {e}")
+            self.update_task_status(task_id, "failed", completed_at=datetime.utcnow())
+            raise
+
+    def _finish_scan(
+        self,
+        task_id: int,
+        state: ScanState,
+        processed_count: int,
+        threshold: int,
+        cluster_mode: str,
+        lsh_bands: int,
+        lsh_rows: int,
+        executor: str,
+        workers: int,
+        capture_window: int = 3600,
+        edges: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+    ) -> Dict:
+        """
+        哈希全部入库后的收尾：计算相似边、重建哈希索引、分组并完成任务
+
+        Args:
+            state: 本次扫描的图片ID与哈希
+            processed_count: 已处理的文件数
+            capture_window: time 模式的拍摄时间窗口（秒）
+            edges: 在线模式聚类时已收集的相似边 (起点图片ID, 终点图片ID, 距离)，
+                给出时不再重新计算
+
+        Returns:
+            处理结果字典
+        """
+        rotation_invariant = state.hash_width > 1
+        # 分组需要覆盖本次扫描的阈值；保存的相似边不超过 settings.edge_max_distance，
+        # 更大的阈值调整时回退到哈希索引现场分组，避免阈值过大时保存接近全部的图片对
+        edge_max_distance = max(settings.edge_max_distance, threshold - 1)
+
+        # 生成相似边，之后任意不超过最大距离的阈值都可直接重新分组
+        ids = state.ids()
+        hashes = state.hashes()
+        times = state.captured_times()
+        result = {}
+        comparisons = {}
+        if edges is not None:
+            src, dst, distances = edges
+        else:
+            src, dst, distances = self._compute_edges(
+                ids, hashes, edge_max_distance, cluster_mode, lsh_bands, lsh_rows,
+                times, capture_window
+            )
+
+        if cluster_mode == "time":
+            blocked, full = time_block_comparisons(times, capture_window)
+            undated = int(np.isnan(times).sum())
+            result["comparisons"] = {"blocked": blocked, "full": full, "undated": undated}
+            # 记录到任务上，进度接口与命令行输出都可查看
+            comparisons = {
+                "comparisons_blocked": blocked,
+                "comparisons_full": full,
+                "undated_files": undated
             }
+            logger.info(
+                f"按拍摄时间分桶：比较 {blocked} 对，全量比较需 {full} 对"
+                f"（减少 {(1 - blocked / full) * 100 if full else 0:.1f}%）"
+            )
+
+        # 快速哈希：阈值附近的缩略图哈希完整解码确认后重新计算相似边
+        thumbnail_ids = state.thumbnail_ids()
+        if len(thumbnail_ids):
+            confirmed = self._confirm_thumbnail_hashes(
+                src, dst, distances, thumbnail_ids, threshold,
+                executor, workers, rotation_invariant
+            )
+            if confirmed:
+                order = np.argsort(ids)
+                for image_id, hash_row in confirmed.items():
+                    hashes[order[np.searchsorted(ids, image_id, sorter=order)]] = hash_row
+                src, dst, distances = self._compute_edges(
+                    ids, hashes, edge_max_distance,
+                    cluster_mode if cluster_mode in ("lsh", "time") else "exact", lsh_bands, lsh_rows,
+                    times, capture_window
+                )
+
+        # 更新持久化哈希索引（变体扫描同时更新变体索引）
+        self.rebuild_hash_index(variants=rotation_invariant)
+
+        stored = distances <= settings.edge_max_distance
+        write_edge_store(
+            self._edge_path(task_id), src[stored], dst[stored], distances[stored],
+            settings.edge_max_distance
+        )
+
+        # 查找相似图片组，连同距离矩阵和建议保留的图片一起保存
+        within = distances < threshold
+        members, offsets = group_arrays_from_edges(src[within], dst[within])
+        group_count = len(offsets) - 1
+        self._save_group_summaries(task_id, threshold, members, offsets)
+        logger.info(f"找到 {group_count} 个相似图片组")
+
+        # 完成任务
+        self.update_task_status(
+            task_id,
+            "completed",
+            processed_files=processed_count,
+            similar_groups=group_count,
+            completed_at=datetime.utcnow(),
+            **comparisons
+        )
+
+        return {
+            "total_files": processed_count,
+            "similar_groups": group_count,
+            **result
+        }
+
+    def merge_partial_indexes(
+        self,
+        task_id: int,
+        partial_paths: List[str],
+        root: str,
+        threshold: int = 10,
+        cluster_mode: str = "exact",
+        lsh_bands: int = 32,
+        lsh_rows: int = 16,
+        executor: str = "process",
+        workers: int = 4,
+        batch_size: int = 500,
+        capture_window: int = 3600
+    ) -> Dict:
+        """
+        合并各工作节点生成的分片索引，之后与普通扫描一样计算相似边并分组
+
+        分片索引中的相对路径映射到本机的 root 下；图片记录按路径批量写入，
+        已有记录直接更新。各分片的旋转不敏感设置必须一致。
+
+        Args:
+            task_id: 任务ID
+            partial_paths: 分片索引文件路径
+            root: 本机上的扫描根目录
+            threshold: 相似度阈值
+            cluster_mode: 聚类模式 exact / lsh / time（online 按 exact 处理）
+            executor: 快速哈希确认时的解码执行方式
+            workers: 快速哈希确认时的工作进程数
+            batch_size: 每批写入的记录数
+            capture_window: time 模式的拍摄时间窗口（秒）
+
+        Returns:
+            处理结果字典
+        """
+        partials = []
+        try:
+            partials = [PartialIndex(path) for path in partial_paths]
+            if not partials:
+                raise ValueError("没有可合并的分片索引")
+
+            missing = missing_shards(partials)
+            if missing is None:
+                raise ValueError("分片索引的分片总数不一致")
+            if missing:
+                logger.warning(f"缺少分片 {missing}，合并结果不包含这些分片的图片")
+            if len({partial.variants for partial in partials}) != 1:
+                raise ValueError("分片索引的旋转不敏感设置不一致")
+
+            rotation_invariant = partials[0].variants
+            if cluster_mode == "online":
+                cluster_mode = "exact"
+
+            total_files = sum(partial.count() for partial in partials)
+            self.update_task_status(
+                task_id, "running",
+                cluster_mode=cluster_mode, threshold=threshold, total_files=total_files
+            )
+            logger.info(f"开始合并 {len(partials)} 个分片索引，共 {total_files} 个文件")
+
+            state = ScanState(VARIANT_COUNT if rotation_invariant else 1)
+            processed_count = 0
+            for partial in partials:
+                for file_path, reason in partial.iter_failures(root):
+                    self._quarantine_file(file_path, reason)
+                    processed_count += 1
+
+                for rows in partial.iter_images(root, batch_size):
+                    image_ids = self._upsert_images(rows)
+                    for row in rows:
+                        state.add(
+                            image_ids[row["file_path"]],
+                            self._hash_row(row, rotation_invariant),
+                            row["hash_source"] == HASH_SOURCE_THUMBNAIL,
+                            row["captured_at"]
+                        )
+                    processed_count += len(rows)
+                    self.update_task_status(task_id, "running", processed_files=processed_count)
+                    logger.info(f"合并进度: {processed_count}/{total_files}")
+
+            return self._finish_scan(
+                task_id, state, processed_count, threshold, cluster_mode,
+                lsh_bands, lsh_rows, executor, workers, capture_window=capture_window
+            )
 
         except Exception as e:
-            logger.error(f"扫描任务失败: {e}")
+            logger.error(f"合并分片索引失败: {e}")
             self.update_task_status(task_id, "failed", completed_at=datetime.utcnow())
             raise
+        finally:
+            for partial in partials:
+                partial.close()
+
+    def _upsert_images(self, rows: List[Dict]) -> Dict[str, int]:
+        """批量保存或更新图片记录，返回文件路径 -> 图片ID"""
+        now = datetime.utcnow()
+        stmt = sqlite_insert(ImageRecord).values([
+            {**row, "dir_path": os.path.dirname(row["file_path"]), "scanned_at": now} for row in rows
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["file_path"],
+            set_={
+                column: stmt.excluded[column]
+                for column in rows[0] if column != "file_path"
+            } | {"dir_path": stmt.excluded.dir_path, "scanned_at": stmt.excluded.scanned_at}
+        ).returning(ImageRecord.id, ImageRecord.file_path)
+        image_ids = {file_path: image_id for image_id, file_path in self.db.execute(stmt)}
+        self.db.commit()
+        return image_ids
+
+    def _relink_moved_files(
+        self,
+        scan_dir: str,
+        recursive: bool,
+        image_files: List[str]
+    ) -> Tuple[List[str], List[Dict]]:
+        """
+        识别被移动或重命名的文件，将原记录改指向新路径
+
+        数据库中没有记录的新路径与扫描范围内已消失的记录配对：先按
+        (inode, 文件大小, 修改时间) 匹配，同卷内的移动、重命名都能命中；
+        未命中时再按 (文件大小, 首尾字节摘要) 匹配跨卷复制的文件。
+        只做 stat 与少量读取，不解码图片。
+
+        Args:
+            scan_dir: 扫描目录
+            recursive: 是否递归扫描
+            image_files: 本次扫描待处理的文件路径
+
+        Returns:
+            (仍需处理的文件路径, 已改指向新路径的记录)
+        """
+        prefix, upper = self._path_range(scan_dir)
+        rows = self.db.query(
+            ImageRecord.id, ImageRecord.file_path, ImageRecord.file_size, ImageRecord.modified_at,
+            ImageRecord.inode, ImageRecord.partial_digest, ImageRecord.hash_value,
+            ImageRecord.hash_source, ImageRecord.variant_hashes, ImageRecord.captured_at
+        ).filter(ImageRecord.file_path >= prefix, ImageRecord.file_path < upper).all()
+        # 之后逐个 stat 新文件（网络存储上可能较慢），先释放写连接
+        self.db.commit()
+
+        walked = set(image_files)
+        known = set()
+        vanished = []
+        for row in rows:
+            known.add(row.file_path)
+            if row.file_path in walked:
+                continue
+            if not recursive and os.path.dirname(row.file_path) != scan_dir.rstrip(os.sep):
+                continue
+            vanished.append(row)
+
+        new_files = [path for path in image_files if path not in known]
+        if not vanished or not new_files:
+            return image_files, []
+
+        by_inode: Dict[tuple, list] = {}
+        by_digest: Dict[tuple, list] = {}
+        for row in vanished:
+            if row.inode is not None and row.modified_at is not None:
+                by_inode.setdefault((row.inode, row.file_size, row.modified_at), []).append(row)
+            if row.partial_digest:
+                by_digest.setdefault((row.file_size, row.partial_digest), []).append(row)
+        sizes = {size for size, _ in by_digest}
+
+        matched_ids = set()
+        updates = []
+        moved = []
+
+        def take(candidates):
+            while candidates:
+                row = candidates.pop()
+                if row.id not in matched_ids:
+                    return row
+            return None
+
+        for file_path in new_files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            modified_at = datetime.fromtimestamp(stat.st_mtime)
+            row = take(by_inode.get((stat.st_ino, stat.st_size, modified_at), []))
+            digest = None
+            if row is None and stat.st_size in sizes:
+                try:
+                    digest = partial_digest(file_path)
+                except OSError:
+                    continue
+                row = take(by_digest.get((stat.st_size, digest), []))
+            if row is None:
+                continue
+
+            matched_ids.add(row.id)
+            updates.append({
+                "id": row.id,
+                "file_path": file_path,
+                "file_name": os.path.basename(file_path),
+                "dir_path": os.path.dirname(file_path),
+                "modified_at": modified_at,
+                "inode": stat.st_ino,
+                "partial_digest": digest or row.partial_digest,
+                "scanned_at": datetime.utcnow()
+            })
+            moved.append({
+                "id": row.id,
+                "file_path": file_path,
+                "hash_value": row.hash_value,
+                "hash_source": row.hash_source,
+                "variant_hashes": row.variant_hashes,
+                "captured_at": row.captured_at
+            })
+
+        if not updates:
+            return image_files, []
+
+        self.db.execute(update(ImageRecord), updates)
+        self.db.commit()
+        # 已保存分组中的成员目录与文件夹统计随之更新
+        FolderService(self.db).relink_images(
+            {update_row["id"]: update_row["dir_path"] for update_row in updates}
+        )
+        logger.info(f"识别到 {len(updates)} 个被移动或重命名的文件，沿用原有哈希")
+
+        relinked = {update_row["file_path"] for update_row in updates}
+        return [path for path in image_files if path not in relinked], moved
+
+    @staticmethod
+    def _path_range(scan_dir: str) -> Tuple[str, str]:
+        """scan_dir 下所有路径所在的字符串区间 [scan_dir/, scan_dir0)，范围查询可走 file_path 索引"""
+        prefix = os.path.join(scan_dir, "")
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def reconcile_missing(
+        self,
+        scan_dir: str,
+        recursive: bool,
+        walked_files: List[str],
+        unreadable_dirs: Optional[List[str]] = None,
+        batch_size: int = 500
+    ) -> int:
+        """
+        清除扫描范围内文件已不存在的图片记录
+
+        遍历得到的路径批量写入临时表，与图片表做反连接找出缺失的记录，
+        避免逐条查询；记录及其在线分组成员按批删除。遍历时无法读取的目录
+        （权限变化、网络存储暂时不可用等）整个子树不参与核对。哈希索引在扫描收尾时
+        重建，单独调用时由调用方负责重建。
+
+        Args:
+            scan_dir: 扫描目录
+            recursive: 是否递归扫描（否则只核对目录下的直接文件）
+            walked_files: 本次遍历得到的全部图片路径
+            unreadable_dirs: 遍历时无法读取的目录（scan_directory 收集的 errors）
+            batch_size: 每批写入/删除的记录数
+
+        Returns:
+            清除的记录数
+        """
+        prefix, upper = self._path_range(scan_dir)
+        conn = self.db.connection()
+        conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS walked_paths (path TEXT PRIMARY KEY)"))
+        try:
+            conn.execute(text("DELETE FROM walked_paths"))
+            for start in range(0, len(walked_files), batch_size):
+                conn.execute(
+                    text("INSERT OR IGNORE INTO walked_paths (path) VALUES (:path)"),
+                    [{"path": path} for path in walked_files[start:start + batch_size]]
+                )
+
+            # 非递归扫描时子目录中的记录不在核对范围内
+            direct_only = "" if recursive else "AND instr(substr(images.file_path, :offset), :sep) = 0"
+            params = {"prefix": prefix, "upper": upper, "offset": len(prefix) + 1, "sep": os.sep}
+            # 无法读取的目录下的记录不能判断文件是否还在，保留
+            excluded = ""
+            for i, directory in enumerate(unreadable_dirs or []):
+                params[f"skip_lo_{i}"], params[f"skip_hi_{i}"] = self._path_range(directory)
+                excluded += f" AND NOT (images.file_path >= :skip_lo_{i} AND images.file_path < :skip_hi_{i})"
+            missing = conn.execute(text(f"""
+                SELECT images.id FROM images
+                WHERE images.file_path >= :prefix AND images.file_path < :upper {direct_only}{excluded}
+                AND NOT EXISTS (SELECT 1 FROM walked_paths WHERE walked_paths.path = images.file_path)
+            """), params).scalars().all()
+        finally:
+            conn.execute(text("DROP TABLE IF EXISTS temp.walked_paths"))
+            self.db.commit()
+
+        if missing:
+            self.refresh_group_summaries(FolderService(self.db).remove_images(missing, batch_size))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            self.db.query(GroupMember).filter(GroupMember.image_id.in_(batch)).delete(synchronize_session=False)
+            self.db.query(ImageRecord).filter(ImageRecord.id.in_(batch)).delete(synchronize_session=False)
+            self.db.commit()
+
+        if missing:
+            logger.info(f"清除 {len(missing)} 条文件已不存在的图片记录")
+        return len(missing)
 
-    def _save_or_update_image(self, image_data: Dict):
-        """保存或更新图片记录"""
+    def _save_or_update_image(self, image_data: Dict) -> int:
+        """保存或更新图片记录，返回图片ID"""
+        image_data = {**image_data, "dir_path": os.path.dirname(image_data["file_path"])}
         existing = self.db.query(ImageRecord).filter(
             ImageRecord.file_path == image_data["file_path"]
         ).first()
@@ -177,17 +645,261 @@ class ScanService:
             existing.scanned_at = datetime.utcnow()
         else:
             # 创建新记录
-            image = ImageRecord(**image_data)
-            self.db.add(image)
+            existing = ImageRecord(**image_data)
+            self.db.add(existing)
+
+        self.db.commit()
+        return existing.id
+
+    @staticmethod
+    def _hash_row(result: Dict, rotation_invariant: bool):
+        """扫描结果对应的哈希：原图哈希，或 8 个旋转/翻转变体哈希"""
+        if rotation_invariant and result.get("variant_hashes"):
+            return [hash_to_int(h) for h in result["variant_hashes"].split(",")]
+        return hash_to_int(result["hash_value"])
+
+    def _compute_edges(
+        self,
+        ids: np.ndarray,
+        hashes: np.ndarray,
+        max_distance: int,
+        cluster_mode: str,
+        lsh_bands: int,
+        lsh_rows: int,
+        times: Optional[np.ndarray] = None,
+        capture_window: int = 3600
+    ):
+        """
+        计算相似边，返回 (起点图片ID, 终点图片ID, 距离)
+
+        hashes 为二维 (n, 8) 数组时按旋转/翻转不敏感的距离计算；
+        time 模式下只比较拍摄时间（times，无拍摄时间为 NaN）相近的图片。
+        """
+        logger.info("开始计算相似边")
+        if cluster_mode == "time" and times is not None:
+            src, dst, distances = time_blocked_similarity_edges(
+                hashes, times, capture_window, max_distance
+            )
+        elif hashes.ndim == 2:
+            if cluster_mode == "lsh":
+                src, dst, distances = lsh_variant_similarity_edges(
+                    hashes, max_distance, lsh_bands, lsh_rows
+                )
+            else:
+                src, dst, distances = variant_similarity_edges(hashes, max_distance)
+        elif cluster_mode == "lsh":
+            src, dst, distances = lsh_similarity_edges(hashes, max_distance, lsh_bands, lsh_rows)
+        else:
+            src, dst, distances = exact_similarity_edges(hashes, max_distance)
+        return ids[src], ids[dst], distances
+
+    def _confirm_thumbnail_hashes(
+        self,
+        src: np.ndarray,
+        dst: np.ndarray,
+        distances: np.ndarray,
+        thumbnail_ids: np.ndarray,
+        threshold: int,
+        executor: str,
+        workers: int,
+        rotation_invariant: bool = False
+    ) -> Dict[int, object]:
+        """
+        完整解码距离落在阈值附近的缩略图哈希图片
+
+        缩略图哈希与完整哈希通常只差几个比特，只有距离在
+        threshold ± fast_hash_margin 内的组对可能因此改变分组结果。
+
+        Returns:
+            图片ID -> 完整解码得到的哈希（或变体哈希列表）
+        """
+        margin = settings.fast_hash_margin
+        near = (distances >= max(threshold - margin, 0)) & (distances < threshold + margin)
+        candidates = np.intersect1d(np.concatenate([src[near], dst[near]]), thumbnail_ids)
+        if not len(candidates):
+            return {}
+
+        logger.info(f"完整解码确认 {len(candidates)} 张阈值附近的图片")
+        confirmed = {}
+        records = self.load_images_by_ids(candidates.tolist())
+        # 解码期间不占用写连接
+        self._release_connection(records.values())
+        results = iter_hash_results(
+            [records[image_id].file_path for image_id in candidates.tolist() if image_id in records],
+            executor,
+            workers,
+            settings.prefetch_threads,
+            variants=rotation_invariant,
+            **default_pool_options()
+        )
+        for _, result, _ in results:
+            if result:
+                image_id = self._save_or_update_image(result)
+                confirmed[image_id] = self._hash_row(result, rotation_invariant)
+        return confirmed
+
+    def _load_quarantine(self) -> Dict[str, tuple]:
+        """读取隔离列表：文件路径 -> (文件大小, 修改时间)"""
+        rows = self.db.query(
+            QuarantinedFile.file_path, QuarantinedFile.file_size, QuarantinedFile.mtime
+        ).all()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def _is_quarantined(self, file_path: str, quarantined: Dict[str, tuple]) -> bool:
+        """文件在隔离列表中且大小、修改时间均未变化"""
+        entry = quarantined.get(file_path)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime) == entry
+
+    def _quarantine_file(self, file_path: str, reason: str):
+        """记录处理失败的文件"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+
+        now = datetime.utcnow()
+        stmt = sqlite_insert(QuarantinedFile).values(
+            file_path=file_path,
+            file_size=stat.st_size,
+            mtime=stat.st_mtime,
+            reason=reason,
+            failures=1,
+            created_at=now,
+            updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["file_path"],
+            set_={
+                "file_size": stmt.excluded.file_size,
+                "mtime": stmt.excluded.mtime,
+                "reason": stmt.excluded.reason,
+                "failures": QuarantinedFile.failures + 1,
+                "updated_at": stmt.excluded.updated_at
+            }
+        )
+        self.db.execute(stmt)
+        self.db.commit()
+        logger.warning(f"文件已隔离: {file_path}, 原因: {reason}")
+
+    def _release_quarantine(self, file_path: str):
+        """将文件移出隔离列表"""
+        self.db.query(QuarantinedFile).filter(QuarantinedFile.file_path == file_path).delete()
+        self.db.commit()
+
+    def _save_group_members(self, task_id: int, members: Dict[int, int], chunk_size: int = 1000):
+        """写入归属发生变化的组成员（图片ID -> 组根图片ID）"""
+        if not members:
+            return
 
+        # 每行 3 个绑定参数，分批写入避免超出 SQLite 的参数个数上限
+        items = list(members.items())
+        for start in range(0, len(items), chunk_size):
+            stmt = sqlite_insert(GroupMember).values([
+                {"task_id": task_id, "image_id": image_id, "group_key": group_key}
+                for image_id, group_key in items[start:start + chunk_size]
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["task_id", "image_id"],
+                set_={"group_key": stmt.excluded.group_key}
+            )
+            self.db.execute(stmt)
         self.db.commit()
 
+    def rebuild_hash_index(self, variants: bool = False) -> int:
+        """
+        根据数据库中的哈希值重建 mmap 哈希索引
+
+        只查询需要的列，不构造 ORM 对象。本次扫描启用了旋转/翻转不敏感匹配、
+        全局启用或变体索引已存在（此前有过变体扫描）时同时重建变体索引。
+
+        Args:
+            variants: 是否为旋转/翻转不敏感的扫描
+
+        Returns:
+            索引条目数
+        """
+        rows = self.db.query(
+            ImageRecord.id, ImageRecord.hash_value, ImageRecord.variant_hashes
+        ).filter(
+            ImageRecord.hash_value.isnot(None)
+        ).order_by(ImageRecord.id).all()
+        # 写索引文件（含 fsync）期间不占用唯一的写连接
+        self.db.commit()
+
+        ids = np.fromiter((row[0] for row in rows), dtype=np.uint32, count=len(rows))
+        hashes = np.fromiter(
+            (hash_to_int(row[1]) for row in rows), dtype=np.uint64, count=len(rows)
+        )
+        count = write_hash_index(
+            settings.index_path, ids, hashes, multi_index=settings.index_multi_index
+        )
+        if variants or settings.rotation_invariant or os.path.exists(settings.variant_index_path):
+            self._write_variant_index(rows)
+        return count
+
+    def _write_variant_index(self, rows) -> int:
+        """
+        写入变体索引：每张图片的 8 个旋转/翻转变体各占一行
+
+        用查询图片的原图哈希检索一次即可命中任意方向的相似图片；
+        没有变体哈希的旧记录只收录原图哈希。
+        """
+        variant_ids, variant_hashes = [], []
+        for image_id, hash_value, variants in rows:
+            values = variants.split(",") if variants else [hash_value]
+            variant_ids.extend([image_id] * len(values))
+            variant_hashes.extend(hash_to_int(value) for value in values)
+
+        return write_hash_index(
+            settings.variant_index_path,
+            np.array(variant_ids, dtype=np.uint32),
+            np.array(variant_hashes, dtype=np.uint64),
+            multi_index=settings.index_multi_index,
+            variants=True
+        )
+
+    def get_hash_index(self, variants: bool = False) -> Optional[HashIndex]:
+        """
+        打开 mmap 哈希索引，不存在时从数据库构建一次
+
+        Args:
+            variants: 是否使用旋转/翻转变体索引（全局启用 rotation_invariant
+                或已有变体扫描建立的变体索引时可用，否则使用原图哈希索引）
+        """
+        variants = variants and (
+            settings.rotation_invariant or os.path.exists(settings.variant_index_path)
+        )
+        path = settings.variant_index_path if variants else settings.index_path
+        index = load_hash_index(path)
+        if index is None:
+            self.rebuild_hash_index(variants=variants)
+            index = load_hash_index(path)
+        return index
+
     def get_task_progress(self, task_id: int) -> Dict:
         """获取任务进度"""
         task = self.db.query(ScanTask).filter(ScanTask.id == task_id).first()
         if not task:
             return None
+        return self._progress_dict(task)
+
+    @staticmethod
+    async def get_task_progress_async(db: AsyncSession, task_id: int) -> Optional[Dict]:
+        """异步获取任务进度（进度接口被前端高频轮询，直接在事件循环中查询）"""
+        task = await db.get(ScanTask, task_id)
+        if not task:
+            return None
+        return ScanService._progress_dict(task)
 
+    @staticmethod
+    def _progress_dict(task: ScanTask) -> Dict:
+        """任务进度返回数据"""
         progress = 0
         if task.total_files > 0:
             progress = (task.processed_files / task.total_files) * 100
@@ -198,46 +910,483 @@ class ScanService:
             "total_files": task.total_files,
             "processed_files": task.processed_files,
             "similar_groups": task.similar_groups,
-            "progress_percent": round(progress, 2)
+            "progress_percent": round(progress, 2),
+            "comparisons": {
+                "blocked": task.comparisons_blocked,
+                "full": task.comparisons_full,
+                "undated": task.undated_files
+            } if task.comparisons_full is not None else None
         }
 
-    def get_similar_groups(self, task_id: int) -> List[Dict]:
-        """获取相似图片组"""
-        # 从数据库获取所有图片记录
-        images = self.db.query(ImageRecord).all()
+    def get_similar_groups(self, task_id: int, threshold: Optional[int] = None) -> List[Dict]:
+        """
+        获取全部相似图片组
+
+        Args:
+            task_id: 任务ID
+            threshold: 相似度阈值，默认使用扫描时的阈值
 
-        if not images:
-            return []
+        Returns:
+            相似图片组列表
+        """
+        return list(self.iter_similar_groups(task_id, threshold))
 
-        # 构建哈希映射
-        image_hashes = {img.file_path: img.hash_value for img in images if img.hash_value}
+    def get_similar_groups_page(
+        self,
+        task_id: int,
+        threshold: Optional[int],
+        page: int,
+        page_size: int,
+        folder: Optional[str] = None,
+        include_matrix: bool = False
+    ) -> Tuple[int, List[Dict]]:
+        """
+        获取一页相似图片组，只为这一页加载图片记录
+
+        Args:
+            folder: 只返回有图片位于该文件夹（含子目录）中的组，组ID保持不变
+            include_matrix: 是否附带组内完整距离矩阵（默认只返回到建议保留图片的距离）
+
+        Returns:
+            (总组数, 当前页的相似图片组)
+        """
+        total, load = self._group_loader(task_id, threshold, folder, include_matrix)
+        start = min((page - 1) * page_size, total)
+        return total, load(start, min(start + page_size, total))
+
+    def get_similar_group(
+        self,
+        task_id: int,
+        threshold: Optional[int],
+        group_id: int,
+        include_matrix: bool = False
+    ) -> Optional[Dict]:
+        """
+        按组ID获取单个相似图片组
+
+        Returns:
+            相似图片组，组不存在（或图片删除后已不是重复组）时返回None
+        """
+        task = self.db.query(ScanTask).filter(ScanTask.id == task_id).first()
+        if threshold is None:
+            threshold = self.get_default_threshold(task_id)
+
+        index = group_id - 1
+        if self._has_saved_summaries(task, threshold):
+            summaries = self._load_group_summaries_at(task_id, threshold, [index])
+            groups = self._build_group_response(
+                [image_ids for image_ids, _ in summaries], [group_id] * len(summaries),
+                summaries, include_matrix=include_matrix
+            )
+        else:
+            # 未保存摘要时组序号即位置
+            total, load = self._group_loader(task_id, threshold, include_matrix=include_matrix)
+            groups = load(index, index + 1) if 0 <= index < total else []
+        return groups[0] if groups else None
+
+    def iter_similar_groups(
+        self,
+        task_id: int,
+        threshold: Optional[int] = None,
+        chunk_size: int = 1000,
+        include_matrix: bool = False
+    ) -> Iterator[Dict]:
+        """逐组返回全部相似图片组，每次只加载 chunk_size 组的图片记录"""
+        total, load = self._group_loader(task_id, threshold, include_matrix=include_matrix)
+        for start in range(0, total, chunk_size):
+            yield from load(start, min(start + chunk_size, total))
+
+    def _group_loader(
+        self,
+        task_id: int,
+        threshold: Optional[int],
+        folder: Optional[str] = None,
+        include_matrix: bool = False
+    ) -> Tuple[int, Callable[[int, int], List[Dict]]]:
+        """
+        确定分组来源
+
+        分组只以图片ID数组的形式存在，路径等图片信息在构建接口数据时
+        按需加载。按文件夹筛选时，扫描阈值下的分组直接查询组成员表的目录索引，
+        其他阈值下按文件夹内的图片ID筛选。
+
+        Returns:
+            (总组数, 按组序号区间 [start, stop) 构建接口数据的函数)
+        """
+        task = self.db.query(ScanTask).filter(ScanTask.id == task_id).first()
+        if threshold is None:
+            threshold = self.get_default_threshold(task_id)
+
+        saved = self._has_saved_summaries(task, threshold)
+
+        if saved and folder is not None:
+            group_indexes = FolderService(self.db).group_indexes(task_id, folder)
+
+            def load_folder_summaries(start: int, stop: int) -> List[Dict]:
+                indexes = group_indexes[start:stop]
+                summaries = self._load_group_summaries_at(task_id, threshold, indexes)
+                return self._build_group_response(
+                    [image_ids for image_ids, _ in summaries], [index + 1 for index in indexes],
+                    summaries, include_matrix=include_matrix
+                )
+            return len(group_indexes), load_folder_summaries
+
+        if saved:
+            def load_summaries(start: int, stop: int) -> List[Dict]:
+                indexes, summaries = self._load_group_summaries(task_id, threshold, start, stop)
+                return self._build_group_response(
+                    [image_ids for image_ids, _ in summaries], [index + 1 for index in indexes],
+                    summaries, include_matrix=include_matrix
+                )
+            return self._count_group_summaries(task_id, threshold), load_summaries
+
+        if task and task.cluster_mode == "online" and task.status == "running":
+            # 在线聚类任务直接读取已写入的组成员，扫描进行中也可查看
+            members, offsets = pack_groups(self._load_group_members(task_id))
+        else:
+            members, offsets = self._compute_group_arrays(task_id, threshold)
+
+        positions = np.arange(len(offsets) - 1)
+        if folder is not None and len(positions):
+            folder_ids = np.array(FolderService(self.db).image_ids_in_folder(folder), dtype=members.dtype)
+            in_folder = np.isin(members, folder_ids)
+            positions = np.flatnonzero(np.logical_or.reduceat(in_folder, offsets[:-1]))
+
+        def load_groups(start: int, stop: int) -> List[Dict]:
+            indexes = positions[start:stop].tolist()
+            groups = [members[offsets[i]:offsets[i + 1]].tolist() for i in indexes]
+            return self._build_group_response(
+                groups, [i + 1 for i in indexes], include_matrix=include_matrix
+            )
+        return len(positions), load_groups
 
-        # 查找相似组
-        groups = find_similar_groups(image_hashes, threshold=10)
+    def _compute_group_arrays(self, task_id: int, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+        """按阈值重新分组，返回 (members, offsets) 紧凑数组"""
+        # 优先用相似边在内存中重新分组，无需重新扫描
+        store = load_edge_store(self._edge_path(task_id))
+        if store is not None and store.supports(threshold):
+            return store.group_arrays(threshold)
+
+        index = self.get_hash_index()
+        if index is None or len(index) == 0:
+            return pack_groups([])
+
+        # 超出相似边覆盖范围的阈值：现场计算阈值内的相似边，与相似边文件一样按传递闭包归组
+        hashes = np.asarray(index.hashes)
+        if settings.cluster_mode == "lsh":
+            src, dst, _ = lsh_similarity_edges(hashes, threshold - 1, settings.lsh_bands, settings.lsh_rows)
+        else:
+            src, dst, _ = exact_similarity_edges(hashes, threshold - 1)
+        ids = np.asarray(index.ids, dtype=np.int64)
+        return group_arrays_from_edges(ids[src], ids[dst])
+
+    def get_default_threshold(self, task_id: int) -> int:
+        """任务的默认相似度阈值（扫描时使用的阈值）"""
+        task_threshold = self.db.query(ScanTask.threshold).filter(ScanTask.id == task_id).scalar()
+        return task_threshold or settings.similarity_threshold
+
+    def _edge_path(self, task_id: int) -> str:
+        """任务相似边文件路径"""
+        return os.path.join(settings.edge_dir, f"task_{task_id}.edges")
+
+    def _load_group_members(self, task_id: int) -> List[List[int]]:
+        """读取任务的组成员，按组内最小图片ID排序"""
+        rows = self.db.query(GroupMember.group_key, GroupMember.image_id).filter(
+            GroupMember.task_id == task_id
+        ).order_by(GroupMember.group_key, GroupMember.image_id).all()
+
+        members: Dict[int, List[int]] = {}
+        for group_key, image_id in rows:
+            members.setdefault(group_key, []).append(image_id)
+
+        return sorted((group for group in members.values() if len(group) > 1), key=lambda g: g[0])
+
+    def _save_group_summaries(
+        self,
+        task_id: int,
+        threshold: int,
+        members: np.ndarray,
+        offsets: np.ndarray,
+        chunk_size: int = 1000
+    ):
+        """计算并保存各组的距离矩阵和建议保留的图片，每次处理并提交 chunk_size 组"""
+        self.db.query(GroupSummary).filter(GroupSummary.task_id == task_id).delete()
+        folders = FolderService(self.db)
+        folders.clear(task_id)
+        scan_dir = self.db.query(ScanTask.scan_dir).filter(ScanTask.id == task_id).scalar()
+        self.db.commit()
+
+        # 逐块提交，计算距离矩阵期间不占用唯一的写连接，其他写请求可以在块之间执行；
+        # 任务完成前不会读取组摘要，中途可见的部分结果不影响接口
+        for chunk_start in range(0, len(offsets) - 1, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, len(offsets) - 1)
+            records = self.load_images_by_ids(
+                members[offsets[chunk_start]:offsets[chunk_stop]].tolist()
+            )
+            self._release_connection(records.values())
+            rows = []
+            ranked = []
+            for i in range(chunk_start, chunk_stop):
+                group = members[offsets[i]:offsets[i + 1]].tolist()
+                image_ids, distances = self._summarize_group(
+                    [records[image_id] for image_id in group if image_id in records]
+                )
+                rows.append({
+                    "task_id": task_id,
+                    "threshold": threshold,
+                    "group_index": i,
+                    "image_ids": ",".join(str(image_id) for image_id in image_ids),
+                    "distances": distances.tobytes()
+                })
+                ranked.append((i, [records[image_id] for image_id in image_ids]))
+            self.db.bulk_insert_mappings(GroupSummary, rows)
+            folders.add_groups(task_id, scan_dir, ranked)
+            self.db.commit()
+
+    def refresh_group_summaries(self, groups: List[Tuple[int, int]]):
+        """
+        按组成员表中未删除的图片重新计算组摘要（删除、恢复图片之后调用）
+
+        只剩一张图片的组已不是重复组，删除其摘要，分页时跳过。
+
+        Args:
+            groups: 受影响的组 [(任务ID, 组序号)]
+        """
+        if not groups:
+            return
+
+        thresholds = dict(self.db.query(ScanTask.id, ScanTask.threshold).filter(
+            ScanTask.id.in_({task_id for task_id, _ in groups})
+        ).all())
+        for task_id, group_index in groups:
+            if task_id not in thresholds:
+                continue
+            image_ids = [image_id for image_id, in self.db.query(GroupImage.image_id).filter(
+                GroupImage.task_id == task_id,
+                GroupImage.group_index == group_index,
+                GroupImage.removed == False
+            )]
+            records = self.load_images_by_ids(image_ids)
+            summary = self.db.query(GroupSummary).filter(
+                GroupSummary.task_id == task_id,
+                GroupSummary.threshold == thresholds.get(task_id),
+                GroupSummary.group_index == group_index
+            ).first()
+
+            if len(records) < 2:
+                if summary is not None:
+                    self.db.delete(summary)
+                continue
+
+            image_ids, distances = self._summarize_group(list(records.values()))
+            if summary is None:
+                summary = GroupSummary(
+                    task_id=task_id, threshold=thresholds.get(task_id), group_index=group_index
+                )
+                self.db.add(summary)
+            summary.image_ids = ",".join(str(image_id) for image_id in image_ids)
+            summary.distances = distances.tobytes()
+        self.db.commit()
+
+    def _has_saved_summaries(self, task: Optional[ScanTask], threshold: int) -> bool:
+        """
+        扫描阈值下的分组已在扫描完成时连同距离矩阵一起保存
+
+        图片删除后组摘要随之更新，组都已不是重复组时组成员表中仍有记录，
+        此时同样以组摘要为准（没有组），不再按相似边重新分组。
+        """
+        if not (task and task.status == "completed" and threshold == task.threshold):
+            return False
+        return self.db.query(
+            self.db.query(GroupSummary.id).filter(GroupSummary.task_id == task.id).exists()
+        ).scalar() or self.db.query(
+            self.db.query(GroupImage.id).filter(GroupImage.task_id == task.id).exists()
+        ).scalar()
+
+    def _count_group_summaries(self, task_id: int, threshold: int) -> int:
+        """已保存的组摘要数"""
+        return self.db.query(GroupSummary).filter(
+            GroupSummary.task_id == task_id,
+            GroupSummary.threshold == threshold
+        ).count()
+
+    def _load_group_summaries(
+        self,
+        task_id: int,
+        threshold: int,
+        start: int,
+        stop: int
+    ) -> Tuple[List[int], List[Tuple[List[int], np.ndarray]]]:
+        """
+        按组序号排序后读取第 [start, stop) 个组摘要
+
+        图片删除后只剩一张的组已删除摘要，组序号可能不连续。
+
+        Returns:
+            (组序号列表, [(图片ID列表, 距离矩阵)])
+        """
+        rows = self.db.query(
+            GroupSummary.group_index, GroupSummary.image_ids, GroupSummary.distances
+        ).filter(
+            GroupSummary.task_id == task_id,
+            GroupSummary.threshold == threshold
+        ).order_by(GroupSummary.group_index).offset(start).limit(stop - start).all()
+
+        return (
+            [group_index for group_index, _, _ in rows],
+            self._parse_group_summaries([(image_ids, distances) for _, image_ids, distances in rows])
+        )
+
+    def _load_group_summaries_at(
+        self,
+        task_id: int,
+        threshold: int,
+        group_indexes: List[int]
+    ) -> List[Tuple[List[int], np.ndarray]]:
+        """按组序号读取组摘要，返回顺序与 group_indexes 一致"""
+        rows = self.db.query(
+            GroupSummary.group_index, GroupSummary.image_ids, GroupSummary.distances
+        ).filter(
+            GroupSummary.task_id == task_id,
+            GroupSummary.threshold == threshold,
+            GroupSummary.group_index.in_(group_indexes)
+        ).all()
+
+        by_index = {group_index: (image_ids, distances) for group_index, image_ids, distances in rows}
+        return self._parse_group_summaries([by_index[index] for index in group_indexes if index in by_index])
+
+    @staticmethod
+    def _parse_group_summaries(rows) -> List[Tuple[List[int], np.ndarray]]:
+        """把 (逗号分隔的图片ID, 距离矩阵字节) 解析为 [(图片ID列表, 距离矩阵)]"""
+        summaries = []
+        for image_ids, distances in rows:
+            ids = [int(image_id) for image_id in image_ids.split(",")] if image_ids else []
+            summaries.append((ids, np.frombuffer(distances, dtype=np.uint8).reshape(-1, len(ids) or 1)))
+        return summaries
+
+    @staticmethod
+    def _summarize_group(members: List[ImageRecord]) -> Tuple[List[int], np.ndarray]:
+        """
+        按建议保留优先级排列组内图片，并一次性计算组内距离矩阵
+
+        Returns:
+            (图片ID列表, 距离矩阵)，第一个图片为建议保留的图片；
+            大组的距离矩阵只有建议保留图片所在的一行
+        """
+        if not members:
+            return [], np.empty((0, 0), dtype=np.uint8)
+
+        order = rank_keepers(
+            np.array([(img.width or 0) * (img.height or 0) for img in members]),
+            np.array([img.file_size or 0 for img in members]),
+            np.array([img.modified_at.timestamp() if img.modified_at else np.inf for img in members])
+        )
+        members = [members[i] for i in order]
+
+        # 所有图片都有变体哈希时按旋转/翻转不敏感的距离计算
+        if all(img.variant_hashes for img in members):
+            hashes = np.array(
+                [[hash_to_int(value) for value in img.variant_hashes.split(",")] for img in members],
+                dtype=np.uint64
+            )
+        else:
+            hashes = np.array([hash_to_int(img.hash_value) for img in members], dtype=np.uint64)
+
+        rows = None if len(members) <= GROUP_MATRIX_MAX_SIZE else np.array([0])
+        return [img.id for img in members], pairwise_distance_matrix(hashes, rows)
+
+    @staticmethod
+    def _similarity_scores(
+        image_ids: List[int],
+        distances: np.ndarray,
+        include_matrix: bool = False
+    ) -> Optional[Dict]:
+        """
+        组内相似度分数：各图片到建议保留图片的距离
+
+        完整距离矩阵最多 GROUP_MATRIX_MAX_SIZE² 个元素，只在 include_matrix 时返回（小组）。
+        """
+        if not image_ids:
+            return None
+
+        keeper_distances = distances[0].tolist()
+        scores = {
+            "image_ids": image_ids,
+            "keeper_distances": keeper_distances,
+            "keeper_similarities": [round(distance_to_similarity(d), 2) for d in keeper_distances]
+        }
+        if include_matrix:
+            scores["distance_matrix"] = distances.tolist() if len(distances) == len(image_ids) else None
+        return scores
+
+    def _build_group_response(
+        self,
+        groups: List[List[int]],
+        group_ids: List[int],
+        summaries: Optional[List[Tuple[List[int], np.ndarray]]] = None,
+        include_matrix: bool = False
+    ) -> List[Dict]:
+        """
+        将图片ID分组转换为接口返回数据
+
+        Args:
+            groups: 图片ID分组
+            group_ids: 各组的组ID（组序号 + 1，按文件夹筛选或有组被删除时不连续）
+            summaries: 已保存的组摘要，缺省或组内图片已变化时现场计算
+            include_matrix: 是否附带组内完整距离矩阵
+        """
+        # 批量加载组内图片记录
+        records = self.load_images_by_ids([image_id for group in groups for image_id in group])
 
         # 构建返回数据
         result = []
         for i, group in enumerate(groups):
+            summary = summaries[i] if summaries else None
+            if summary is None or any(image_id not in records for image_id in group):
+                summary = self._summarize_group(
+                    [records[image_id] for image_id in group if image_id in records]
+                )
+            image_ids, distances = summary
+
             group_images = []
-            for path in group:
-                img = self.db.query(ImageRecord).filter(
-                    ImageRecord.file_path == path
-                ).first()
-                if img:
-                    group_images.append({
-                        "id": img.id,
-                        "file_path": img.file_path,
-                        "file_name": img.file_name,
-                        "file_size": img.file_size,
-                        "width": img.width,
-                        "height": img.height,
-                        "hash_value": img.hash_value,
-                        "modified_at": img.modified_at.isoformat() if img.modified_at else None
-                    })
+            for image_id in image_ids:
+                img = records[image_id]
+                group_images.append({
+                    "id": img.id,
+                    "file_path": img.file_path,
+                    "file_name": img.file_name,
+                    "file_size": img.file_size,
+                    "width": img.width,
+                    "height": img.height,
+                    "hash_value": img.hash_value,
+                    "modified_at": img.modified_at.isoformat() if img.modified_at else None
+                })
 
             result.append({
-                "group_id": i + 1,
-                "images": group_images
+                "group_id": group_ids[i],
+                "images": group_images,
+                "keeper_id": image_ids[0] if image_ids else None,
+                "similarity_scores": self._similarity_scores(image_ids, distances, include_matrix)
             })
 
         return result
+
+    def _release_connection(self, records: Iterable[ImageRecord] = ()):
+        """
+        结束当前的只读事务，把唯一的写连接归还连接池
+
+        Args:
+            records: 之后还要读取的图片记录；先脱离会话，提交后不会过期，访问属性无需重新查询
+        """
+        for record in records:
+            self.db.expunge(record)
+        self.db.commit()
+
+    def load_images_by_ids(self, image_ids: List[int], chunk_size: int = 500) -> Dict[int, ImageRecord]:
+        """按ID分批加载图片记录"""
+        records = {}
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = image_ids[start:start + chunk_size]
+            for img in self.db.query(ImageRecord).filter(ImageRecord.id.in_(chunk)):
+                records[img.id] = img
+        return records
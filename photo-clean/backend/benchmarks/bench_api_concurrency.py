@@ -0,0 +1,134 @@
+"""
+接口并发基准测试：重负载接口运行期间的预览延迟
+
+先单独测量预览接口的延迟，再在多个分组查询（大图库下按阈值重新分组，
+CPU 密集）持续运行的同时测量一次。作为对照，额外注册一个在 async 函数中
+直接同步调用分组服务的接口，复现改造前阻塞事件循环的写法。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_api_concurrency --images 50000 --requests 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# 应用模块导入时会按配置创建数据库，这里指向临时目录，避免触碰正式数据
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_api_")
+for _key, _name in (("DB_PATH", "bench.db"), ("INDEX_PATH", "bench.idx"),
+                    ("EDGE_DIR", "edges"), ("TRASH_DIR", "trash")):
+    os.environ[_key] = os.path.join(_TMP_DIR, _name)
+
+import httpx  # noqa: E402
+from fastapi import Depends  # noqa: E402
+from PIL import Image  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.database import ImageRecord, ScanTask, SessionLocal, get_read_db  # noqa: E402
+from app.main import app  # noqa: E402
+from app.services.scan_service import ScanService  # noqa: E402
+
+
+@app.get("/bench/groups-blocking/{task_id}")
+async def groups_blocking(task_id: int, db: Session = Depends(get_read_db)):
+    """对照组：在事件循环中同步计算分组（改造前的写法）"""
+    groups = ScanService(db).get_similar_groups(task_id)
+    return {"total_groups": len(groups)}
+
+
+def seed(count: int) -> int:
+    """写入随机哈希（其中约一成为近似重复），返回扫描任务ID"""
+    rng = random.Random(0)
+    hashes = []
+    for i in range(count):
+        if hashes and rng.random() < 0.1:
+            hashes.append(rng.choice(hashes) ^ (1 << rng.randrange(64)))
+        else:
+            hashes.append(rng.getrandbits(64))
+
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(ImageRecord, [
+            {
+                "file_path": f"/photos/{i}.jpg",
+                "file_name": f"{i}.jpg",
+                "file_size": 1000,
+                "width": 4000,
+                "height": 3000,
+                "hash_value": f"{h:016x}"
+            }
+            for i, h in enumerate(hashes)
+        ])
+        task = ScanTask(scan_dir="/photos", status="completed", threshold=10)
+        db.add(task)
+        db.commit()
+        return task.id
+    finally:
+        db.close()
+
+
+async def preview_latencies(client: httpx.AsyncClient, path: str, count: int):
+    """顺序请求预览接口，返回各次延迟（毫秒）"""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.get("/api/images/preview", params={"file_path": path})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def heavy_load(client: httpx.AsyncClient, url: str, stop: asyncio.Event):
+    """持续请求重负载接口"""
+    while not stop.is_set():
+        (await client.get(url)).raise_for_status()
+
+
+async def run(args):
+    task_id = seed(args.images)
+    preview_path = os.path.join(_TMP_DIR, "preview.jpg")
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(preview_path)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # 预热：构建哈希索引
+        (await client.get(f"/api/scan/groups/{task_id}")).raise_for_status()
+
+        scenarios = [
+            ("空闲", None),
+            ("分组查询并发(线程池)", f"/api/scan/groups/{task_id}"),
+            ("分组查询并发(阻塞写法)", f"/bench/groups-blocking/{task_id}"),
+        ]
+
+        print(f"图片数: {args.images}, 并发重负载请求: {args.concurrency}")
+        print(f"{'场景':<24}{'p50(ms)':>10}{'p95(ms)':>10}{'最大(ms)':>10}")
+        for name, url in scenarios:
+            stop = asyncio.Event()
+            loads = [
+                asyncio.create_task(heavy_load(client, url, stop))
+                for _ in range(args.concurrency if url else 0)
+            ]
+            await asyncio.sleep(0.2)
+            latencies = sorted(await preview_latencies(client, preview_path, args.requests))
+            stop.set()
+            await asyncio.gather(*loads)
+
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            print(f"{name:<24}{p50:>10.2f}{p95:>10.2f}{latencies[-1]:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口并发基准测试")
+    parser.add_argument("--images", type=int, default=50000, help="图库图片数")
+    parser.add_argument("--requests", type=int, default=40, help="每个场景的预览请求数")
+    parser.add_argument("--concurrency", type=int, default=2, help="并发的重负载请求数")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+扫描写入期间的接口查询延迟基准测试
+
+一个线程模拟扫描（逐个文件写入图片记录并提交，每 100 个文件更新一次进度），
+同时另一个线程反复执行进度查询和分组页查询，分别对比：
+
+- legacy: 默认回滚日志，读写共用一个引擎
+- wal:    WAL 模式，单写连接 + 只读连接池（当前配置）
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_db_latency --seed 20000 --seconds 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+# 数据库模块导入时会按配置创建数据库，这里指向临时目录，避免触碰正式数据
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_db_")
+os.environ["DB_PATH"] = os.path.join(_TMP_DIR, "default.db")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database import (  # noqa: E402
+    Base, ImageRecord, ScanTask, create_reader_engine, create_writer_engine
+)
+from app.services.scan_service import ScanService  # noqa: E402
+
+
+def make_engines(mode: str, db_path: str):
+    """返回 (写入引擎, 读取引擎)"""
+    if mode == "legacy":
+        engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        return engine, engine
+    return create_writer_engine(db_path), create_reader_engine(db_path)
+
+
+def seed(session_factory, count: int) -> int:
+    """写入初始图片记录，返回扫描任务ID"""
+    db = session_factory()
+    try:
+        db.bulk_insert_mappings(ImageRecord, [
+            {
+                "file_path": f"/photos/seed/{i}.jpg",
+                "file_name": f"{i}.jpg",
+                "file_size": 1000 + i,
+                "width": 4000,
+                "height": 3000,
+                "hash_value": f"{random.getrandbits(64):016x}"
+            }
+            for i in range(count)
+        ])
+        task = ScanTask(scan_dir="/photos", status="running")
+        db.add(task)
+        db.commit()
+        return task.id
+    finally:
+        db.close()
+
+
+def simulate_scan(session_factory, task_id: int, stop: threading.Event) -> int:
+    """模拟扫描写入，返回写入的文件数"""
+    db = session_factory()
+    service = ScanService(db)
+    written = 0
+    try:
+        while not stop.is_set():
+            service._save_or_update_image({
+                "file_path": f"/photos/scan/{written}.jpg",
+                "file_name": f"{written}.jpg",
+                "file_size": written,
+                "width": 4000,
+                "height": 3000,
+                "hash_value": f"{random.getrandbits(64):016x}"
+            })
+            written += 1
+            if written % 100 == 0:
+                service.update_task_status(task_id, "running", processed_files=written)
+    finally:
+        db.close()
+    return written
+
+
+def measure_reads(session_factory, task_id: int, seed_count: int, stop: threading.Event):
+    """反复执行接口查询，返回各次延迟（毫秒）"""
+    latencies = []
+    while not stop.is_set():
+        ids = random.sample(range(1, seed_count + 1), 200)
+        start = time.perf_counter()
+        db = session_factory()
+        try:
+            service = ScanService(db)
+            service.get_task_progress(task_id)
+            service.load_images_by_ids(ids)
+        finally:
+            db.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def run(mode: str, seed_count: int, seconds: float):
+    db_path = os.path.join(_TMP_DIR, f"{mode}.db")
+    writer, reader = make_engines(mode, db_path)
+    Base.metadata.create_all(bind=writer)
+    write_sessions = sessionmaker(bind=writer)
+    read_sessions = sessionmaker(bind=reader)
+    task_id = seed(write_sessions, seed_count)
+
+    stop = threading.Event()
+    result = {}
+    scan = threading.Thread(
+        target=lambda: result.setdefault("written", simulate_scan(write_sessions, task_id, stop))
+    )
+    scan.start()
+    timer = threading.Timer(seconds, stop.set)
+    timer.start()
+    latencies = measure_reads(read_sessions, task_id, seed_count, stop)
+    scan.join()
+
+    writer.dispose()
+    reader.dispose()
+    return latencies, result.get("written", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描写入期间的接口查询延迟基准测试")
+    parser.add_argument("--seed", type=int, default=20000, help="初始图片记录数")
+    parser.add_argument("--seconds", type=float, default=10, help="每种模式的测试时长")
+    args = parser.parse_args()
+
+    print(f"{'模式':<8}{'查询次数':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}{'扫描写入':>10}")
+    for mode in ("legacy", "wal"):
+        latencies, written = run(mode, args.seed, args.seconds)
+        print(
+            f"{mode:<8}{len(latencies):>10}"
+            f"{percentile(latencies, 0.5):>10.2f}{percentile(latencies, 0.95):>10.2f}"
+            f"{percentile(latencies, 0.99):>10.2f}{max(latencies):>10.2f}{written:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+解码执行方式基准测试
+
+分别生成小尺寸 PNG 截图和大尺寸 JPEG 照片，对比 process / thread / hybrid
+三种执行方式的吞吐量（files/sec）。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_executor --workers 4
+    python -m benchmarks.bench_executor --png 400 --jpeg 40 --backends thread,process
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from app.core.pipeline import EXECUTOR_BACKENDS, iter_hash_results
+
+
+def make_screenshots(directory: str, count: int, size=(1280, 800)):
+    """生成类似界面截图的 PNG：大面积纯色块和文字行"""
+    rng = random.Random(1)
+    paths = []
+    for i in range(count):
+        img = Image.new("RGB", size, (245, 245, 245))
+        draw = ImageDraw.Draw(img)
+        for _ in range(30):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.rectangle([x, y, x + rng.randrange(40, 400), y + rng.randrange(10, 60)], fill=color)
+        path = os.path.join(directory, f"screenshot_{i}.png")
+        img.save(path)
+        paths.append(path)
+    return paths
+
+
+def make_photos(directory: str, count: int, size=(4000, 3000)):
+    """生成大尺寸 JPEG：带噪声的渐变，接近相机照片的解码开销"""
+    rng = random.Random(2)
+    base = Image.effect_noise(size, 64).convert("RGB")
+    paths = []
+    for i in range(count):
+        tint = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        img = Image.blend(base, tint, 0.5)
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        img.save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def measure(paths, backend: str, workers: int) -> float:
+    """返回 files/sec"""
+    start = time.perf_counter()
+    processed = sum(1 for _, result, _ in iter_hash_results(paths, backend, workers) if result)
+    elapsed = time.perf_counter() - start
+    if processed != len(paths):
+        print(f"  警告: {backend} 仅成功处理 {processed}/{len(paths)} 个文件")
+    return len(paths) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解码执行方式基准测试")
+    parser.add_argument("--png", type=int, default=200, help="PNG 截图数量")
+    parser.add_argument("--jpeg", type=int, default=24, help="大尺寸 JPEG 数量")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="工作进程/线程数")
+    parser.add_argument("--backends", default=",".join(EXECUTOR_BACKENDS), help="逗号分隔的执行方式")
+    args = parser.parse_args()
+
+    backends = args.backends.split(",")
+    with tempfile.TemporaryDirectory() as tmp:
+        datasets = {
+            f"PNG 截图 x{args.png}": make_screenshots(tmp, args.png),
+            f"JPEG 12MP x{args.jpeg}": make_photos(tmp, args.jpeg),
+        }
+
+        print(f"工作单元数: {args.workers}")
+        print(f"{'数据集':<20}" + "".join(f"{b:>12}" for b in backends))
+        for name, paths in datasets.items():
+            rates = [measure(paths, backend, args.workers) for backend in backends]
+            print(f"{name:<20}" + "".join(f"{rate:>12.1f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
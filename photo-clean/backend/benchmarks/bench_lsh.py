@@ -0,0 +1,99 @@
+"""
+LSH 近似聚类基准测试
+
+对比精确模式与不同 bands/rows 配置下 LSH 模式的耗时与召回率。
+召回率按“精确结果中同组的图片对，在 LSH 结果中仍同组”的比例计算。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.bench_lsh --size 20000
+    python -m benchmarks.bench_lsh --index /data/db/photo_clean.idx --size 50000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.core.hash_index import load_hash_index, write_hash_index
+from app.core.similarity import find_similar_groups_indexed, find_similar_groups_lsh
+
+
+def synthetic_hashes(size: int, seed: int = 42) -> np.ndarray:
+    """生成带近似重复簇的随机哈希：约一半图片属于 2-6 张的簇，簇内翻转 0-12 个比特"""
+    rng = np.random.default_rng(seed)
+    hashes = []
+    while len(hashes) < size:
+        base = int(rng.integers(0, 2 ** 63, dtype=np.uint64)) | (int(rng.integers(0, 2)) << 63)
+        hashes.append(base)
+        if rng.random() < 0.5:
+            for _ in range(int(rng.integers(1, 6))):
+                flipped = base
+                for bit in rng.choice(64, size=int(rng.integers(0, 13)), replace=False):
+                    flipped ^= 1 << int(bit)
+                hashes.append(flipped)
+    hashes = np.array(hashes[:size], dtype=np.uint64)
+    return hashes[rng.permutation(size)]
+
+
+def grouped_pairs(groups) -> set:
+    """展开为同组图片对集合"""
+    pairs = set()
+    for group in groups:
+        members = sorted(group)
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pairs.add((a, b))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LSH 近似聚类基准测试")
+    parser.add_argument("--size", type=int, default=20000, help="样本图片数")
+    parser.add_argument("--threshold", type=int, default=10, help="相似度阈值")
+    parser.add_argument("--index", help="使用已有哈希索引文件抽样，默认生成合成数据")
+    parser.add_argument(
+        "--configs", default="16x12,32x16,32x20,64x20",
+        help="逗号分隔的 bandsxrows 配置"
+    )
+    args = parser.parse_args()
+
+    if args.index:
+        source = load_hash_index(args.index)
+        if source is None:
+            raise SystemExit(f"无法打开索引: {args.index}")
+        rng = np.random.default_rng(0)
+        size = min(args.size, len(source))
+        rows = np.sort(rng.choice(len(source), size=size, replace=False))
+        hashes = np.asarray(source.hashes[rows])
+    else:
+        hashes = synthetic_hashes(args.size)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, "sample.idx")
+        write_hash_index(index_path, np.arange(len(hashes)), hashes)
+        index = load_hash_index(index_path)
+
+        start = time.perf_counter()
+        exact = find_similar_groups_indexed(index, args.threshold)
+        exact_time = time.perf_counter() - start
+
+    exact_pairs = grouped_pairs(exact)
+    print(f"样本 {len(hashes)} 张, 阈值 {args.threshold}")
+    print(f"{'模式':<12}{'耗时(s)':>10}{'组数':>8}{'召回率':>10}{'加速比':>8}")
+    print(f"{'exact':<12}{exact_time:>10.3f}{len(exact):>8}{1.0:>10.3f}{1.0:>8.1f}")
+
+    for config in args.configs.split(","):
+        bands, rows = (int(v) for v in config.split("x"))
+        start = time.perf_counter()
+        groups = find_similar_groups_lsh(hashes, args.threshold, bands, rows)
+        elapsed = time.perf_counter() - start
+
+        found = grouped_pairs(groups)
+        recall = len(exact_pairs & found) / len(exact_pairs) if exact_pairs else 1.0
+        speedup = exact_time / elapsed if elapsed else float("inf")
+        print(f"{'lsh ' + config:<12}{elapsed:>10.3f}{len(groups):>8}{recall:>10.3f}{speedup:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
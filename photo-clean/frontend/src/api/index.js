@@ -38,11 +38,44 @@ export const scanAPI = {
     return api.get(`/scan/progress/${taskId}`)
   },
 
-  // 获取相似图片组（支持分页）
-  getSimilarGroups(taskId, page = 1, pageSize = 100) {
+  // 获取相似图片组（支持分页，threshold 为空时使用扫描时的阈值，folder 为空时不按文件夹筛选，
+  // includeMatrix 为 true 时附带组内完整距离矩阵）
+  getSimilarGroups(taskId, page = 1, pageSize = 100, threshold = null, folder = null, includeMatrix = false) {
     return api.get(`/scan/groups/${taskId}`, {
-      params: { page, page_size: pageSize }
+      params: {
+        page,
+        page_size: pageSize,
+        threshold: threshold ?? undefined,
+        folder: folder ?? undefined,
+        include_matrix: includeMatrix || undefined
+      }
     })
+  },
+
+  // 获取文件夹重复统计（parent 为空时返回全部文件夹，否则只返回其直接子文件夹）
+  getFolderStats(taskId, parent = null) {
+    return api.get(`/scan/groups/${taskId}/folders`, {
+      params: { parent: parent ?? undefined }
+    })
+  },
+
+  // 获取相似组缩略图联系表布局（每张图片的坐标，联系表 JPEG 的地址为 image_url）
+  getContactSheet(taskId, page = 1, pageSize = 50, threshold = null, tileSize = 200) {
+    return api.get(`/scan/groups/${taskId}/contact-sheet`, {
+      params: { page, page_size: pageSize, threshold: threshold ?? undefined, tile_size: tileSize }
+    })
+  },
+
+  // 按保留策略批量处理全部相似组（dryRun 为 true 时只返回统计）
+  resolveGroups(taskId, policy = 'suggested', dryRun = false, threshold = null) {
+    return api.post(`/scan/groups/${taskId}/resolve`, {
+      policy, dry_run: dryRun, threshold: threshold ?? undefined
+    })
+  },
+
+  // 获取批量处理进度
+  getResolveProgress(jobId) {
+    return api.get(`/scan/resolve/${jobId}`)
   }
 }
 
@@ -66,6 +99,22 @@ export const imageAPI = {
   // 获取回收站信息
   getTrashInfo() {
     return api.get('/images/trash-info')
+  },
+
+  // 查找与指定图片相似的图片
+  findSimilar(filePath, k = 20, maxDistance = 10) {
+    return api.get('/images/similar', {
+      params: { file_path: filePath, k, max_distance: maxDistance }
+    })
+  },
+
+  // 上传图片查找相似图片
+  findSimilarByUpload(file, k = 20, maxDistance = 10) {
+    const formData = new FormData()
+    formData.append('file', file)
+    return api.post('/images/similar', formData, {
+      params: { k, max_distance: maxDistance }
+    })
   }
 }
 